@@ -1,25 +1,28 @@
 import argparse
-import pickle
+import itertools
 
 import numpy as np
 from group_affiliations import get_affiliation_groups, mapping_entities
-from analysis import full_field_name
-from parse_mag import Paper, PaperAuthor, Affiliation
-import matplotlib.pyplot as plt
-import networkx as nx
+from analysis import field_mask, year_span, year_slice, year_prefix_sums, add_year_arguments, year_params, load_corpus
+from corpus_store import as_store
+import cache
 
-def author_group_name(author_group, newline=False):
+def author_group_name(author_group, newline=False, names=None):
+    names = mapping_entities_binary if names is None else names
     name = ""
     for i, ag_idx in enumerate(author_group):
         if i > 0:
             if newline:
                 name += "\n"
             name += "&"
-        # name += mapping_entities[ag_idx]
-        name += mapping_entities_binary[ag_idx]
+        name += names[ag_idx]
     return name
 
 mapping_entities_binary = {1: "Academia", 3: "Industry"}
+mapping_entities_title = {k: v.title() for k, v in mapping_entities.items()}
+
+# group universities with institutes (and the few fetched affiliations of unknown type)
+ACADEMIA_INDUSTRY = {0: 1, 2: 1}
 
 # copied from: https://stackoverflow.com/a/70245742
 def my_draw_networkx_edge_labels(
@@ -123,48 +126,45 @@ def my_draw_networkx_edge_labels(
     else:
         labels = edge_labels
     text_items = {}
-    for (n1, n2), label in labels.items():
-        (x1, y1) = pos[n1]
-        (x2, y2) = pos[n2]
-        (x, y) = (
-            x1 * label_pos + x2 * (1.0 - label_pos),
-            y1 * label_pos + y2 * (1.0 - label_pos),
-        )
-        pos_1 = ax.transData.transform(np.array(pos[n1]))
-        pos_2 = ax.transData.transform(np.array(pos[n2]))
-        linear_mid = 0.5*pos_1 + 0.5*pos_2
-        d_pos = pos_2 - pos_1
-        rotation_matrix = np.array([(0,1), (-1,0)])
-        ctrl_1 = linear_mid + rad*rotation_matrix@d_pos
-        ctrl_mid_1 = 0.5*pos_1 + 0.5*ctrl_1
-        ctrl_mid_2 = 0.5*pos_2 + 0.5*ctrl_1
-        bezier_mid = 0.5*ctrl_mid_1 + 0.5*ctrl_mid_2
-        (x, y) = ax.transData.inverted().transform(bezier_mid)
-
-        if rotate:
-            # in degrees
-            angle = np.arctan2(y2 - y1, x2 - x1) / (2.0 * np.pi) * 360
-            # make label orientation "right-side-up"
-            if angle > 90:
-                angle -= 180
-            if angle < -90:
-                angle += 180
-            # transform data coordinate angle to screen coordinate angle
-            xy = np.array((x, y))
-            trans_angle = ax.transData.transform_angles(
-                np.array((angle,)), xy.reshape((1, 2))
-            )[0]
-        else:
-            trans_angle = 0.0
-        # use default box of white with white border
-        if bbox is None:
-            bbox = dict(boxstyle="round", ec=(1.0, 1.0, 1.0), fc=(1.0, 1.0, 1.0))
+    edges = list(labels)
+    if len(edges) == 0:
+        return text_items
+    p1 = np.array([pos[n1] for n1, _ in edges], dtype=float)
+    p2 = np.array([pos[n2] for _, n2 in edges], dtype=float)
+    # bezier midpoints of all edges with one transform round trip
+    pos_1 = ax.transData.transform(p1)
+    pos_2 = ax.transData.transform(p2)
+    linear_mid = 0.5*pos_1 + 0.5*pos_2
+    d_pos = pos_2 - pos_1
+    rotation_matrix = np.array([(0,1), (-1,0)])
+    ctrl_1 = linear_mid + rad*d_pos@rotation_matrix.T
+    ctrl_mid_1 = 0.5*pos_1 + 0.5*ctrl_1
+    ctrl_mid_2 = 0.5*pos_2 + 0.5*ctrl_1
+    bezier_mid = 0.5*ctrl_mid_1 + 0.5*ctrl_mid_2
+    xy = ax.transData.inverted().transform(bezier_mid)
+
+    if rotate:
+        # in degrees
+        angle = np.arctan2(p2[:, 1] - p1[:, 1], p2[:, 0] - p1[:, 0]) / (2.0 * np.pi) * 360
+        # make label orientation "right-side-up"
+        angle = np.where(angle > 90, angle - 180, angle)
+        angle = np.where(angle < -90, angle + 180, angle)
+        # transform data coordinate angle to screen coordinate angle
+        trans_angle = ax.transData.transform_angles(angle, xy)
+    else:
+        trans_angle = np.zeros(len(edges))
+    # use default box of white with white border
+    if bbox is None:
+        bbox = dict(boxstyle="round", ec=(1.0, 1.0, 1.0), fc=(1.0, 1.0, 1.0))
+
+    for e, (n1, n2) in enumerate(edges):
+        label = labels[(n1, n2)]
         if not isinstance(label, str):
             label = str(label)  # this makes "1" and 1 labeled the same
 
         t = ax.text(
-            x,
-            y,
+            xy[e, 0],
+            xy[e, 1],
             label,
             size=font_size,
             color=font_color,
@@ -173,7 +173,7 @@ def my_draw_networkx_edge_labels(
             alpha=alpha,
             horizontalalignment=horizontalalignment,
             verticalalignment=verticalalignment,
-            rotation=trans_angle,
+            rotation=trans_angle[e],
             transform=ax.transData,
             bbox=bbox,
             zorder=1,
@@ -192,61 +192,124 @@ def my_draw_networkx_edge_labels(
 
     return text_items
 
-# analyze citations between different affiliation groups
+# author groups of each paper as a bitmask, bit b is set when an author belongs to groups[b];
+# 0 for papers without authors or with an author we have no grouping information for
+def paper_group_masks(store, group_of_affiliation, groups):
+    affiliation_bits = np.zeros(store.num_affiliations, dtype=np.int64)
+    for bit, group in enumerate(groups):
+        affiliation_bits[group_of_affiliation == group] = 1 << bit
+
+    paper = store.author_paper()
+    affiliation = np.asarray(store.author_affiliation)
+    author_bits = np.where(affiliation >= 0, affiliation_bits[affiliation], 0)
+    masks = np.zeros(store.num_papers, dtype=np.int64)
+    np.bitwise_or.at(masks, paper, author_bits)
+    # don't have sufficient affiliation info for one of the authors
+    masks[np.bincount(paper[author_bits == 0], minlength=store.num_papers) > 0] = 0
+    return masks
+
+
+# group of every affiliation (0 for none) after merge_groups maps group values onto each other,
+# as a list, the form the cached counts are keyed by
+def merged_affiliation_groups(store, affiliation_idx, affiliation_group, merge_groups=ACADEMIA_INDUSTRY):
+    group_of_affiliation = np.zeros(store.num_affiliations, dtype=np.int64)
+    group_of_affiliation[np.asarray(affiliation_idx, dtype=np.int64)] = [merge_groups.get(g, g) for g in affiliation_group]
+    return group_of_affiliation.tolist()
+
+
+# the groups and every combination of them (e.g. [(1,), (2,), (3,), (1,2), (1,3), (2,3), (1,2,3)])
+def group_combinations(group_of_affiliation):
+    groups = sorted(set(group_of_affiliation) - {0})
+    return groups, [c for size in range(1, len(groups) + 1) for c in itertools.combinations(groups, size)]
+
+
+# author group bitmask of every paper (see paper_group_masks), 0 outside fields; also returns
+# the bitmask of every combination of groups, in the order of group_combinations
+def grouped_paper_masks(store, group_of_affiliation, fields=[]):
+    groups, author_groups = group_combinations(group_of_affiliation)
+    masks = paper_group_masks(store, np.asarray(group_of_affiliation, dtype=np.int64), groups)
+    masks[~field_mask(store, fields)] = 0
+    combination_masks = [sum(1 << groups.index(g) for g in ag) for ag in author_groups]
+    return masks, combination_masks
+
+
+# citing and cited paper of every reference between two grouped papers
+def grouped_references(store, masks):
+    source = store.reference_source()
+    target = np.asarray(store.reference_indices)
+    keep = (masks[source] > 0) & (masks[target] > 0)
+    return source[keep], target[keep]
+
+
+# count citations between different affiliation groups, for every combination of groups
+# found among a paper's authors; merge_groups maps group values onto each other first
 # filter for papers in fields, if list is empty consider all fields
-def inter_group_citations(data, affiliation_idx, affiliation_group, fields=[]):
-    # group universities with institutes
-    affiliation_group = [3 if x == 3 else 1 for x in affiliation_group]
-
-    # filter for papers with affiliations that we have grouping information for
-    papers = data['papers']
-    affiliations = data['affiliations']
-    idx_to_afg = {}
-    idx_to_id = {}
-    id_to_idx = {}
-    filtered_papers = []
-    # author_groups = [(1,), (2,), (3,), (1,2), (1,3), (2,3), (1,2,3)] # different combinations of papers authors
-    author_groups = [(1,), (3,), (1, 3)]  # different combinations of papers authors
-    author_group_to_idx = {}
-    for idx, ag in enumerate(author_groups):
-        author_group_to_idx[ag] = idx
+# from_year and to_year restrict the citing papers
+def group_citation_counts(data, affiliation_idx, affiliation_group, fields=[], merge_groups=ACADEMIA_INDUSTRY,
+                          from_year=None, to_year=None):
+    store = as_store(data)
+    group_of_affiliation = merged_affiliation_groups(store, affiliation_idx, affiliation_group, merge_groups)
+    _, author_groups = group_combinations(group_of_affiliation)
+    if from_year is not None or to_year is not None:
+        citations, author_group_count = _yearly_group_citation_counts(store, group_of_affiliation, fields)
+        # any year range is the difference of two prefix sums
+        lo, hi = year_slice(store, from_year, to_year)
+        return author_groups, citations[hi] - citations[lo], author_group_count[hi] - author_group_count[lo]
+    citations, author_group_count = _group_citation_counts(store, group_of_affiliation, fields)
+    return author_groups, citations, author_group_count
+
+
+# citations between and paper counts of the combinations of groups of group_of_affiliation
+@cache.cached
+def _group_citation_counts(data, group_of_affiliation, fields=[]):
+    store = as_store(data)
+    masks, combination_masks = grouped_paper_masks(store, group_of_affiliation, fields)
+
+    # (citing mask, cited mask) of every reference between two grouped papers
+    source, target = grouped_references(store, masks)
+    num_masks = 1 << len(group_combinations(group_of_affiliation)[0])
+    citations = np.bincount(masks[source] * num_masks + masks[target], minlength=num_masks * num_masks)
+    citations = citations.reshape(num_masks, num_masks)
+    author_group_count = np.bincount(masks[masks > 0], minlength=num_masks)
+
+    citations = citations[np.ix_(combination_masks, combination_masks)].astype(np.float64)
+    return citations, author_group_count[combination_masks].astype(np.float64)
+
+
+# group_citation_counts split by the year of the citing paper, as prefix sums over the years:
+# citations[k] and author_group_count[k] hold the counts of papers published before year_span(store)[0] + k
+def yearly_group_citation_counts(data, affiliation_idx, affiliation_group, fields=[], merge_groups=ACADEMIA_INDUSTRY):
+    store = as_store(data)
+    group_of_affiliation = merged_affiliation_groups(store, affiliation_idx, affiliation_group, merge_groups)
+    _, author_groups = group_combinations(group_of_affiliation)
+    return (author_groups, *_yearly_group_citation_counts(store, group_of_affiliation, fields))
+
+
+@cache.cached
+def _yearly_group_citation_counts(data, group_of_affiliation, fields=[]):
+    store = as_store(data)
+    masks, combination_masks = grouped_paper_masks(store, group_of_affiliation, fields)
+
+    first, num_years = year_span(store)
+    year = np.asarray(store.paper_year, dtype=np.int64)
+    source, target = grouped_references(store, masks)
+    keep = year[source] >= 0
+    source, target = source[keep], target[keep]
+    num_masks = 1 << len(group_combinations(group_of_affiliation)[0])
+    key = ((year[source] - first) * num_masks + masks[source]) * num_masks + masks[target]
+    citations = np.bincount(key, minlength=num_years * num_masks * num_masks)
+    citations = citations.reshape(num_years, num_masks, num_masks)
+    counted = (masks > 0) & (year >= 0)
+    author_group_count = np.bincount(
+        (year[counted] - first) * num_masks + masks[counted], minlength=num_years * num_masks
+    ).reshape(num_years, num_masks)
+
+    citations = citations[:, combination_masks][:, :, combination_masks]
+    return year_prefix_sums(citations), year_prefix_sums(author_group_count[:, combination_masks])
+
+
+def print_group_citations(author_groups, citations, author_group_count, names=None):
     num_groups = len(author_groups)
-    for idx, id in enumerate(affiliations.keys()):
-        idx_to_id[idx] = id
-        id_to_idx[id] = idx
-    for idx, ag in zip(affiliation_idx, affiliation_group):
-        idx_to_afg[idx] = ag
-
-    papers_analyzed = 0
-    paper_author_group = {}
-    for paper in papers.values():
-        author_group = set()
-        author_aids = [author.affiliation_id for author in paper.authors]
-        skip_paper = any(id not in id_to_idx or id_to_idx[id] not in idx_to_afg for id in author_aids)
-        skip_field = len(fields) > 0 and full_field_name[paper.field] not in fields
-        if skip_paper or skip_field:
-            # don't have sufficient affiliation info for one of the authors
-            continue
-        papers_analyzed += 1
-        for aid in author_aids:
-            author_group.add(idx_to_afg[id_to_idx[aid]])
-
-        paper_author_group[paper.id] = tuple(author_group)
-
-    citations = np.zeros((num_groups, num_groups)) # how many times one group cites another
-    author_group_count = np.zeros(num_groups) # how many citations of each author group
-    for paper in papers.values():
-        if paper.id not in paper_author_group:
-            continue
-        citing_author_group = paper_author_group[paper.id]
-        group1 = author_group_to_idx[citing_author_group]
-        author_group_count[group1] += 1
-        for referred_paper in paper.referred_papers:
-            if referred_paper.id not in paper_author_group:
-                continue
-            cited_author_group = paper_author_group[referred_paper.id]
-            group2 = author_group_to_idx[cited_author_group]
-            citations[group1][group2] += 1
     citation_proportion = citations / np.sum(citations, axis=1).reshape(-1, 1)
     total_citations = np.sum(citations, axis=0)
     for i in range(num_groups):
@@ -254,18 +317,30 @@ def inter_group_citations(data, affiliation_idx, affiliation_group, fields=[]):
             continue
         citing_group = author_groups[i]
         print("=============")
-        print(f"{author_group_name(citing_group)}, Paper Count: {author_group_count[i]}, Proportion: {100 * author_group_count[i] / np.sum(author_group_count)}%"
+        print(f"{author_group_name(citing_group, names=names)}, Paper Count: {author_group_count[i]}, Proportion: {100 * author_group_count[i] / np.sum(author_group_count)}%"
               f", Total Citations: {total_citations[i]}, Proportion: {100 * total_citations[i] / np.sum(citations)}%")
         for j in range(num_groups):
             cited_group = author_groups[j]
             if citations[i][j] == 0:
                 continue
-            print(f"{author_group_name(citing_group)} -> {author_group_name(cited_group)}, Count: {citations[i][j]}, Proportion: {100* citation_proportion[i][j]}%")
+            print(f"{author_group_name(citing_group, names=names)} -> {author_group_name(cited_group, names=names)}, Count: {citations[i][j]}, Proportion: {100* citation_proportion[i][j]}%")
+
+
+def plot_group_citations(author_groups, citations, names=None):
+    import matplotlib
+    import networkx as nx
+    from network_drawing import new_figure, cached_layout, draw_edges
+
+    num_groups = len(author_groups)
+    citation_proportion = citations / np.sum(citations, axis=1).reshape(-1, 1)
+    total_citations = np.sum(citations, axis=0)
 
     # plot
     figsize = 8
-    node_color = ["blue", "red", "green"]
-    fig, ax = plt.subplots(1, 1, figsize=(figsize, figsize))
+    # a colour for each combination of groups, however many groups there are
+    colormap = matplotlib.colormaps["turbo"].resampled(num_groups)
+    node_color = [colormap(i) for i in range(num_groups)]
+    fig, ax = new_figure(figsize)
     edge_weights = 3.0 * citation_proportion
     edge_labels = {}
     # edge_weights = 3.0 * citations / citations.max()
@@ -280,22 +355,23 @@ def inter_group_citations(data, affiliation_idx, affiliation_group, fields=[]):
             edge_labels[(i, j)] = f"{100 * citation_proportion[i][j]:.0f}%"
 
     # prob want to group institute with university or company to make easier to see visualization
-    pos = nx.spring_layout(G)
+    pos = cached_layout(G, [author_group_name(ag, names=names) for ag in author_groups])
     nx.draw_networkx_nodes(G,
        pos,
-        dict(zip(range(num_groups), [author_group_name(author_groups[i], newline=True) for i in range(num_groups)])),
+        dict(zip(range(num_groups), [author_group_name(author_groups[i], newline=True, names=names) for i in range(num_groups)])),
        # node_color=["blue" for _ in range(num_groups)],
        node_color=node_color,
        node_size=node_size,
        alpha=0.4,
+       ax=ax,
     )
 
-    for edge in G.edges(data='weight'):
-        # edge_color = colors["edge"][tuple(affiliation_group[top_k_idx[list(edge[:2])]])]
-        nx.draw_networkx_edges(G, pos, edgelist=[edge], width=edge[2], alpha=1, arrowsize=10, edge_color=node_color[edge[0]], connectionstyle='arc3, rad = 0.1')
-    # nx.draw(G, pos, with_labels=True, connectionstyle='arc3, rad = 0.1')
+    edges = list(G.edges(data='weight'))
+    draw_edges(ax, pos, [e[:2] for e in edges], [e[2] for e in edges], [node_color[e[0]] for e in edges],
+               node_size=node_size, arrowsize=10, rad=0.1)
     my_draw_networkx_edge_labels(
         G, pos,
+        ax=ax,
         edge_labels=edge_labels,
         font_color='black',
         rotate=False,
@@ -304,20 +380,36 @@ def inter_group_citations(data, affiliation_idx, affiliation_group, fields=[]):
         alpha=1.0,
     )
     for i, ag in enumerate(author_groups):
-        ax.plot([0], [0], color=node_color[i], label=author_group_name(ag))
+        ax.plot([0], [0], color=node_color[i], label=author_group_name(ag, names=names))
 
     def nudge(pos, x_shift, y_shift):
         return {n: (x + x_shift, y + y_shift) for n, (x, y) in pos.items()}
 
     pos_nodes = nudge(pos, 0, -0.13)
-    nx.draw_networkx_labels(G, pos=pos_nodes, labels=dict(zip(range(num_groups), [author_group_name(author_groups[i], newline=True) for i in range(num_groups)]))
-                            , font_size=14, font_weight="bold")
-    plt.legend(loc="lower right")
-    plt.show()
-    plt.savefig("aff_int_vis.png")
+    nx.draw_networkx_labels(G, pos=pos_nodes, labels=dict(zip(range(num_groups), [author_group_name(author_groups[i], newline=True, names=names) for i in range(num_groups)]))
+                            , font_size=14, font_weight="bold", ax=ax)
+    ax.legend(loc="lower right")
+    fig.savefig("aff_int_vis.png")
 
 
-if __name__ == "__main__":
+# analyze citations between different affiliation groups
+# filter for papers in fields, if list is empty consider all fields
+# all_groups keeps universities, institutes and companies apart instead of academia vs industry
+# from_year and to_year restrict the citing papers
+def inter_group_citations(data, affiliation_idx, affiliation_group, fields=[], all_groups=False, plot=True,
+                          from_year=None, to_year=None):
+    merge_groups = {} if all_groups else ACADEMIA_INDUSTRY
+    names = mapping_entities_title if all_groups else mapping_entities_binary
+    author_groups, citations, author_group_count = group_citation_counts(
+        data, affiliation_idx, affiliation_group, fields, merge_groups, from_year, to_year
+    )
+    print_group_citations(author_groups, citations, author_group_count, names)
+    if plot:
+        plot_group_citations(author_groups, citations, names)
+    return author_groups, citations, author_group_count
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser()
 
     # shared parameters
@@ -328,8 +420,29 @@ if __name__ == "__main__":
         help="Directory where data.pkl and affiliation_type_raw.pkl resides",
     )
     parser.add_argument("-f", "--fields", nargs="+", default=[])
-    args = parser.parse_args()
-    with open(f"{args.data_dir}/data.pkl", "rb") as fh:
-        data = pickle.load(fh)
-    idx, _, affiliation_group = get_affiliation_groups(args.data_dir)
-    inter_group_citations(data, idx, affiliation_group, fields=args.fields)
+    parser.add_argument("-a", "--all_groups", action="store_true", help="Keep universities, institutes and companies apart")
+    parser.add_argument("--no_plot", action="store_true", help="Only print the citation counts")
+    parser.add_argument("-s", "--server", default=None, help="URL of a running server.py to query instead")
+    add_year_arguments(parser)
+    cache.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.server:
+        from server import query
+        result = query(args.server, "group_citations", fields=args.fields, all_groups=int(args.all_groups),
+                       **year_params(args))
+        names = mapping_entities_title if args.all_groups else mapping_entities_binary
+        author_groups = [tuple(ag) for ag in result["author_groups"]]
+        citations = np.array(result["citations"])
+        print_group_citations(author_groups, citations, np.array(result["author_group_count"]), names)
+        if not args.no_plot:
+            plot_group_citations(author_groups, citations, names)
+    else:
+        cache.configure_from_args(args)
+        data = load_corpus(args.data_dir, args.fields)
+        idx, _, affiliation_group = get_affiliation_groups(args.data_dir, data)
+        inter_group_citations(data, idx, affiliation_group, fields=args.fields, all_groups=args.all_groups,
+                              plot=not args.no_plot, from_year=args.from_year, to_year=args.to_year)
+
+
+if __name__ == "__main__":
+    main()
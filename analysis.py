@@ -1,8 +1,14 @@
-import pickle
 import argparse
+import tempfile
+import threading
+import multiprocessing
 import numpy as np
+import scipy.sparse as sp
 
-from parse_mag import Paper, PaperAuthor, Affiliation
+import cache
+import instrumentation
+
+from corpus_store import CorpusStore, load_store, as_store, save_columns, STORE_VERSION
 
 # detailed descriptions: https://arxiv.org/archive/cs
 full_field_name = {
@@ -49,104 +55,569 @@ full_field_name = {
 }
 
 
-def citation_matrix_institutions(data, fields=[]):
-    papers = data["papers"]
-    affiliations = data["affiliations"]
-
-    num_affiliations = len(affiliations)
-    idx_to_affiliation = {}
-    affiliation_to_idx = {}
-    for idx, affiliation_id in enumerate(affiliations.keys()):
-        idx_to_affiliation[idx] = affiliation_id
-        affiliation_to_idx[affiliation_id] = idx
-
-    # citations[x][y] is the number of times affiliation x cites affiliation y
-    citations = np.zeros((num_affiliations, num_affiliations))
-    for paper in papers.values():
-        skip_field = len(fields) > 0 and full_field_name[paper.field] not in fields
-        if skip_field:
-            continue
-        paper_affiliations = set()
-
-        for author in paper.authors:
-            if author.affiliation is None:
-                continue
-            paper_affiliations.add(author.affiliation_id)
-
-        for referred_paper in paper.referred_papers:
-            skip_field = len(fields) > 0 and full_field_name[referred_paper.field] not in fields
-            if skip_field:
-                continue
-            reference_affiliations = set()
-            for referred_author in referred_paper.authors:
-                if referred_author.affiliation is None:
-                    continue
-                reference_affiliations.add(referred_author.affiliation_id)
-            for a1 in paper_affiliations:
-                for a2 in reference_affiliations:
-                    # affiliation a1 cites a2
-                    citations[affiliation_to_idx[a1]][affiliation_to_idx[a2]] += 1
+# papers whose field is one of fields (full field names), all papers if fields is empty
+def field_mask(store, fields=[]):
+    if len(fields) == 0:
+        return np.ones(store.num_papers, dtype=bool)
+    return np.isin(store.paper_field, field_indices(store, fields))
+
+
+# incidence[p][a] is 1 if paper p has an author affiliated with a, restricted to papers in mask
+def paper_affiliation_matrix(store, mask=None):
+    paper = store.author_paper()
+    affiliation = np.asarray(store.author_affiliation)
+    keep = affiliation >= 0
+    if mask is not None:
+        keep &= mask[paper]
+    incidence = sp.csr_matrix(
+        (np.ones(keep.sum()), (paper[keep], affiliation[keep])),
+        shape=(store.num_papers, store.num_affiliations),
+    )
+    # several authors of a paper can share an affiliation, count it once
+    incidence.data[:] = 1
+    return incidence
+
+
+# papers with a known year between from_year and to_year (inclusive, None for an open end),
+# all papers if neither is given
+def year_mask(store, from_year=None, to_year=None):
+    if from_year is None and to_year is None:
+        return np.ones(store.num_papers, dtype=bool)
+    year = np.asarray(store.paper_year)
+    mask = year >= 0
+    if from_year is not None:
+        mask &= year >= from_year
+    if to_year is not None:
+        mask &= year <= to_year
+    return mask
+
+
+# first year and number of years spanned by the papers with a known year
+def year_span(store):
+    year = np.asarray(store.paper_year)
+    year = year[year >= 0]
+    if len(year) == 0:
+        return 0, 0
+    return int(year.min()), int(year.max() - year.min() + 1)
+
+
+# rows (lo, hi) of the per-year prefix sums whose difference covers from_year..to_year
+def year_slice(store, from_year=None, to_year=None):
+    first, num_years = year_span(store)
+    lo = 0 if from_year is None else min(max(from_year - first, 0), num_years)
+    hi = num_years if to_year is None else min(max(to_year - first + 1, 0), num_years)
+    return lo, max(lo, hi)
+
+
+# prefix sums over the first axis of a per-year table (dense, or a sparse matrix with a row per
+# year): prefix[k] holds the sum of years 0..k-1, so any year range is the difference of two rows
+def year_prefix_sums(per_year):
+    num_years = per_year.shape[0]
+    if not sp.issparse(per_year):
+        prefix = np.zeros((num_years + 1,) + per_year.shape[1:])
+        np.cumsum(per_year, axis=0, out=prefix[1:])
+        return prefix
+
+    per_year = per_year.tocoo()
+    if per_year.nnz == 0:
+        return sp.csr_matrix((num_years + 1, per_year.shape[1]))
+    # running total of every column at each year it changes, which holds until its next change
+    order = np.lexsort((per_year.row, per_year.col))
+    year, col, value = per_year.row[order].astype(np.int64), per_year.col[order], per_year.data[order]
+    total = np.cumsum(value)
+    first = np.flatnonzero(np.r_[True, col[1:] != col[:-1]])
+    running = total - np.repeat(total[first] - value[first], np.diff(np.r_[first, len(col)]))
+    same_col = np.r_[col[1:] == col[:-1], False]
+    start = year + 1
+    end = np.where(same_col, np.r_[year[1:], 0] + 1, num_years + 1)
+    counts = end - start
+    rows = np.repeat(start - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    return sp.csr_matrix(
+        (np.repeat(running, counts), (rows, np.repeat(col, counts))), shape=(num_years + 1, per_year.shape[1])
+    )
+
+
+# references[p][q] is the number of times paper p refers to paper q, restricted to papers in mask
+# and to citing papers in source_mask
+def paper_reference_matrix(store, mask=None, source_mask=None):
+    source = store.reference_source()
+    target = np.asarray(store.reference_indices)
+    if mask is not None or source_mask is not None:
+        keep = np.ones(len(source), dtype=bool)
+        if mask is not None:
+            keep &= mask[source] & mask[target]
+        if source_mask is not None:
+            keep &= source_mask[source]
+        source, target = source[keep], target[keep]
+    return sp.csr_matrix(
+        (np.ones(len(source)), (source, target)),
+        shape=(store.num_papers, store.num_papers),
+    )
+
+
+# fields must be full field names, a misspelled one would silently select no papers
+def check_fields(fields):
+    unknown = set(fields) - set(full_field_name.values())
+    if unknown:
+        raise ValueError(f"Unknown fields {sorted(unknown)}")
+
+
+# indices (into store.fields) of the fields given by their full names
+def field_indices(store, fields):
+    check_fields(fields)
+    return [idx for idx, field in enumerate(store.fields) if full_field_name[field] in fields]
+
+
+# corpus of data_dir; when it is sharded and fields (full names) are given, only their shards are read
+def load_corpus(data_dir, fields=[]):
+    check_fields(fields)
+    return load_store(data_dir, [field for field, name in full_field_name.items() if name in fields])
+
+
+# guards the matrices built on first use and kept on the store, reentrant as building one may read another
+_memo_lock = threading.RLock()
+
+
+# compute(store) kept on the store as attribute name; built once, also when request threads of the
+# server ask for it at the same time
+def memoized(store, name, compute):
+    value = getattr(store, name, None)
+    if value is None:
+        with _memo_lock:
+            value = getattr(store, name, None)
+            if value is None:
+                value = compute(store)
+                setattr(store, name, value)
+    return value
+
+
+# citing and cited paper of the reference edges of the citing papers lo..hi-1 (all papers by default)
+def reference_edges(store, lo=0, hi=None):
+    hi = store.num_papers if hi is None else hi
+    indptr = np.asarray(store.reference_indptr)
+    source = np.repeat(np.arange(lo, hi), np.diff(indptr[lo:hi + 1]))
+    return source, np.asarray(store.reference_indices[indptr[lo]:indptr[hi]])
+
+
+# processes summing institution citations over ranges of citing papers, see sum_over_citing_papers
+_processes = 1
+
+# columns the citation counts read, the only ones written for processes when the store isn't on disk
+CITATION_COLUMNS = [
+    "paper_id",
+    "paper_field",
+    "paper_year",
+    "author_indptr",
+    "author_affiliation",
+    "affiliation_id",
+    "reference_indptr",
+    "reference_indices",
+]
+
+
+def configure_processes(processes):
+    global _processes
+    _processes = max(processes, 1)
+
+
+# corpus of the pool processes, memory-mapped from disk instead of pickled to them
+_process_store = None
+
+
+def _attach_store(path):
+    global _process_store
+    _process_store = CorpusStore.load(path)
+
+
+def _sum_range(task):
+    fn, args, lo, hi = task
+    return fn(_process_store, *args, lo=lo, hi=hi)
+
+
+def _add(pair):
+    return pair[0] + pair[1]
+
+
+# fn(store, *args, lo, hi) counts the citations of the citing papers lo..hi-1 as a sparse matrix;
+# with more than one process (configure_processes) the papers are split into ranges of about equal
+# numbers of references, one per process, and the partial counts are summed pairwise in the pool.
+# Counts are integers, so the sum is exact and equal to the serial fn(store, *args) whatever the order
+def sum_over_citing_papers(store, fn, *args):
+    if _processes <= 1:
+        return fn(store, *args)
+    indptr = np.asarray(store.reference_indptr)
+    splits = np.searchsorted(indptr, np.linspace(0, indptr[-1], _processes + 1)[1:-1])
+    bounds = np.unique(np.concatenate([[0], splits, [store.num_papers]]))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = store.path
+        if path is None:
+            path = tmp
+            save_columns(path, {name: store.columns[name] for name in CITATION_COLUMNS},
+                         {"version": STORE_VERSION, "fields": store.field_mapping})
+        # spawned, forking a server with request threads isn't safe
+        with multiprocessing.get_context("spawn").Pool(_processes, initializer=_attach_store, initargs=(path,)) as pool:
+            partials = pool.map(_sum_range, [(fn, args, lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:])])
+            while len(partials) > 1:
+                summed = pool.map(_add, list(zip(partials[0::2], partials[1::2])))
+                partials = summed + partials[2 * len(summed):]
+    return partials[0]
+
+
+# (citing field, cited field) of reference edges, one of len(store.fields) ** 2 keys
+def field_pair_keys(store, source, target):
+    num_fields = len(store.fields)
+    paper_field = np.asarray(store.paper_field, dtype=np.int64)
+    return paper_field[source] * num_fields + paper_field[target], num_fields * num_fields
+
+
+# year of the citing paper of reference edges counted from year_span(store)[0], -1 if it is unknown
+def citing_year_keys(store, source, target):
+    first, num_years = year_span(store)
+    year = np.asarray(store.paper_year, dtype=np.int64)[source]
+    return np.where(year >= 0, year - first, -1), num_years
+
+
+# institution citations of the reference edges grouped by keys(store, source, target): row k holds the
+# flattened (affiliation x affiliation) citations of the edges with key k, edges with a negative key are
+# left out; only the edges of the citing papers lo..hi-1
+def grouped_citation_tensor(store, keys, lo=0, hi=None):
+    num_affiliations = store.num_affiliations
+    incidence = paper_affiliation_matrix(store)
+    source, target = reference_edges(store, lo, hi)
+    key, num_keys = keys(store, source, target)
+
+    order = np.argsort(key, kind="stable")
+    bounds = np.searchsorted(key[order], np.arange(num_keys + 1))
+    rows, cols, values = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0)]
+    for k in np.where(np.diff(bounds) > 0)[0]:
+        edges = order[bounds[k]:bounds[k + 1]]
+        # citations between the affiliations of the citing and cited papers of these edges
+        key_citations = (incidence[source[edges]].T @ incidence[target[edges]]).tocoo()
+        rows.append(np.full(key_citations.nnz, k, dtype=np.int64))
+        cols.append(key_citations.row.astype(np.int64) * num_affiliations + key_citations.col)
+        values.append(key_citations.data)
+    return sp.csr_matrix(
+        (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(num_keys, num_affiliations * num_affiliations),
+    )
+
+
+# (num_affiliations x num_affiliations) sum of flattened rows of a citation tensor
+def unflatten_citations(rows, num_affiliations):
+    rows = rows.tocsr()
+    rows.eliminate_zeros()
+    citing, cited = np.divmod(rows.indices.astype(np.int64), num_affiliations)
+    citations = sp.csr_matrix((rows.data, (citing, cited)), shape=(num_affiliations, num_affiliations))
+    citations.sum_duplicates()
     return citations
 
 
-def citation_matrix_fields(data):
-    papers = data["papers"]
-    field_mapping = data["fields"]
+# institution citations split by (citing field, cited field): row f * num_fields + g holds the
+# flattened (affiliation x affiliation) citations from papers of field f to papers of field g
+@cache.cached
+def _field_citation_tensor(data):
+    return sum_over_citing_papers(as_store(data), grouped_citation_tensor, field_pair_keys)
 
-    num_fields = len(field_mapping)
-    field_to_idx = {v: k for k, v in enumerate(field_mapping.values())}
 
-    # citations[x][y] is the number of times field x cites field y
-    citations = np.zeros((num_fields, num_fields))
-    for paper in papers.values():
-        f1 = field_to_idx[paper.field]
-        for referred_paper in paper.referred_papers:
-            f2 = field_to_idx[referred_paper.field]
-            citations[f1][f2] += 1
+# built once per corpus and kept on the store for repeated field queries
+@instrumentation.timed
+def field_citation_tensor(data):
+    return memoized(as_store(data), "_field_citation_tensor", _field_citation_tensor)
+
+
+# sum of the tensor slices with both citing and cited field in field_idx
+def select_field_citations(tensor, field_idx, num_fields, num_affiliations):
+    field_idx = np.asarray(field_idx, dtype=np.int64)
+    pairs = (field_idx[:, None] * num_fields + field_idx[None, :]).ravel()
+    return unflatten_citations(tensor[pairs], num_affiliations)
+
+
+# prefix sums of the institution citations over the year of the citing paper: row k holds the
+# flattened (affiliation x affiliation) citations from papers published before year_span(store)[0] + k,
+# i.e. an entry per year for every pair of institutions cited by then
+@cache.cached
+def _year_citation_tensor(data):
+    return year_prefix_sums(sum_over_citing_papers(as_store(data), grouped_citation_tensor, citing_year_keys))
+
+
+# built on the first year range query and kept on the store for the next ones
+@instrumentation.timed
+def year_citation_tensor(data):
+    return memoized(as_store(data), "_year_citation_tensor", _year_citation_tensor)
 
-    import pdb
-    pdb.set_trace()
 
+@instrumentation.timed
+def citation_matrix_institutions(data, fields=[], from_year=None, to_year=None):
+    store = as_store(data)
+    years = from_year is not None or to_year is not None
+    if len(fields) > 0 and years:
+        # no precomputed table is split by both, mask the corpus instead
+        return _citation_matrix_institutions(store, fields, from_year, to_year)
+    if len(fields) > 0:
+        # any field subset is a sum of precomputed (citing field, cited field) slices
+        return select_field_citations(
+            field_citation_tensor(store), field_indices(store, fields), len(store.fields), store.num_affiliations
+        )
+    if years:
+        # any year range is the difference of two prefix sums
+        lo, hi = year_slice(store, from_year, to_year)
+        tensor = year_citation_tensor(store)
+        return unflatten_citations(tensor[hi] - tensor[lo], store.num_affiliations)
+    # built once per corpus and kept on the store, every unfiltered query reads it
+    return memoized(store, "_institution_citations", _citation_matrix_institutions)
+
+
+# from_year and to_year restrict the citing paper
+@cache.cached
+def _citation_matrix_institutions(data, fields=[], from_year=None, to_year=None):
+    return sum_over_citing_papers(as_store(data), institution_citations, fields, from_year, to_year)
+
+
+# citations[x][y] is the number of times affiliation x cites affiliation y in the references of the
+# citing papers lo..hi-1 that are in fields and published between from_year and to_year
+def institution_citations(store, fields=[], from_year=None, to_year=None, lo=0, hi=None):
+    hi = store.num_papers if hi is None else hi
+    mask = field_mask(store, fields)
+    incidence = paper_affiliation_matrix(store, mask)
+    source, target = reference_edges(store, lo, hi)
+    keep = mask[source] & mask[target] & year_mask(store, from_year, to_year)[source]
+    references = sp.csr_matrix(
+        (np.ones(keep.sum()), (source[keep] - lo, target[keep])),
+        shape=(hi - lo, store.num_papers),
+    )
+
+    citations = (incidence[lo:hi].T @ references @ incidence).tocsr()
+    citations.sum_duplicates()
     return citations
 
 
-def citations_between_institutions(data, top: int = 100):
-    citations = citation_matrix_institutions(data)
+# dense view of the (rows x cols) block of a sparse citation matrix, meant for small top-k slices
+def dense_submatrix(citations, rows, cols=None):
+    cols = rows if cols is None else cols
+    return citations[rows][:, cols].toarray()
 
-    # find most cited institutions
-    affiliations = list(data["affiliations"].values())
-    num_citations = citations.sum(axis=0).astype(int)
+
+# number of times each affiliation is cited
+def cited_counts(citations):
+    return np.asarray(citations.sum(axis=0)).ravel()
+
+
+# PageRank of the nodes of a weighted citation graph given as a sparse (citing x cited) matrix,
+# by power iteration: every node passes damping of its rank on to the nodes it cites in proportion
+# to the edge weights, nodes citing nothing spread theirs over all nodes
+def pagerank(adjacency, damping=0.85, tol=1e-10, max_iter=1000):
+    adjacency = sp.csr_matrix(adjacency, dtype=np.float64)
+    n = adjacency.shape[0]
+    if n == 0:
+        return np.zeros(0)
+    out_weight = np.asarray(adjacency.sum(axis=1)).ravel()
+    dangling = out_weight == 0
+    scale = np.divide(1.0, out_weight, out=np.zeros(n), where=~dangling)
+    # column stochastic transition matrix
+    transition = (sp.diags(scale) @ adjacency).T.tocsr()
+
+    rank = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        new_rank = damping * (transition @ rank + rank[dangling].sum() / n) + (1 - damping) / n
+        converged = np.abs(new_rank - rank).sum() < tol
+        rank = new_rank
+        if converged:
+            break
+    return rank
+
+
+# PageRank of the institutions in the institution citation graph, weighted by the citation counts;
+# self citations are left out so an institution can't raise its own rank
+@instrumentation.timed
+def institution_pagerank(data, fields=[], from_year=None, to_year=None, damping=0.85):
+    citations = citation_matrix_institutions(data, fields, from_year, to_year)
+    citations = (citations - sp.diags(citations.diagonal())).tocsr()
+    citations.eliminate_zeros()
+    return pagerank(citations, damping)
+
+
+# PageRank of the papers in the paper citation graph (papers in fields, citing papers published
+# between from_year and to_year), summed per institution with each paper's rank split evenly
+# between its institutions
+@instrumentation.timed
+def paper_pagerank_institutions(data, fields=[], from_year=None, to_year=None, damping=0.85):
+    return _paper_pagerank_institutions(as_store(data), fields, from_year, to_year, damping)
+
+
+@cache.cached
+def _paper_pagerank_institutions(data, fields=[], from_year=None, to_year=None, damping=0.85):
+    store = as_store(data)
+    mask = field_mask(store, fields)
+    papers = np.flatnonzero(mask)
+    references = paper_reference_matrix(store, mask, year_mask(store, from_year, to_year))
+    rank = np.zeros(store.num_papers)
+    rank[papers] = pagerank(references[papers][:, papers], damping)
+
+    incidence = paper_affiliation_matrix(store, mask)
+    num_affiliations = np.asarray(incidence.sum(axis=1)).ravel()
+    share = np.divide(rank, num_affiliations, out=np.zeros(store.num_papers), where=num_affiliations > 0)
+    return incidence.T @ share
+
+
+RANK_BY = ["citations", "pagerank", "paper_pagerank"]
+
+
+# score every institution is ranked by: the citations it receives, its PageRank in the institution
+# citation graph or the PageRank of its papers in the paper citation graph
+def institution_scores(data, rank_by="citations", fields=[], from_year=None, to_year=None):
+    if rank_by == "pagerank":
+        return institution_pagerank(data, fields, from_year, to_year)
+    if rank_by == "paper_pagerank":
+        return paper_pagerank_institutions(data, fields, from_year, to_year)
+    if rank_by == "citations":
+        return cited_counts(citation_matrix_institutions(data, fields, from_year, to_year))
+    raise ValueError(f"Unknown ranking {rank_by}, expected one of {RANK_BY}")
+
+
+@instrumentation.timed
+def citation_matrix_fields(data, from_year=None, to_year=None):
+    store = as_store(data)
+    if from_year is None and to_year is None:
+        # built once per corpus and kept on the store, like the institution matrix
+        return memoized(store, "_field_citations", _citation_matrix_fields)
+    lo, hi = year_slice(store, from_year, to_year)
+    prefix = year_field_citations(store)
+    return prefix[hi] - prefix[lo]
+
+
+@cache.cached
+def _citation_matrix_fields(data):
+    store = as_store(data)
+    num_fields = len(store.fields)
+
+    # field of the citing and of the cited paper of every reference edge
+    citing_field = np.asarray(store.paper_field, dtype=np.int64)[store.reference_source()]
+    cited_field = np.asarray(store.paper_field, dtype=np.int64)[store.reference_indices]
+
+    # citations[x][y] is the number of times field x cites field y
+    citations = np.bincount(citing_field * num_fields + cited_field, minlength=num_fields * num_fields)
+    return citations.reshape(num_fields, num_fields).astype(np.float64)
+
+
+# prefix sums of the field citations over the year of the citing paper: prefix[k] holds the
+# citations from papers published before year_span(store)[0] + k
+@cache.cached
+def _year_field_citations(data):
+    store = as_store(data)
+    num_fields = len(store.fields)
+    first, num_years = year_span(store)
+    source = store.reference_source()
+    year = np.asarray(store.paper_year, dtype=np.int64)[source]
+    paper_field = np.asarray(store.paper_field, dtype=np.int64)
+    keep = year >= 0
+
+    key = ((year[keep] - first) * num_fields + paper_field[source[keep]]) * num_fields
+    key += paper_field[np.asarray(store.reference_indices)[keep]]
+    per_year = np.bincount(key, minlength=num_years * num_fields * num_fields)
+    return year_prefix_sums(per_year.reshape(num_years, num_fields, num_fields))
+
+
+# built on the first year range query and kept on the store for the next ones
+@instrumentation.timed
+def year_field_citations(data):
+    return memoized(as_store(data), "_year_field_citations", _year_field_citations)
+
+
+# indices of the top largest values, ordered by value and then by index (both descending)
+def top_indices(values, top, *tie_breakers):
+    if 0 < top < len(values):
+        # argpartition finds the cut-off value, ties at the cut-off are all kept
+        threshold = values[np.argpartition(-values, top - 1)[top - 1]]
+        candidates = np.where(values >= threshold)[0]
+    else:
+        candidates = np.arange(len(values))
+    keys = [-t[candidates] for t in reversed(tie_breakers)] + [-values[candidates]]
+    return candidates[np.lexsort(keys)][:top]
+
+
+# most cited institutions as (citations, institution name), counting citations from papers
+# published between from_year and to_year; rank_by (see RANK_BY) ranks them by PageRank instead
+@instrumentation.timed
+def top_institutions(data, top: int = 100, fields=[], from_year=None, to_year=None, rank_by="citations"):
+    affiliation_names = as_store(data).affiliation_name
+    scores = institution_scores(data, rank_by, fields, from_year, to_year)
+    if rank_by == "citations":
+        scores = scores.astype(int)
     # argsort in descending order
-    sort_id = np.argsort(-num_citations)
+    sort_id = np.argsort(-scores)
+    return [(scores[idx].item(), affiliation_names[idx]) for idx in sort_id[:top]]
 
+
+def print_top_institutions(institutions, top: int = 100, rank_by="citations"):
     print(f"Top {top} Institutions")
-    for idx in sort_id[:top]:
-        print(f"Citations: {num_citations[idx]}, Insitution: {affiliations[idx].name}")
+    for score, name in institutions:
+        if rank_by == "citations":
+            print(f"Citations: {score}, Insitution: {name}")
+        else:
+            print(f"{rank_by}: {score:.6g}, Insitution: {name}")
 
 
-def citations_between_fields(data, top: int = 100):
-    # find most common inter field citations
-    citations = citation_matrix_fields(data)
-    idx_to_field = {k: v for k, v in enumerate(data["fields"].values())}
+def citations_between_institutions(data, top: int = 100, from_year=None, to_year=None, fields=[], rank_by="citations"):
+    # find most cited institutions
+    print_top_institutions(top_institutions(data, top, fields, from_year, to_year, rank_by), top, rank_by)
+
+
+# most common inter field citations as (citations, citing field, cited field)
+@instrumentation.timed
+def top_field_citations(data, top: int = 100, from_year=None, to_year=None):
+    citations = citation_matrix_fields(data, from_year, to_year)
+    idx_to_field = dict(enumerate(as_store(data).fields))
     i, j = [x.reshape(-1) for x in np.indices(citations.shape)]
     citations = citations.reshape(-1).astype(int)
 
     # keep the inter-field citations
     inter_idx = np.where(i != j)[0]
     citations, i, j = citations[inter_idx], i[inter_idx], j[inter_idx]
-    top_citation_patterns = list(zip(*[citations, i, j]))
-    top_citation_patterns.sort(reverse=True)
+    return [(int(citations[idx]), idx_to_field[i[idx]], idx_to_field[j[idx]]) for idx in top_indices(citations, top, i, j)]
+
 
+def print_field_citations(field_citations):
     print("Most common inter field citations")
-    for citations, f1, f2 in top_citation_patterns[:top]:
-        fn1 = idx_to_field[f1]
-        fn2 = idx_to_field[f2]
+    for citations, fn1, fn2 in field_citations:
         print(
-            f"Citations: {int(citations)}, {fn1} ({full_field_name[fn1]}) -> {fn2} ({full_field_name[fn2]})"
+            f"Citations: {citations}, {fn1} ({full_field_name[fn1]}) -> {fn2} ({full_field_name[fn2]})"
         )
 
 
-if __name__ == "__main__":
+def citations_between_fields(data, top: int = 100, from_year=None, to_year=None):
+    # find most common inter field citations
+    print_field_citations(top_field_citations(data, top, from_year, to_year))
+
+
+# command line arguments restricting the year of the citing papers
+def add_year_arguments(parser):
+    parser.add_argument("--from_year", "--from-year", type=int, default=None, help="First year of the citing papers")
+    parser.add_argument("--to_year", "--to-year", type=int, default=None, help="Last year of the citing papers")
+
+
+# command line argument choosing the institution score of the reports
+def add_rank_arguments(parser):
+    parser.add_argument("--rank_by", "--rank-by", choices=RANK_BY, default="citations",
+                        help="Rank institutions by citations received, institution PageRank or the PageRank of their papers")
+
+
+# command line argument for the processes computing the institution citation matrices
+def add_process_arguments(parser):
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Processes computing the institution citation matrices, each over a range of citing papers")
+
+
+# the year arguments that are set, as query parameters for the server
+def year_params(args):
+    return {k: v for k, v in [("from_year", args.from_year), ("to_year", args.to_year)] if v is not None}
+
+
+REPORTS = ["fields", "institutions"]
+
+
+# reports is the subset of REPORTS to print
+def main(argv=None, reports=REPORTS):
     parser = argparse.ArgumentParser()
 
     # shared parameters
@@ -154,10 +625,37 @@ if __name__ == "__main__":
         "-d",
         "--data_dir",
         default="data",
-        help="Directory where data.pkl resides",
+        help="Directory where data.pkl or the corpus store resides",
     )
-    args = parser.parse_args()
-    with open(f"{args.data_dir}/data.pkl", "rb") as fh:
-        data = pickle.load(fh)
-    citations_between_fields(data)
-    citations_between_institutions(data)
+    parser.add_argument("-t", "--top", default=100, type=int, help="Number of rows of each report")
+    parser.add_argument("-f", "--fields", nargs="+", default=[], help="Count only citations of papers in these fields (institutions)")
+    parser.add_argument("-s", "--server", default=None, help="URL of a running server.py to query instead")
+    add_year_arguments(parser)
+    add_rank_arguments(parser)
+    add_process_arguments(parser)
+    cache.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(argv)
+    instrumentation.configure_from_args(args)
+    if args.server:
+        from server import query
+        if "fields" in reports:
+            print_field_citations(query(args.server, "field_citations", top=args.top, **year_params(args)))
+        if "institutions" in reports:
+            institutions = query(args.server, "top_institutions", top=args.top, fields=args.fields, rank_by=args.rank_by,
+                                 **year_params(args))
+            print_top_institutions(institutions, args.top, args.rank_by)
+    else:
+        cache.configure_from_args(args)
+        configure_processes(args.processes)
+        # the field report needs every field
+        data = load_corpus(args.data_dir, [] if "fields" in reports else args.fields)
+        if "fields" in reports:
+            citations_between_fields(data, args.top, args.from_year, args.to_year)
+        if "institutions" in reports:
+            citations_between_institutions(data, args.top, args.from_year, args.to_year, args.fields, args.rank_by)
+    instrumentation.finish_from_args(args)
+
+
+if __name__ == "__main__":
+    main()
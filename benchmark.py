@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import platform
+import argparse
+import queue
+import resource
+import subprocess
+import multiprocessing
+
+from instrumentation import peak_rss_mb
+
+# Benchmarks the pipeline stages on synthetic data (see synthetic.py) at several scales.
+#
+#   python3 benchmark.py --scales 10000 100000 1000000 -o benchmark.json
+#
+# Every stage runs in its own freshly spawned process, so its peak RSS is its own and
+# nothing is shared between stages through memory or the lazily built matrices. The
+# results (runtime and peak RSS per scale and stage) are written as JSON.
+
+STAGES = ["parse", "load", "institutions", "fields", "groups"]
+
+
+# imports and inputs of a stage, returns the function running the stage itself
+def _setup_stage(stage, data_dir, workers):
+    if stage == "parse":
+        from parse_mag import parse_data
+
+        def run():
+            parse_data(data_dir, output_format="columnar", workers=workers, output_dir=data_dir)
+            return {}
+        return run
+
+    from corpus_store import load_store
+    if stage == "load":
+        def run():
+            store = load_store(data_dir)
+            return {"papers": store.num_papers, "authors": store.num_authors, "references": store.num_references}
+        return run
+
+    store = load_store(data_dir)
+    if stage == "institutions":
+        from analysis import citation_matrix_institutions, configure_processes
+        configure_processes(workers)
+        return lambda: {"nnz": int(citation_matrix_institutions(store).nnz)}
+    if stage == "fields":
+        from analysis import citation_matrix_fields
+        return lambda: {"citations": int(citation_matrix_fields(store).sum())}
+    if stage == "groups":
+        from group_affiliations import get_affiliation_groups
+        from affilation_interactions import group_citation_counts
+
+        def run():
+            idx, _, affiliation_group = get_affiliation_groups(data_dir, store)
+            _, citations, _ = group_citation_counts(store, idx, affiliation_group)
+            return {"citations": int(citations.sum())}
+        return run
+    raise ValueError(f"Unknown stage {stage}")
+
+
+def _run_stage(stage, data_dir, workers, results):
+    start = time.perf_counter()
+    run = _setup_stage(stage, data_dir, workers)
+    setup_seconds = time.perf_counter() - start
+    setup_rss = peak_rss_mb(resource.RUSAGE_SELF)
+
+    start = time.perf_counter()
+    summary = run()
+    results.put({
+        "seconds": time.perf_counter() - start,
+        # imports and loading the inputs
+        "setup_seconds": setup_seconds,
+        "peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF),
+        "setup_peak_rss_mb": setup_rss,
+        # e.g. the parse workers
+        "peak_rss_children_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+        **summary,
+    })
+
+
+# run stage in a spawned process and return its measurements
+def run_stage(stage, data_dir, workers=1):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_run_stage, args=(stage, data_dir, workers, results))
+    process.start()
+    # read the result before joining, the process only exits once its result is flushed to the queue
+    result = None
+    while result is None and (process.is_alive() or not results.empty()):
+        try:
+            result = results.get(timeout=1.0)
+        except queue.Empty:
+            pass
+    process.join()
+    if process.exitcode != 0 or result is None:
+        raise RuntimeError(f"Stage {stage} failed with exit code {process.exitcode}")
+    return result
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "commit": commit,
+    }
+
+
+def benchmark(scales, work_dir, stages=STAGES, workers=1, affiliations_per_paper=0.02, seed=0, **generator_args):
+    from synthetic import generate
+
+    results = []
+    for num_papers in scales:
+        data_dir = os.path.join(work_dir, f"papers_{num_papers}")
+        if not os.path.exists(os.path.join(data_dir, "paperReferences.txt")):
+            generate(data_dir, num_papers, max(int(affiliations_per_paper * num_papers), 10), seed=seed, **generator_args)
+        for stage in stages:
+            result = {"num_papers": num_papers, "stage": stage, "workers": workers, **run_stage(stage, data_dir, workers)}
+            print(f"{num_papers} papers, {stage}: {result['seconds']:.2f}s (setup {result['setup_seconds']:.2f}s), "
+                  f"peak RSS {result['peak_rss_mb']:.0f} MB", flush=True)
+            results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", type=int, nargs="+", default=[10000, 100000], help="Numbers of arxiv papers")
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+    parser.add_argument("-d", "--work_dir", default="benchmark", help="Directory for the generated data (reused across runs)")
+    parser.add_argument("-o", "--output", default="benchmark.json")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Workers of the parse stage and processes of the institutions stage")
+    parser.add_argument("--authors_per_paper", type=float, default=3.0)
+    parser.add_argument("--references_per_paper", type=float, default=10.0)
+    parser.add_argument("--citation_exponent", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    results = benchmark(
+        args.scales,
+        args.work_dir,
+        stages=args.stages,
+        workers=args.workers,
+        seed=args.seed,
+        authors_per_paper=args.authors_per_paper,
+        references_per_paper=args.references_per_paper,
+        citation_exponent=args.citation_exponent,
+    )
+    with open(args.output, "w") as fh:
+        json.dump({"environment": environment(), "results": results}, fh, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import os
+import io
+import sys
+import time
+import tempfile
+import inspect
+import hashlib
+import functools
+import contextlib
+
+import numpy as np
+import scipy.sparse as sp
+
+# Persistent content-addressed cache for citation matrices and other derived results.
+#
+# Entries are keyed by a fingerprint of the corpus arrays, the call arguments and
+# the source code of the module defining the cached function, stored as .npz files (sparse matrices in
+# scipy's own format, tuples of arrays as one file) and evicted least-recently-used once the cache directory
+# grows beyond max_bytes. Entry points enable it with configure(); it is off
+# until then, so library use stays side-effect free.
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+_directory = None
+_max_bytes = DEFAULT_MAX_BYTES
+
+# the umask can only be read by setting it, so once at import rather than while threads create files
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def configure(directory, max_bytes=DEFAULT_MAX_BYTES):
+    global _directory, _max_bytes
+    _directory = directory
+    _max_bytes = max_bytes
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+
+
+def enabled():
+    return _directory is not None
+
+
+# add the standard cache arguments to an entry point's parser
+def add_arguments(parser):
+    parser.add_argument("--cache_dir", default=None, help="Cache directory, defaults to <data_dir>/cache")
+    parser.add_argument("--cache_size", type=float, default=DEFAULT_MAX_BYTES / 1024 ** 3, help="Cache size budget in GB")
+    parser.add_argument("--no_cache", action="store_true", help="Don't read or write cached results")
+
+
+def configure_from_args(args):
+    if args.no_cache:
+        configure(None)
+    else:
+        configure(args.cache_dir or os.path.join(args.data_dir, "cache"), int(args.cache_size * 1024 ** 3))
+
+
+# content hash of the corpus columns, memoized on the store
+def fingerprint(store):
+    if getattr(store, "_fingerprint", None) is None:
+        digest = hashlib.sha256()
+        digest.update(repr(store.field_mapping).encode())
+        for name in sorted(store.columns):
+            column = store.columns[name]
+            arrays = [column.data, column.offsets] if hasattr(column, "offsets") else [column]
+            for array in arrays:
+                digest.update(name.encode())
+                digest.update(str(array.dtype).encode())
+                digest.update(np.ascontiguousarray(array).data)
+        store._fingerprint = digest.hexdigest()
+    return store._fingerprint
+
+
+def _key(name, parts):
+    digest = hashlib.sha256(name.encode())
+    for part in parts:
+        digest.update(b"\0")
+        digest.update(repr(part).encode())
+    return f"{name}-{digest.hexdigest()[:32]}"
+
+
+def _serialize(value):
+    buffer = io.BytesIO()
+    if sp.issparse(value):
+        sp.save_npz(buffer, value.tocsr(), compressed=True)
+    elif isinstance(value, tuple):
+        # several dense arrays, e.g. the citations and paper counts of the affiliation groups
+        np.savez_compressed(buffer, **{f"value{i}": np.asarray(v) for i, v in enumerate(value)})
+    else:
+        np.savez_compressed(buffer, value=np.asarray(value))
+    return buffer.getvalue()
+
+
+def _deserialize(path):
+    with np.load(path, allow_pickle=False) as npz:
+        if "format" in npz.files:
+            return sp.load_npz(path).tocsr()
+        if "value" in npz.files:
+            return npz["value"]
+        return tuple(npz[f"value{i}"] for i in range(len(npz.files)))
+
+
+# None on a miss; another thread or process may evict the entry at any point, which is a miss too
+def get(key):
+    path = os.path.join(_directory, key + ".npz")
+    try:
+        value = _deserialize(path)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError):
+        # partially written or corrupt entry
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+        return None
+    # the modification time doubles as last access time for LRU eviction
+    with contextlib.suppress(FileNotFoundError):
+        os.utime(path)
+    return value
+
+
+def put(key, value):
+    path = os.path.join(_directory, key + ".npz")
+    # unique per call, server request threads may store the same key at once
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=_directory)
+    with os.fdopen(fd, "wb") as fh:
+        fh.write(_serialize(value))
+    # mkstemp creates the file 0600, entries should be readable by whoever shares the directory
+    os.chmod(tmp_path, 0o666 & ~_UMASK)
+    os.replace(tmp_path, path)
+    evict()
+
+
+# drop least recently used entries until the cache fits in its budget
+def evict():
+    entries = []
+    for name in os.listdir(_directory):
+        if name.endswith(".npz"):
+            try:
+                stat = os.stat(os.path.join(_directory, name))
+            except FileNotFoundError:
+                # evicted by another thread or process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= _max_bytes:
+            break
+        try:
+            os.remove(os.path.join(_directory, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+# value of compute() cached under name and parts (e.g. arguments), for results that
+# don't depend on the corpus
+def memoize(name, parts, compute):
+    if not enabled():
+        return compute()
+    key = _key(name, parts)
+    value = get(key)
+    if value is None:
+        value = compute()
+        put(key, value)
+    return value
+
+
+# arguments that select a set (e.g. of fields), whose order and repeats don't change the result
+UNORDERED_ARGUMENTS = {"fields"}
+
+
+# cache a function of the corpus (first argument: data dict or store) by content
+def cached(function):
+    from corpus_store import as_store
+
+    # the whole module's source, so edits to helpers of function invalidate too
+    source = inspect.getsource(inspect.getmodule(function))
+    signature = inspect.signature(function)
+
+    def key(data, *args, **kwargs):
+        bound = signature.bind(data, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = sorted(
+            (k, sorted(set(v)) if k in UNORDERED_ARGUMENTS else v) for k, v in bound.arguments.items() if k != "data"
+        )
+        return _key(function.__name__, [fingerprint(as_store(data)), arguments, source])
+
+    @functools.wraps(function)
+    def wrapper(data, *args, **kwargs):
+        if not enabled():
+            return function(data, *args, **kwargs)
+        key = wrapper.key(data, *args, **kwargs)
+        value = get(key)
+        if value is None:
+            start = time.time()
+            value = function(data, *args, **kwargs)
+            put(key, value)
+            # stderr, stdout carries the reports
+            print(f"Cached {function.__name__} ({time.time() - start:.1f}s)", file=sys.stderr, flush=True)
+        return value
+
+    wrapper.key = key
+    return wrapper
+
+
+# store value as the result of the cached function for these arguments, for results that
+# were derived some other way (e.g. updated incrementally)
+def put_result(function, value, data, *args, **kwargs):
+    if enabled():
+        put(function.key(data, *args, **kwargs), value)
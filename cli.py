@@ -0,0 +1,47 @@
+import sys
+import argparse
+
+# Single entry point for the pipeline:
+#
+#   python3 cli.py parse -d <mag dump dir> -w 4
+#   python3 cli.py fields --from_year 2010
+#   python3 cli.py plot -f "Machine Learning"
+#
+# Every subcommand is handled by the main() of its module, which gets the remaining
+# arguments (`python3 cli.py <command> -h` lists them). The modules are only imported
+# once their subcommand runs, so numpy/scipy, networkx/matplotlib and zstandard are
+# loaded only by the commands that use them and `cli.py -h` stays fast.
+
+# subcommand -> (module, keyword arguments of its main, help)
+COMMANDS = {
+    "unpack": ("unpack_zst", {}, "Decompress the .zst MAG dumps"),
+    "parse": ("parse_mag", {}, "Parse the MAG dumps into data.pkl and/or the corpus store"),
+    "ingest": ("incremental", {}, "Merge a new MAG snapshot into the corpus store"),
+    "fields": ("analysis", {"reports": ["fields"]}, "Most common citations between fields"),
+    "institutions": ("analysis", {"reports": ["institutions"]}, "Most cited institutions"),
+    "fetch": ("fetch_affiliation_group", {}, "Fetch the type descriptions of the most cited affiliations"),
+    "groups": ("group_affiliations", {}, "Classify affiliations into academia and industry"),
+    "interactions": ("affilation_interactions", {}, "Citations between affiliation groups"),
+    "plot": ("top_institution_visualization", {}, "Plot the citations among the top institutions"),
+    "coauthorship": ("coauthorship", {}, "Institution pairs and affiliation groups that co-author papers"),
+    "serve": ("server", {}, "Answer queries over HTTP from the resident corpus"),
+    "synthetic": ("synthetic", {}, "Generate MAG-like dumps of a synthetic corpus"),
+    "benchmark": ("benchmark", {}, "Time the pipeline stages on synthetic corpora of several sizes"),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="cli.py", description="MAG citation analysis")
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    subparsers.required = True
+    for name, (_, _, help) in COMMANDS.items():
+        subparsers.add_parser(name, help=help, add_help=False)
+    args, rest = parser.parse_known_args(argv)
+
+    module_name, kwargs, _ = COMMANDS[args.command]
+    module = __import__(module_name)
+    module.main(rest, **kwargs)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
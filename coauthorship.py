@@ -0,0 +1,135 @@
+import argparse
+
+import numpy as np
+import scipy.sparse as sp
+
+import cache
+import instrumentation
+from analysis import (
+    field_mask,
+    year_mask,
+    paper_affiliation_matrix,
+    top_indices,
+    load_corpus,
+    add_year_arguments,
+)
+from corpus_store import as_store
+from group_affiliations import get_affiliation_groups
+from affilation_interactions import ACADEMIA_INDUSTRY, mapping_entities_binary, mapping_entities_title
+
+# Co-authorship between institutions.
+#
+# Both matrices are products of the (paper x affiliation) incidence matrix A, built
+# once from the author table: AᵀA counts for every pair of institutions the papers
+# they have authors on together, and with A collapsed to (paper x group) columns the
+# same product counts the papers co-authored by affiliation groups (e.g. academia
+# and industry).
+
+
+# collaboration[x][y] is the number of papers with authors affiliated with both x and y, the
+# diagonal the number of papers of x; papers in fields published between from_year and to_year
+@cache.cached
+def _coauthorship_matrix(data, fields=[], from_year=None, to_year=None):
+    store = as_store(data)
+    incidence = paper_affiliation_matrix(store, field_mask(store, fields) & year_mask(store, from_year, to_year))
+    collaboration = (incidence.T @ incidence).tocsr()
+    collaboration.sum_duplicates()
+    return collaboration
+
+
+@instrumentation.timed
+def coauthorship_matrix(data, fields=[], from_year=None, to_year=None):
+    return _coauthorship_matrix(as_store(data), fields, from_year, to_year)
+
+
+# institution pairs with the most co-authored papers as (papers, institution, institution)
+@instrumentation.timed
+def top_coauthorships(data, top: int = 100, fields=[], from_year=None, to_year=None):
+    names = as_store(data).affiliation_name
+    pairs = sp.triu(coauthorship_matrix(data, fields, from_year, to_year), k=1).tocoo()
+    papers = pairs.data.astype(int)
+    # ties in the order of the institutions
+    return [
+        (int(papers[idx]), names[pairs.row[idx]], names[pairs.col[idx]])
+        for idx in top_indices(papers, top, -pairs.row, -pairs.col)
+    ]
+
+
+def print_top_coauthorships(coauthorships, top: int = 100):
+    print(f"Top {top} co-authoring institution pairs")
+    for papers, name1, name2 in coauthorships:
+        print(f"Papers: {papers}, {name1} & {name2}")
+
+
+# papers[i][j] is the number of papers with authors of groups[i] and of groups[j], the diagonal the
+# number of papers with authors of groups[i]; affiliations without a group are left out and
+# merge_groups maps group values onto each other first
+@instrumentation.timed
+def group_coauthorship(data, affiliation_idx, affiliation_group, fields=[], merge_groups=ACADEMIA_INDUSTRY,
+                       from_year=None, to_year=None):
+    store = as_store(data)
+    affiliation_group = np.array([merge_groups.get(g, g) for g in affiliation_group], dtype=np.int64)
+    groups = sorted(set(affiliation_group.tolist()) - {0})
+    group_of_affiliation = np.zeros(store.num_affiliations, dtype=np.int64)
+    group_of_affiliation[np.asarray(affiliation_idx, dtype=np.int64)] = affiliation_group
+
+    # (affiliation x group) membership
+    grouped = np.flatnonzero(group_of_affiliation > 0)
+    membership = sp.csr_matrix(
+        (np.ones(len(grouped)), (grouped, np.searchsorted(groups, group_of_affiliation[grouped]))),
+        shape=(store.num_affiliations, len(groups)),
+    )
+    incidence = paper_affiliation_matrix(store, field_mask(store, fields) & year_mask(store, from_year, to_year))
+    paper_groups = (incidence @ membership).tocsr()
+    # several institutions of a paper can be in one group, count it once
+    paper_groups.data[:] = 1
+    return groups, (paper_groups.T @ paper_groups).toarray().astype(int)
+
+
+def print_group_coauthorship(groups, papers, names=None):
+    names = mapping_entities_binary if names is None else names
+    print("Co-authored papers by affiliation group")
+    for i, g in enumerate(groups):
+        print(f"{names[g]}, Papers: {papers[i][i]}")
+    for i, g in enumerate(groups):
+        for j in range(i + 1, len(groups)):
+            h = groups[j]
+            # papers of the two groups that have authors of both
+            share = papers[i][j] / max(papers[i][i] + papers[j][j] - papers[i][j], 1)
+            print(f"{names[g]}&{names[h]}, Papers: {papers[i][j]}, Proportion: {100 * share}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+
+    # shared parameters
+    parser.add_argument(
+        "-d",
+        "--data_dir",
+        default="data",
+        help="Directory where data.pkl and affiliation_type_raw.pkl resides",
+    )
+    parser.add_argument("-t", "--top", default=100, type=int, help="Number of institution pairs")
+    parser.add_argument("-f", "--fields", nargs="+", default=[])
+    parser.add_argument("-a", "--all_groups", action="store_true", help="Keep universities, institutes and companies apart")
+    add_year_arguments(parser)
+    cache.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(argv)
+    instrumentation.configure_from_args(args)
+    cache.configure_from_args(args)
+
+    data = load_corpus(args.data_dir, args.fields)
+    print_top_coauthorships(top_coauthorships(data, args.top, args.fields, args.from_year, args.to_year), args.top)
+
+    idx, _, affiliation_group = get_affiliation_groups(args.data_dir, data)
+    groups, papers = group_coauthorship(
+        data, idx, affiliation_group, args.fields, {} if args.all_groups else ACADEMIA_INDUSTRY,
+        args.from_year, args.to_year,
+    )
+    print_group_coauthorship(groups, papers, mapping_entities_title if args.all_groups else mapping_entities_binary)
+    instrumentation.finish_from_args(args)
+
+
+if __name__ == "__main__":
+    main()
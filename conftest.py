@@ -0,0 +1,37 @@
+import pytest
+
+import synthetic
+from parse_mag import build_data
+from corpus_store import CorpusStore
+
+# small synthetic corpus (see synthetic.py) shared by the tests comparing the vectorized
+# analyses with loops over the data dict, as the scripts computed them before
+
+
+@pytest.fixture(scope="session")
+def synthetic_dir(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("synthetic"))
+    synthetic.generate(path, num_papers=300, num_affiliations=40, seed=1)
+    return path
+
+
+# the data dict of mag_model records, as in data.pkl
+@pytest.fixture(scope="session")
+def data(synthetic_dir):
+    return build_data(synthetic_dir)
+
+
+# a fresh store of the corpus, so matrices memoized on it don't leak between tests
+@pytest.fixture
+def store(data):
+    return CorpusStore.from_data(data)
+
+
+# the two fields with the most papers, by full name
+@pytest.fixture(scope="session")
+def top_fields(data):
+    from analysis import full_field_name
+    counts = {}
+    for paper in data["papers"].values():
+        counts[paper.field] = counts.get(paper.field, 0) + 1
+    return [full_field_name[f] for f in sorted(counts, key=counts.get, reverse=True)[:2]]
@@ -0,0 +1,474 @@
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+
+from mag_model import Paper, PaperAuthor, Affiliation, MISSING_INT
+import mag_model
+
+# Columnar, memory-mappable replacement for the pickled object graph in data.pkl.
+#
+# Layout of a store directory (default data/corpus):
+#   meta.json                   counts, field mapping and the list of columns
+#   <column>.npy                numeric column, loaded with np.load(mmap_mode="r")
+#   <column>.data.npy/.offsets.npy
+#                               string column: concatenated utf-8 bytes + offsets
+#
+# Papers and affiliations are integer indexed in the insertion order of the
+# original data["papers"] / data["affiliations"] dicts, so affiliation indices
+# stay compatible with affiliation_type_raw.pkl and hardcoded_entries.
+# Relations are stored as CSR arrays:
+#   paper -> authors      author_indptr (num_papers + 1), author_* columns
+#   author -> affiliation author_affiliation (affiliation index, -1 if none)
+#   paper -> references   reference_indptr (num_papers + 1), reference_indices
+#
+# The corpus can also be written as shards (default data/shards), so that jobs on a
+# few fields only read those:
+#   meta.json                   field mapping and the shard of every field
+#   affiliations/               the affiliation_* columns, shared by all shards
+#   <field>/                    paper_*, author_* columns of the papers of one field,
+#                               reference_ids (MAG IDs of the cited papers, which may
+#                               live in another shard) and reference_indptr
+
+STORE_VERSION = 1
+STORE_DIR = "corpus"
+SHARD_DIR = "shards"
+AFFILIATION_SHARD = "affiliations"
+
+# column name -> (attribute of the mag_model record, kind)
+PAPER_COLUMNS = {
+    "paper_id": ("id", "int"),
+    "paper_rank": ("rank", "int"),
+    "paper_doc_type": ("doc_type", "str"),
+    "paper_title": ("title", "str"),
+    "paper_original_title": ("original_title", "str"),
+    "paper_year": ("year", "int"),
+    "paper_date": ("date", "str"),
+    "paper_references": ("references", "int"),
+    "paper_citations": ("citations", "int"),
+    "paper_estimated_citations": ("estimated_citations", "int"),
+}
+AUTHOR_COLUMNS = {
+    "author_id": ("author_id", "int"),
+    "author_sequence": ("author_sequence_number", "int"),
+    "author_original_name": ("original_author", "str"),
+}
+AFFILIATION_COLUMNS = {
+    "affiliation_id": ("id", "int"),
+    "affiliation_rank": ("rank", "int"),
+    "affiliation_normalized_name": ("normalized_name", "str"),
+    "affiliation_name": ("name", "str"),
+    "affiliation_official_page": ("official_page", "str"),
+    "affiliation_paper_count": ("paper_count", "int"),
+    "affiliation_paper_family_count": ("paper_family_count", "int"),
+    "affiliation_citation_count": ("citation_count", "int"),
+    "affiliation_country_code": ("country_code", "str"),
+    "affiliation_latitude": ("latitude", "float"),
+    "affiliation_longitude": ("longitude", "float"),
+}
+# integer columns that never need 64 bits
+SMALL_INT_COLUMNS = {"paper_year": np.int32, "author_sequence": np.int32}
+
+
+class StringColumn:
+    # variable length strings stored as one utf-8 buffer plus offsets
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_list(cls, values):
+        encoded = [v.encode("utf-8") for v in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(v) for v in encoded], out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(data, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return bytes(self.data[start:end]).decode("utf-8")
+
+    def take(self, rows):
+        offsets, positions = gather_csr(self.offsets, rows)
+        return StringColumn(np.asarray(self.data)[positions], offsets)
+
+    def tolist(self):
+        buffer = bytes(self.data)
+        offsets = self.offsets.tolist()
+        return [buffer[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(self))]
+
+
+# index of every query ID in ids, -1 if it is not there
+def index_of(ids, query):
+    ids = np.asarray(ids)
+    query = np.asarray(query)
+    if len(ids) == 0:
+        return np.full(len(query), -1, dtype=np.int64)
+    order = np.argsort(ids, kind="stable")
+    pos = np.minimum(np.searchsorted(ids[order], query), len(ids) - 1)
+    return np.where(ids[order][pos] == query, order[pos], -1)
+
+
+# rows of a CSR structure: new indptr plus the positions of the gathered elements
+def gather_csr(indptr, rows):
+    indptr = np.asarray(indptr)
+    lengths = indptr[rows + 1] - indptr[rows]
+    new_indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_indptr[1:])
+    positions = np.repeat(indptr[rows] - new_indptr[:-1], lengths) + np.arange(new_indptr[-1])
+    return new_indptr, positions
+
+
+def concat_indptr(a, b):
+    return np.concatenate([np.asarray(a)[:-1], np.asarray(b) + a[-1]])
+
+
+def take(column, rows):
+    if isinstance(column, StringColumn):
+        return column.take(rows)
+    return np.asarray(column)[rows]
+
+
+def concat(columns):
+    if isinstance(columns[0], StringColumn):
+        offsets = columns[0].offsets
+        for column in columns[1:]:
+            offsets = concat_indptr(offsets, column.offsets)
+        return StringColumn(np.concatenate([c.data for c in columns]), offsets)
+    return np.concatenate(columns)
+
+
+def save_columns(path, columns, meta):
+    os.makedirs(path, exist_ok=True)
+    meta = dict(meta, numeric_columns=[], string_columns=[])
+    for name, column in columns.items():
+        if isinstance(column, StringColumn):
+            np.save(os.path.join(path, f"{name}.data.npy"), column.data)
+            np.save(os.path.join(path, f"{name}.offsets.npy"), column.offsets)
+            meta["string_columns"].append(name)
+        else:
+            np.save(os.path.join(path, f"{name}.npy"), column)
+            meta["numeric_columns"].append(name)
+    # written last so a half written store is never picked up by load_data
+    with open(os.path.join(path, "meta.json"), "w") as fh:
+        json.dump(meta, fh, indent=1)
+
+
+# columns and meta data of a directory written by save_columns
+def load_columns(path, mmap=True):
+    mmap_mode = "r" if mmap else None
+    with open(os.path.join(path, "meta.json"), "r") as fh:
+        meta = json.load(fh)
+    if meta["version"] != STORE_VERSION:
+        raise ValueError(f"Unsupported corpus store version {meta['version']} in {path}")
+    columns = {}
+    for name in meta["numeric_columns"]:
+        columns[name] = np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+    for name in meta["string_columns"]:
+        columns[name] = StringColumn(
+            np.load(os.path.join(path, f"{name}.data.npy"), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, f"{name}.offsets.npy"), mmap_mode=mmap_mode),
+        )
+    return columns, meta
+
+
+def _to_int(value):
+    if value is None or value == "":
+        return MISSING_INT
+    return int(value)
+
+
+def _to_float(value):
+    if value is None or value == "":
+        return np.nan
+    return float(value)
+
+
+def _column(values, name, kind):
+    if kind == "str":
+        return StringColumn.from_list(values)
+    if kind == "float":
+        return np.array([_to_float(v) for v in values], dtype=np.float64)
+    dtype = SMALL_INT_COLUMNS.get(name, np.int64)
+    return np.array([_to_int(v) for v in values], dtype=dtype)
+
+
+class CorpusStore:
+    def __init__(self, columns, field_mapping, path=None):
+        self.columns = columns
+        self.field_mapping = field_mapping
+        self.fields = list(field_mapping.values())
+        self.path = path
+        for name, column in columns.items():
+            setattr(self, name, column)
+
+    @property
+    def num_papers(self):
+        return len(self.paper_id)
+
+    @property
+    def num_affiliations(self):
+        return len(self.affiliation_id)
+
+    @property
+    def num_authors(self):
+        return len(self.author_id)
+
+    @property
+    def num_references(self):
+        return len(self.reference_indices)
+
+    # paper index of every author row / reference edge, expanded from the CSR pointers
+    def author_paper(self):
+        return np.repeat(np.arange(self.num_papers), np.diff(self.author_indptr))
+
+    def reference_source(self):
+        return np.repeat(np.arange(self.num_papers), np.diff(self.reference_indptr))
+
+    @classmethod
+    def from_data(cls, data):
+        papers = list(data["papers"].values())
+        affiliations = list(data["affiliations"].values())
+        field_mapping = data["fields"]
+        field_to_idx = {v: k for k, v in enumerate(field_mapping.values())}
+        affiliation_to_idx = {a.id: idx for idx, a in enumerate(affiliations)}
+        paper_to_idx = {p.id: idx for idx, p in enumerate(papers)}
+
+        columns = {}
+        for name, (attr, kind) in PAPER_COLUMNS.items():
+            columns[name] = _column([getattr(p, attr) for p in papers], name, kind)
+        columns["paper_field"] = np.array([field_to_idx[p.field] for p in papers], dtype=np.int16)
+
+        authors = [author for p in papers for author in p.authors]
+        for name, (attr, kind) in AUTHOR_COLUMNS.items():
+            columns[name] = _column([getattr(a, attr) for a in authors], name, kind)
+        columns["author_affiliation"] = np.array(
+            [affiliation_to_idx[a.affiliation_id] if a.affiliation is not None else -1 for a in authors],
+            dtype=np.int32,
+        )
+        columns["author_indptr"] = np.zeros(len(papers) + 1, dtype=np.int64)
+        np.cumsum([len(p.authors) for p in papers], out=columns["author_indptr"][1:])
+
+        columns["reference_indices"] = np.array(
+            [paper_to_idx[r.id] for p in papers for r in p.referred_papers], dtype=np.int32
+        )
+        columns["reference_indptr"] = np.zeros(len(papers) + 1, dtype=np.int64)
+        np.cumsum([len(p.referred_papers) for p in papers], out=columns["reference_indptr"][1:])
+
+        for name, (attr, kind) in AFFILIATION_COLUMNS.items():
+            columns[name] = _column([getattr(a, attr) for a in affiliations], name, kind)
+        return cls(columns, field_mapping)
+
+    def save(self, path):
+        save_columns(path, self.columns, {
+            "version": STORE_VERSION,
+            "num_papers": self.num_papers,
+            "num_authors": self.num_authors,
+            "num_references": self.num_references,
+            "num_affiliations": self.num_affiliations,
+            "fields": self.field_mapping,
+        })
+        self.path = path
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        columns, meta = load_columns(path, mmap)
+        return cls(columns, meta["fields"], path=path)
+
+    # write the corpus as one shard per field plus the shared affiliation table
+    def save_shards(self, path):
+        save_columns(
+            os.path.join(path, AFFILIATION_SHARD),
+            {name: self.columns[name] for name in AFFILIATION_COLUMNS},
+            {"version": STORE_VERSION, "num_affiliations": self.num_affiliations},
+        )
+        paper_field = np.asarray(self.paper_field)
+        paper_id = np.asarray(self.paper_id)
+        shards = {}
+        for idx, field in enumerate(self.fields):
+            papers = np.flatnonzero(paper_field == idx)
+            columns = {name: take(self.columns[name], papers) for name in PAPER_COLUMNS}
+            columns["author_indptr"], authors = gather_csr(self.author_indptr, papers)
+            for name in list(AUTHOR_COLUMNS) + ["author_affiliation"]:
+                columns[name] = take(self.columns[name], authors)
+            columns["reference_indptr"], references = gather_csr(self.reference_indptr, papers)
+            columns["reference_ids"] = paper_id[np.asarray(self.reference_indices)[references]]
+            shard = field.replace(" ", "_")
+            save_columns(os.path.join(path, shard), columns, {
+                "version": STORE_VERSION,
+                "field": field,
+                "num_papers": len(papers),
+                "num_authors": len(authors),
+                "num_references": len(references),
+            })
+            shards[field] = shard
+        with open(os.path.join(path, "meta.json"), "w") as fh:
+            json.dump({"version": STORE_VERSION, "fields": self.field_mapping, "shards": shards}, fh, indent=1)
+
+    # store of the papers of the given fields (names as in the field mapping, all if empty) read
+    # from the shards in path; references to papers of other fields are dropped
+    @classmethod
+    def load_shards(cls, path, fields=[], mmap=True):
+        with open(os.path.join(path, "meta.json"), "r") as fh:
+            meta = json.load(fh)
+        field_mapping = meta["fields"]
+        field_idx = {field: idx for idx, field in enumerate(field_mapping.values())}
+        unknown = set(fields) - set(field_idx)
+        if unknown:
+            raise ValueError(f"Unknown fields {sorted(unknown)}")
+        selected = [field for field in field_mapping.values() if len(fields) == 0 or field in fields]
+        shards = [load_columns(os.path.join(path, meta["shards"][field]), mmap)[0] for field in selected]
+
+        columns = {name: concat([shard[name] for shard in shards]) for name in PAPER_COLUMNS}
+        columns["paper_field"] = np.concatenate(
+            [np.full(len(shard["paper_id"]), field_idx[field], dtype=np.int16) for field, shard in zip(selected, shards)]
+        )
+        for name in list(AUTHOR_COLUMNS) + ["author_affiliation"]:
+            columns[name] = concat([shard[name] for shard in shards])
+        author_indptr = reference_indptr = np.zeros(1, dtype=np.int64)
+        for shard in shards:
+            author_indptr = concat_indptr(author_indptr, shard["author_indptr"])
+            reference_indptr = concat_indptr(reference_indptr, shard["reference_indptr"])
+        columns["author_indptr"] = author_indptr
+
+        # cited paper IDs to indices among the loaded papers
+        num_papers = len(columns["paper_id"])
+        source = np.repeat(np.arange(num_papers), np.diff(reference_indptr))
+        target = index_of(columns["paper_id"], concat([shard["reference_ids"] for shard in shards]))
+        keep = target >= 0
+        columns["reference_indices"] = target[keep].astype(np.int32)
+        columns["reference_indptr"] = np.zeros(num_papers + 1, dtype=np.int64)
+        np.cumsum(np.bincount(source[keep], minlength=num_papers), out=columns["reference_indptr"][1:])
+
+        affiliations, _ = load_columns(os.path.join(path, AFFILIATION_SHARD), mmap)
+        columns.update(affiliations)
+        return cls(columns, field_mapping)
+
+    # rebuild the data dict of mag_model records that data.pkl used to contain
+    def to_data(self):
+        fields = self.fields
+        affiliations = {}
+        affiliation_list = []
+        affiliation_values = {name: self.columns[name].tolist() for name in AFFILIATION_COLUMNS}
+        for idx in range(self.num_affiliations):
+            attributes = {attr: affiliation_values[name][idx] for name, (attr, _) in AFFILIATION_COLUMNS.items()}
+            affiliation = Affiliation.from_attributes(**attributes)
+            affiliations[affiliation.id] = affiliation
+            affiliation_list.append(affiliation)
+
+        paper_values = {name: self.columns[name].tolist() for name in PAPER_COLUMNS}
+        author_values = {name: self.columns[name].tolist() for name in AUTHOR_COLUMNS}
+        author_affiliation = self.author_affiliation.tolist()
+        author_indptr = self.author_indptr.tolist()
+        paper_field = self.paper_field.tolist()
+
+        papers = {}
+        paper_list = []
+        for idx in range(self.num_papers):
+            attributes = {attr: paper_values[name][idx] for name, (attr, _) in PAPER_COLUMNS.items()}
+            attributes["field"] = fields[paper_field[idx]]
+            attributes["referred_papers"] = []
+            authors = []
+            for a in range(author_indptr[idx], author_indptr[idx + 1]):
+                affiliation_idx = author_affiliation[a]
+                affiliation = affiliation_list[affiliation_idx] if affiliation_idx >= 0 else None
+                authors.append(PaperAuthor.from_attributes(
+                    paper_id=attributes["id"],
+                    author_id=author_values["author_id"][a],
+                    affiliation_id=affiliation.id if affiliation is not None else MISSING_INT,
+                    author_sequence_number=author_values["author_sequence"][a],
+                    original_author=author_values["author_original_name"][a],
+                    affiliation=affiliation,
+                ))
+            attributes["authors"] = authors
+            paper = Paper.from_attributes(**attributes)
+            papers[paper.id] = paper
+            paper_list.append(paper)
+
+        reference_indptr = self.reference_indptr.tolist()
+        reference_indices = self.reference_indices.tolist()
+        for idx, paper in enumerate(paper_list):
+            paper.referred_papers = [
+                paper_list[r] for r in reference_indices[reference_indptr[idx]:reference_indptr[idx + 1]]
+            ]
+
+        return {"papers": papers, "affiliations": affiliations, "fields": dict(self.field_mapping), "store": self}
+
+
+def store_path(data_dir):
+    return os.path.join(data_dir, STORE_DIR)
+
+
+def has_store(data_dir):
+    return os.path.exists(os.path.join(store_path(data_dir), "meta.json"))
+
+
+def shard_path(data_dir):
+    return os.path.join(data_dir, SHARD_DIR)
+
+
+def has_shards(data_dir):
+    return os.path.exists(os.path.join(shard_path(data_dir), "meta.json"))
+
+
+def load_pickle(data_dir):
+    # referred_papers links make the object graph deeply recursive
+    sys.setrecursionlimit(50000)
+    with open(f"{data_dir}/data.pkl", "rb") as fh:
+        return mag_model.load(fh)
+
+
+# columnar store of data_dir, converted from data.pkl if no store was written yet
+# fields (names as in the field mapping) restricts the corpus to the papers of those fields
+# when it was written as shards, reading only their shards; the full corpus otherwise
+def load_store(data_dir, fields=[]):
+    if has_shards(data_dir) and (len(fields) > 0 or not has_store(data_dir)):
+        return CorpusStore.load_shards(shard_path(data_dir), fields)
+    if has_store(data_dir):
+        return CorpusStore.load(store_path(data_dir))
+    return CorpusStore.from_data(load_pickle(data_dir))
+
+
+# compatibility loader yielding the data dict shape of data.pkl, from the store or the shards
+# when either was written
+def load_data(data_dir):
+    if has_store(data_dir) or has_shards(data_dir):
+        return load_store(data_dir).to_data()
+    return load_pickle(data_dir)
+
+
+# columnar view of a data dict (or store), built once and memoized on the dict
+def as_store(data):
+    if isinstance(data, CorpusStore):
+        return data
+    if "store" not in data:
+        data["store"] = CorpusStore.from_data(data)
+    return data["store"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-d",
+        "--data_dir",
+        default="data",
+        help="Directory where data.pkl resides",
+    )
+    parser.add_argument("-o", "--output", default=None, help="Store directory, defaults to <data_dir>/corpus (or shards)")
+    parser.add_argument("--shards", action="store_true", help="Write one shard per field from the store (or data.pkl)")
+    args = parser.parse_args()
+    if args.shards:
+        store = load_store(args.data_dir)
+        output = args.output or shard_path(args.data_dir)
+        store.save_shards(output)
+        print(f"Wrote {len(store.fields)} field shards of {store.num_papers} papers to {output}")
+    else:
+        store = CorpusStore.from_data(load_pickle(args.data_dir))
+        store.save(args.output or store_path(args.data_dir))
+        print(f"Wrote {store.num_papers} papers, {store.num_authors} authors, {store.num_references} references, "
+              f"{store.num_affiliations} affiliations to {store.path}")
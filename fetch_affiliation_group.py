@@ -1,12 +1,16 @@
+import os
+import json
+import time
+import random
 import pickle
+import asyncio
 import argparse
-import requests
 import urllib.parse
 
 import numpy as np
-from bs4 import BeautifulSoup
-from parse_mag import Paper, PaperAuthor, Affiliation
-from analysis import citation_matrix_institutions
+from analysis import citation_matrix_institutions, cited_counts, add_process_arguments, configure_processes
+from corpus_store import load_store
+import cache
 
 headers = {
     'User-agent':
@@ -14,17 +18,147 @@ headers = {
         "Chrome/70.0.3538.102 Safari/537.36 Edge/18.19582"
 }
 
-def get_affiliation_type(query: str):
-    query = urllib.parse.quote_plus(query)
-    html = requests.get(f'https://www.google.com/search?q={query}&hl=en', headers=headers)
-    result = BeautifulSoup(html.text).find_all("div", {'class':"BNeawe tAd8D AP7Wnd"})
-    html.close()
+SEARCH_URL = "https://www.google.com/search"
+
 
+def parse_affiliation_type(html: str):
+    from bs4 import BeautifulSoup
+
+    result = BeautifulSoup(html, "html.parser").find_all("div", {'class':"BNeawe tAd8D AP7Wnd"})
     if result:
         return result[0].text
     return ""
 
-if __name__ == "__main__":
+
+def get_affiliation_type(query: str, base_url: str = SEARCH_URL):
+    import requests
+
+    query = urllib.parse.quote_plus(query)
+    html = requests.get(f'{base_url}?q={query}&hl=en', headers=headers)
+    description = parse_affiliation_type(html.text)
+    html.close()
+    return description
+
+
+# allows rate requests per second on average, with bursts of up to capacity requests
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# fetched descriptions keyed by MAG affiliation ID, appended to a JSON lines file so
+# an interrupted run resumes where it stopped
+class AffiliationTypeCache:
+    def __init__(self, path: str):
+        self.path = path
+        self.descriptions = {}
+        # the file ends in a line cut off by a run that was killed mid-write
+        self.partial_line = False
+        if os.path.exists(path):
+            with open(path, "r") as fh:
+                for line in fh:
+                    self.partial_line = not line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                        self.descriptions[entry["id"]] = entry["description"]
+                    except (json.JSONDecodeError, TypeError, KeyError):
+                        # cut off mid-write, or joined onto such a line by an earlier version
+                        continue
+
+    def __contains__(self, affiliation_id):
+        return affiliation_id in self.descriptions
+
+    def __getitem__(self, affiliation_id):
+        return self.descriptions[affiliation_id]
+
+    def put(self, affiliation_id, name, description):
+        self.descriptions[affiliation_id] = description
+        line = json.dumps({"id": affiliation_id, "name": name, "description": description}) + "\n"
+        if self.partial_line:
+            # end the cut off line first, or this record would be lost with it
+            line = "\n" + line
+            self.partial_line = False
+        with open(self.path, "a") as fh:
+            fh.write(line)
+
+
+class RetryableStatus(Exception):
+    pass
+
+
+async def _fetch_one(session, bucket, semaphore, url, retries, backoff):
+    import aiohttp
+
+    for attempt in range(retries + 1):
+        async with semaphore:
+            await bucket.acquire()
+            try:
+                async with session.get(url) as response:
+                    # rate limited or server side failure, worth another try
+                    if response.status == 429 or response.status >= 500:
+                        raise RetryableStatus(f"HTTP {response.status}")
+                    response.raise_for_status()
+                    return parse_affiliation_type(await response.text())
+            except aiohttp.ClientResponseError:
+                # any other 4xx (e.g. 403, 404) fails the same way every time
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError, RetryableStatus) as e:
+                if attempt == retries:
+                    raise
+                error = e
+        delay = backoff * 2 ** attempt * (1 + random.random())
+        print(f"Retrying {url} in {delay:.1f}s ({error})", flush=True)
+        await asyncio.sleep(delay)
+
+
+# fetch the type description of every affiliation (id -> name) that is not cached yet
+async def fetch_affiliation_types(affiliations, cache_path, base_url=SEARCH_URL, concurrency=8,
+                                  rate=2.0, retries=4, backoff=1.0, timeout=30.0):
+    import aiohttp
+
+    type_cache = AffiliationTypeCache(cache_path)
+    missing = [(k, v) for k, v in affiliations.items() if k not in type_cache]
+    print(f"Fetching {len(missing)} of {len(affiliations)} affiliation types", flush=True)
+
+    # no bursts, so the server never sees more than rate requests per second
+    bucket = TokenBucket(rate)
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(
+        connector=connector, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)
+    ) as session:
+
+        async def fetch(affiliation_id, name):
+            url = f"{base_url}?q={urllib.parse.quote_plus(name)}&hl=en"
+            try:
+                description = await _fetch_one(session, bucket, semaphore, url, retries, backoff)
+            except Exception as e:
+                # left out of the cache so the next run tries again
+                print(f"Failed to fetch {name}: {e}", flush=True)
+                return
+            type_cache.put(affiliation_id, name, description)
+
+        await asyncio.gather(*[fetch(k, v) for k, v in missing])
+
+    return {k: type_cache[k] for k in affiliations if k in type_cache}
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser()
 
     # shared parameters
@@ -34,20 +168,43 @@ if __name__ == "__main__":
         default="data",
         help="Directory where data.pkl resides",
     )
-    parser.add_argument("-t", "-top", defaut=100, type=int, help="Number of citations to threshold")
-    args = parser.parse_args()
+    parser.add_argument("-t", "--top", default=100, type=int, help="Number of citations to threshold")
+    parser.add_argument("--base_url", default=SEARCH_URL, help="Search endpoint, e.g. a local stub server")
+    parser.add_argument("-c", "--concurrency", default=8, type=int, help="Maximum number of requests in flight")
+    parser.add_argument("-r", "--rate", default=2.0, type=float, help="Maximum requests per second")
+    parser.add_argument("--retries", default=4, type=int)
+    add_process_arguments(parser)
+    cache.add_arguments(parser)
+    args = parser.parse_args(argv)
+    cache.configure_from_args(args)
+    configure_processes(args.processes)
 
-    with open(f"{args.data_dir}/data.pkl",'rb') as fh:
-        data = pickle.load(fh)
+    store = load_store(args.data_dir)
 
-    affiliations = np.array([x.name for x in data["affiliations"].values()])
-    cit_inst = citation_matrix_institutions(data)
-    idx = np.where(cit_inst.sum(axis=0) >= args.top)[0]
+    affiliations = np.array(store.affiliation_name.tolist())
+    affiliation_ids = np.asarray(store.affiliation_id)
+    cit_inst = citation_matrix_institutions(store)
+    idx = np.where(cited_counts(cit_inst) >= args.top)[0]
 
-    description = list()
-    for affiliation in affiliation[idx]:
-        description.append(get_affiliation_type(affiliation))
+    fetched = asyncio.run(fetch_affiliation_types(
+        {int(affiliation_ids[i]): affiliations[i] for i in idx},
+        f"{args.data_dir}/affiliation_type_cache.jsonl",
+        base_url=args.base_url,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        retries=args.retries,
+    ))
+    missing = [i for i in idx if int(affiliation_ids[i]) not in fetched]
+    if missing:
+        print(f"{len(missing)} affiliation types could not be fetched, rerun to retry them")
+        idx = np.array([i for i in idx if int(affiliation_ids[i]) in fetched], dtype=int)
+
+    description = [fetched[int(affiliation_ids[i])] for i in idx]
     description = [x.split('\n')[-1].split('·')[0] for x in description]
 
     with open(f"{args.data_dir}/affiliation_type_raw.pkl", "wb") as f:
         pickle.dump(dict(zip(idx, description)), f)
+
+
+if __name__ == "__main__":
+    main()
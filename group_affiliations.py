@@ -1,9 +1,9 @@
+import re
 import pickle
 import argparse
 
 import numpy as np
-from parse_mag import Paper, PaperAuthor, Affiliation
-from analysis import citation_matrix_fields, citation_matrix_institutions
+from corpus_store import load_store, as_store
 
 hardcoded_entries = {
     1: [
@@ -66,69 +66,106 @@ hardcoded_entries = {
 mapping_entities = {1: "university", 2: "institute", 3: "company"}
 
 
+# keywords of each group, a lower group takes precedence when several match
+NAME_KEYWORDS = {
+    1: ["universi", "college", "école", "education"],
+    2: ["institute", "agency", "academy", "hospital", "association"],
+    3: ["company"],
+}
+DESCRIPTION_KEYWORDS = {
+    1: ["university", "college", "école", "education", "school"],
+    2: ["research", "institute", "laboratory", "academy", "agency", "profit", "hospital", "association"],
+    3: ["company", "corporation", "manufacturer", "provider"],
+}
+UNKNOWN_GROUP = 0
+
+
 def define_type(affiliation_name, affiliation_type=None):
     if isinstance(affiliation_type, int):
         return affiliation_type
 
-    for word in ["universi", "college", "école", "education"]:
-        if word in affiliation_name.lower():
-            return 1
+    for group, words in NAME_KEYWORDS.items():
+        for word in words:
+            if word in affiliation_name.lower():
+                return group
 
-    for word in ["institute", "agency", "academy", "hospital", "association"]:
-        if word in affiliation_name.lower():
-            return 2
+    if affiliation_type:
+        for group, words in DESCRIPTION_KEYWORDS.items():
+            for word in words:
+                if word in affiliation_type.lower():
+                    return group
 
-    if "company" in affiliation_name.lower():
-        return 3
 
-    if affiliation_type:
-        for word in ["university", "college", "école", "education", "school"]:
-            if word in affiliation_type.lower():
-                return 1
-
-        for word in [
-            "research",
-            "institute",
-            "laboratory",
-            "academy",
-            "agency",
-            "profit",
-            "hospital",
-            "association",
-        ]:
-            if word in affiliation_type.lower():
-                return 2
-
-        for word in ["company", "corporation", "manufacturer", "provider"]:
-            if word in affiliation_type.lower():
-                return 3
-
-
-def get_affiliation_groups(data_dir):
-    with open(f"{data_dir}/data.pkl", "rb") as f:
-        data = pickle.load(f)
+# one regex matching every keyword at every position (the lookahead lets matches overlap),
+# the named group of a match tells which affiliation group it belongs to
+def keyword_matcher(keywords):
+    alternatives = "|".join(
+        f"(?P<g{group}>{'|'.join(re.escape(word) for word in words)})" for group, words in keywords.items()
+    )
+    return re.compile(f"(?=(?:{alternatives}))")
+
+
+# lowest group whose keywords occur in each text, UNKNOWN_GROUP if none does
+def match_groups(matcher, texts):
+    texts = [text.lower() for text in texts]
+    starts = np.zeros(len(texts), dtype=np.int64)
+    np.cumsum([len(text) + 1 for text in texts[:-1]], out=starts[1:])
+    positions, groups = [], []
+    # keywords never contain a newline, so matches can't span two texts
+    for match in matcher.finditer("\n".join(texts)):
+        positions.append(match.start())
+        groups.append(int(match.lastgroup[1:]))
+    matched = np.full(len(texts), np.iinfo(np.int64).max)
+    rows = np.searchsorted(starts, positions, side="right") - 1
+    np.minimum.at(matched, rows, np.array(groups, dtype=np.int64))
+    matched[matched == np.iinfo(np.int64).max] = UNKNOWN_GROUP
+    return matched
+
+
+name_matcher = keyword_matcher(NAME_KEYWORDS)
+description_matcher = keyword_matcher(DESCRIPTION_KEYWORDS)
+# affiliation index -> group of the hardcoded entries
+hardcoded_groups = {idx: group for group, indices in hardcoded_entries.items() for idx in indices}
+
+
+# group of every affiliation, same rules as define_type plus hardcoded_entries;
+# descriptions[i] may be empty when nothing is known about affiliation i
+def classify_affiliations(names, descriptions=None):
+    affiliation_group = match_groups(name_matcher, names)
+    if descriptions is not None:
+        # descriptions only decide for affiliations whose name didn't match
+        rows = np.where((affiliation_group == UNKNOWN_GROUP) & np.array([bool(d) for d in descriptions], dtype=bool))[0]
+        affiliation_group[rows] = match_groups(description_matcher, [descriptions[i] for i in rows])
+
+    # input entries that have been hardcoded (e.g. Intel --> 3)
+    for idx, group in hardcoded_groups.items():
+        if idx < len(affiliation_group):
+            affiliation_group[idx] = group
+    return affiliation_group
+
+
+def get_affiliation_groups(data_dir, data=None, all_affiliations=False):
+    if data is None:
+        data = load_store(data_dir)
 
     with open(f"{data_dir}/affiliation_type_raw.pkl", "rb") as f:
         file = pickle.load(f)
         idx = np.array(list(file.keys())).astype(int)
-        descriptions = np.array(list(file.values()))
+        descriptions = list(file.values())
 
-    affiliation_group = []
-    affiliations = [
-        x.name for i, x in enumerate(data["affiliations"].values()) if i in idx
-    ]
-    for i in range(len(idx)):
-        affiliation_group.append(define_type(affiliations[i], descriptions[i]))
-    affiliation_group = np.array(affiliation_group)
-
-    # input entries that have been hardcoded (e.g. Intel --> 3)
-    for k, v in hardcoded_entries.items():
-        affiliation_group[np.where(np.isin(idx, v))[0]] = k
+    names = as_store(data).affiliation_name.tolist()
+    all_descriptions = [""] * len(names)
+    for i, description in zip(idx, descriptions):
+        all_descriptions[i] = description
+    affiliation_group = classify_affiliations(names, all_descriptions)
 
-    return idx, affiliations, affiliation_group
+    if all_affiliations:
+        idx = np.arange(len(names))
+    affiliations = [names[i] for i in idx]
+    return idx, affiliations, affiliation_group[idx]
 
 
-if __name__ == "__main__":
+def main(argv=None):
     parser = argparse.ArgumentParser()
 
     # shared parameters
@@ -138,9 +175,14 @@ if __name__ == "__main__":
         default="data",
         help="Directory where data.pkl and affiliation_type_raw.pkl resides",
     )
-    args = parser.parse_args()
-    idx, affiliations, affiliation_group = get_affiliation_groups(args.data_dir)
+    parser.add_argument("-a", "--all", action="store_true", help="Classify all affiliations, not only the fetched ones")
+    args = parser.parse_args(argv)
+    idx, affiliations, affiliation_group = get_affiliation_groups(args.data_dir, all_affiliations=args.all)
 
     for k, v in mapping_entities.items():
         print(f"{v.title()} in the top {len(idx)}: {(affiliation_group == k).sum()}")
 
+
+if __name__ == "__main__":
+    main()
+
@@ -0,0 +1,291 @@
+import os
+import sys
+import pickle
+import shutil
+import argparse
+
+import numpy as np
+import scipy.sparse as sp
+
+from corpus_store import (
+    CorpusStore,
+    StringColumn,
+    PAPER_COLUMNS,
+    AUTHOR_COLUMNS,
+    AFFILIATION_COLUMNS,
+    load_store,
+    store_path,
+    has_shards,
+    shard_path,
+    index_of,
+    gather_csr,
+    concat_indptr,
+)
+import cache
+import instrumentation
+from analysis import (
+    citation_matrix_institutions,
+    citation_matrix_fields,
+    _citation_matrix_institutions,
+    _citation_matrix_fields,
+    cited_counts,
+    paper_affiliation_matrix,
+    add_process_arguments,
+    configure_processes,
+)
+
+# Incremental ingest of a new MAG snapshot into an existing corpus store.
+#
+# The new snapshot is parsed as usual and then merged into the stored corpus by
+# MAG ID: known papers and affiliations keep their index (so affiliation indices
+# stay valid for affiliation_type_raw.pkl and hardcoded_entries), unseen ones are
+# appended, and papers missing from the snapshot are kept as they were.
+#
+# Derived artifacts kept in <store>/derived are updated from the delta: only the
+# reference edges touching an inserted or changed paper are recounted. The updated
+# citation matrices are also put into the result cache under the merged corpus, so
+# the analyses don't recompute them. Shards and data.pkl, if there are any, are
+# rewritten from the merged corpus.
+#
+# Only the derived artifacts are updated in proportion to the change: the snapshot is
+# a full dump and is parsed as a whole, its papers replace the stored ones wholesale
+# (attributes such as citation counts change in every snapshot), and the store, the
+# shards and data.pkl are rewritten in full.
+
+DERIVED_DIR = "derived"
+
+
+# rows take of the column old followed by new
+def concat_take(old, new, take):
+    if isinstance(old, StringColumn):
+        offsets = concat_indptr(old.offsets, new.offsets)
+        offsets, positions = gather_csr(offsets, take)
+        return StringColumn(np.concatenate([old.data, new.data])[positions], offsets)
+    return np.concatenate([old, new])[take]
+
+
+# which rows have a different segment in the CSR structures a and b (same number of rows)
+def segments_differ(indptr_a, values_a, indptr_b, values_b):
+    lengths_a = np.diff(indptr_a)
+    lengths_b = np.diff(indptr_b)
+    differ = lengths_a != lengths_b
+    rows = np.where(~differ)[0]
+    indptr, positions_a = gather_csr(indptr_a, rows)
+    _, positions_b = gather_csr(indptr_b, rows)
+    mismatch = np.asarray(values_a)[positions_a] != np.asarray(values_b)[positions_b]
+    row_of_element = np.repeat(np.arange(len(rows)), np.diff(indptr))
+    differ[rows] = np.bincount(row_of_element[mismatch], minlength=len(rows)) > 0
+    return differ
+
+
+# merge the new snapshot into the old store, returns the merged store, the changed
+# old papers and the inserted papers (boolean masks over the merged papers)
+def merge_snapshot(old, new):
+    columns = {}
+
+    # affiliations: rows of new replace the old ones with the same ID, unseen ones are appended
+    new_in_old = index_of(old.affiliation_id, new.affiliation_id)
+    old_in_new = index_of(new.affiliation_id, old.affiliation_id)
+    appended = np.where(new_in_old < 0)[0]
+    new_to_merged_affiliation = new_in_old.copy()
+    new_to_merged_affiliation[appended] = old.num_affiliations + np.arange(len(appended))
+    take = np.where(old_in_new >= 0, old.num_affiliations + old_in_new, np.arange(old.num_affiliations))
+    take = np.concatenate([take, old.num_affiliations + appended])
+    for name in AFFILIATION_COLUMNS:
+        columns[name] = concat_take(old.columns[name], new.columns[name], take)
+
+    # papers, same scheme
+    new_in_old = index_of(old.paper_id, new.paper_id)
+    old_in_new = index_of(new.paper_id, old.paper_id)
+    appended = np.where(new_in_old < 0)[0]
+    new_to_merged_paper = new_in_old.copy()
+    new_to_merged_paper[appended] = old.num_papers + np.arange(len(appended))
+    take = np.where(old_in_new >= 0, old.num_papers + old_in_new, np.arange(old.num_papers))
+    take = np.concatenate([take, old.num_papers + appended])
+    for name in list(PAPER_COLUMNS) + ["paper_field"]:
+        columns[name] = concat_take(old.columns[name], new.columns[name], take)
+
+    # authors and references follow the paper they belong to
+    author_indptr = concat_indptr(old.author_indptr, new.author_indptr)
+    columns["author_indptr"], positions = gather_csr(author_indptr, take)
+    for name in AUTHOR_COLUMNS:
+        columns[name] = concat_take(old.columns[name], new.columns[name], positions)
+    new_affiliation = np.asarray(new.author_affiliation)
+    new_affiliation = np.where(new_affiliation >= 0, new_to_merged_affiliation[new_affiliation], -1)
+    columns["author_affiliation"] = np.concatenate([old.author_affiliation, new_affiliation])[positions].astype(np.int32)
+
+    reference_indptr = concat_indptr(old.reference_indptr, new.reference_indptr)
+    columns["reference_indptr"], positions = gather_csr(reference_indptr, take)
+    new_references = new_to_merged_paper[np.asarray(new.reference_indices)]
+    columns["reference_indices"] = np.concatenate([old.reference_indices, new_references])[positions].astype(np.int32)
+
+    merged = CorpusStore(columns, old.field_mapping)
+
+    # old papers whose field, affiliations or references differ in the merged corpus
+    num_old = old.num_papers
+    changed = np.zeros(merged.num_papers, dtype=bool)
+    changed[:num_old] = np.asarray(old.paper_field) != merged.paper_field[:num_old]
+    changed[:num_old] |= segments_differ(
+        old.author_indptr, old.author_affiliation, merged.author_indptr[:num_old + 1], merged.author_affiliation
+    )
+    changed[:num_old] |= segments_differ(
+        old.reference_indptr, old.reference_indices, merged.reference_indptr[:num_old + 1], merged.reference_indices
+    )
+    inserted = np.zeros(merged.num_papers, dtype=bool)
+    inserted[num_old:] = True
+    return merged, changed, inserted
+
+
+def build_derived(store):
+    institution_citations = citation_matrix_institutions(store)
+    return {
+        "institution_citations": institution_citations,
+        "field_citations": citation_matrix_fields(store),
+        "institution_cited": cited_counts(institution_citations),
+    }
+
+
+# institution and field citations of the reference edges touching a paper in mask
+def edge_citations(store, mask, num_affiliations):
+    source = store.reference_source()
+    target = np.asarray(store.reference_indices)
+    keep = mask[source] | mask[target]
+    source, target = source[keep], target[keep]
+    references = sp.csr_matrix((np.ones(len(source)), (source, target)), shape=(store.num_papers, store.num_papers))
+    incidence = pad(paper_affiliation_matrix(store), store.num_papers, num_affiliations)
+    institutions = (incidence.T @ references @ incidence).tocsr()
+
+    num_fields = len(store.fields)
+    paper_field = np.asarray(store.paper_field, dtype=np.int64)
+    fields = np.bincount(paper_field[source] * num_fields + paper_field[target], minlength=num_fields * num_fields)
+    return institutions, fields.reshape(num_fields, num_fields).astype(np.float64)
+
+
+# grow a sparse matrix to shape (rows, cols) with empty rows/columns
+def pad(matrix, rows, cols):
+    matrix = matrix.tocsr()
+    indptr = np.concatenate([matrix.indptr, np.full(rows - matrix.shape[0], matrix.indptr[-1])])
+    return sp.csr_matrix((matrix.data, matrix.indices, indptr), shape=(rows, cols))
+
+
+# apply the contribution change of the affected papers to the derived artifacts of old
+def update_derived(derived, old, merged, affected):
+    num_affiliations = merged.num_affiliations
+    old_institutions, old_fields = edge_citations(old, affected[:old.num_papers], num_affiliations)
+    new_institutions, new_fields = edge_citations(merged, affected, num_affiliations)
+    delta = (new_institutions - old_institutions).tocsr()
+
+    institution_citations = pad(derived["institution_citations"], num_affiliations, num_affiliations) + delta
+    institution_citations.eliminate_zeros()
+    institution_cited = np.zeros(num_affiliations)
+    institution_cited[:len(derived["institution_cited"])] = derived["institution_cited"]
+    return {
+        "institution_citations": institution_citations.tocsr(),
+        "field_citations": derived["field_citations"] + new_fields - old_fields,
+        "institution_cited": institution_cited + cited_counts(delta),
+    }
+
+
+def save_derived(path, derived):
+    path = os.path.join(path, DERIVED_DIR)
+    os.makedirs(path, exist_ok=True)
+    sp.save_npz(os.path.join(path, "institution_citations.npz"), derived["institution_citations"])
+    np.save(os.path.join(path, "field_citations.npy"), derived["field_citations"])
+    np.save(os.path.join(path, "institution_cited.npy"), derived["institution_cited"])
+    # top institutions by number of citations
+    np.save(os.path.join(path, "top_institutions.npy"), np.argsort(-derived["institution_cited"], kind="stable"))
+
+
+def load_derived(path):
+    path = os.path.join(path, DERIVED_DIR)
+    if not os.path.exists(os.path.join(path, "top_institutions.npy")):
+        return None
+    return {
+        "institution_citations": sp.load_npz(os.path.join(path, "institution_citations.npz")).tocsr(),
+        "field_citations": np.load(os.path.join(path, "field_citations.npy")),
+        "institution_cited": np.load(os.path.join(path, "institution_cited.npy")),
+    }
+
+
+def incremental_update(data_dir, snapshot_dir, workers=1):
+    from parse_mag import build_data
+
+    old = load_store(data_dir)
+    new = CorpusStore.from_data(build_data(snapshot_dir, workers))
+    with instrumentation.stage("merge"):
+        merged, changed, inserted = merge_snapshot(old, new)
+    print(f"Inserted papers: {inserted.sum()}, changed papers: {changed.sum()}, "
+          f"new affiliations: {merged.num_affiliations - old.num_affiliations}")
+
+    derived = load_derived(old.path) if old.path is not None else None
+    with instrumentation.stage("update derived"):
+        if derived is None:
+            print("No derived artifacts stored, computing them from scratch")
+            derived = build_derived(merged)
+        else:
+            derived = update_derived(derived, old, merged, changed | inserted)
+
+    def save(path):
+        merged.save(path)
+        save_derived(path, derived)
+
+    with instrumentation.stage("write corpus store"):
+        replace_dir(store_path(data_dir), save)
+    # load_store reads the shards for field queries
+    if has_shards(data_dir):
+        with instrumentation.stage("write shards"):
+            replace_dir(shard_path(data_dir), merged.save_shards)
+    if os.path.exists(os.path.join(data_dir, "data.pkl")):
+        with instrumentation.stage("write pickle"):
+            save_pickle(data_dir, merged)
+
+    # keyed by the fingerprint of the store as it is read back
+    store = load_store(data_dir)
+    cache.put_result(_citation_matrix_institutions, derived["institution_citations"], store)
+    cache.put_result(_citation_matrix_fields, derived["field_citations"], store)
+    print("Done")
+
+
+# write(path + ".new") and swap it in for path, the old files may still be memory-mapped
+def replace_dir(path, write):
+    write(path + ".new")
+    if os.path.exists(path):
+        os.rename(path, path + ".old")
+    os.rename(path + ".new", path)
+    shutil.rmtree(path + ".old", ignore_errors=True)
+
+
+def save_pickle(data_dir, store):
+    # referred_papers links make the object graph deeply recursive
+    sys.setrecursionlimit(50000)
+    data = store.to_data()
+    del data["store"]
+    path = os.path.join(data_dir, "data.pkl")
+    with open(path + ".new", "wb") as fh:
+        pickle.dump(data, fh)
+    os.replace(path + ".new", path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-d",
+        "--data_dir",
+        default="data",
+        help="Directory where the corpus store (or data.pkl) resides",
+    )
+    parser.add_argument("-s", "--snapshot_dir", required=True, help="Directory of the new MAG snapshot")
+    parser.add_argument("-w", "--workers", type=int, default=1)
+    add_process_arguments(parser)
+    cache.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(argv)
+    instrumentation.configure_from_args(args)
+    cache.configure_from_args(args)
+    configure_processes(args.processes)
+    incremental_update(args.data_dir, args.snapshot_dir, args.workers)
+    instrumentation.finish_from_args(args)
+
+
+if __name__ == "__main__":
+    main()
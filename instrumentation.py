@@ -0,0 +1,208 @@
+import sys
+import json
+import time
+import resource
+import functools
+import threading
+import tracemalloc
+import contextlib
+import collections
+
+# Stage-level metrics for the pipeline.
+#
+# Code wraps its stages in `with instrumentation.stage(name) as s:` and reports rows
+# with s.update(read=..., kept=..., nbytes=...); analysis functions are decorated with
+# @instrumentation.timed. Every stage records wall time, rows read and kept, rows/s,
+# bytes/s, the RSS it added, the peak RSS of the process by its end (ru_maxrss can't
+# tell stages apart) and the peak traced Python/numpy allocations with trace_memory.
+# Entry points call configure() to get progress lines of the running
+# stage every interval seconds, which also flag stalled stages, and write_report()
+# for the final JSON report.
+
+MB = 1024 * 1024
+# stages kept for the report, long running processes (e.g. server.py) drop the oldest
+MAX_STAGES = 100000
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    maxrss = resource.getrusage(who).ru_maxrss
+    return maxrss / MB if sys.platform == "darwin" else maxrss / 1024
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * resource.getpagesize() / MB
+    except OSError:
+        return peak_rss_mb()
+
+
+class Stage:
+    def __init__(self, name, depth=0):
+        self.name = name
+        self.depth = depth
+        self.rows_read = 0
+        self.rows_kept = 0
+        self.bytes_read = 0
+        self.start = time.perf_counter()
+        self.end = None
+        # ru_maxrss is the peak of the whole process so far, not of this stage alone
+        self.process_peak_rss_mb = None
+        self.start_rss_mb = current_rss_mb()
+        self.rss_increase_mb = None
+        self.peak_traced_mb = None
+        self.last_progress = self.start
+
+    def update(self, read=0, kept=0, nbytes=0):
+        self.rows_read += read
+        self.rows_kept += kept
+        self.bytes_read += nbytes
+        if read or kept or nbytes:
+            self.last_progress = time.perf_counter()
+
+    @property
+    def seconds(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def progress(self, stall_after=60.0):
+        seconds = max(self.seconds, 1e-9)
+        line = f"[{self.name}] {self.seconds:.0f}s, "
+        if self.rows_read > 0:
+            line += (f"{self.rows_read} rows read, {self.rows_kept} kept, {self.rows_read / seconds:.0f} rows/s, "
+                     f"{self.bytes_read / MB / seconds:.1f} MB/s, ")
+        line += f"RSS {current_rss_mb():.0f} MB"
+        stalled = time.perf_counter() - self.last_progress
+        if self.rows_read > 0 and stalled > stall_after:
+            line += f", STALLED for {stalled:.0f}s"
+        return line
+
+    def to_dict(self):
+        seconds = max(self.seconds, 1e-9)
+        return {
+            "stage": self.name,
+            "depth": self.depth,
+            "seconds": self.seconds,
+            "rows_read": self.rows_read,
+            "rows_kept": self.rows_kept,
+            "bytes_read": self.bytes_read,
+            "rows_per_second": self.rows_read / seconds,
+            "bytes_per_second": self.bytes_read / seconds,
+            "process_peak_rss_mb": self.process_peak_rss_mb,
+            "rss_increase_mb": self.rss_increase_mb,
+            "peak_traced_mb": self.peak_traced_mb,
+        }
+
+
+class Metrics:
+    def __init__(self, interval=None, trace_memory=False):
+        self.interval = interval
+        self.trace_memory = trace_memory
+        self.stages = collections.deque(maxlen=MAX_STAGES)
+        # stages running in this thread, outermost first, so server request threads don't nest
+        # their stages into each other's; running holds those of all threads for the progress lines
+        self.local = threading.local()
+        self.running = []
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if interval:
+            threading.Thread(target=self._report_progress, daemon=True).start()
+
+    # progress of the latest started running stage every interval seconds, also when nothing moves
+    def _report_progress(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                current = self.running[-1] if self.running else None
+            if current is not None:
+                print(current.progress(stall_after=max(60.0, 3 * self.interval)), flush=True)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        active = self.active()
+        with self.lock:
+            current = Stage(name, len(active))
+            self.stages.append(current)
+            self.running.append(current)
+        active.append(current)
+        if self.trace_memory and current.depth == 0:
+            tracemalloc.reset_peak()
+        try:
+            yield current
+        finally:
+            current.end = time.perf_counter()
+            current.process_peak_rss_mb = peak_rss_mb()
+            current.rss_increase_mb = current_rss_mb() - current.start_rss_mb
+            if self.trace_memory:
+                current.peak_traced_mb = tracemalloc.get_traced_memory()[1] / MB
+            active.pop()
+            with self.lock:
+                self.running.remove(current)
+
+    def active(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def report(self):
+        return {
+            "seconds": time.perf_counter() - self.start,
+            "peak_rss_mb": peak_rss_mb(),
+            "peak_rss_children_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+            "stages": [s.to_dict() for s in self.stages],
+        }
+
+    def close(self):
+        self.stopped.set()
+
+
+# records stages without printing until configure() is called
+_metrics = Metrics()
+
+
+def configure(interval=10.0, trace_memory=False):
+    global _metrics
+    _metrics.close()
+    _metrics = Metrics(interval, trace_memory)
+
+
+def stage(name):
+    return _metrics.stage(name)
+
+
+# record every call of function as a stage
+def timed(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with stage(function.__name__):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def report():
+    return _metrics.report()
+
+
+def write_report(path):
+    with open(path, "w") as fh:
+        json.dump(report(), fh, indent=2)
+    print(f"Wrote metrics to {path}", flush=True)
+
+
+# add the standard instrumentation arguments to an entry point's parser
+def add_arguments(parser):
+    parser.add_argument("--progress_interval", type=float, default=10.0, help="Seconds between progress lines, 0 for none")
+    parser.add_argument("--metrics", default=None, help="Write a JSON metrics report to this file")
+    parser.add_argument("--trace_memory", action="store_true", help="Also trace peak Python/numpy allocations (slower)")
+
+
+def configure_from_args(args):
+    configure(args.progress_interval or None, args.trace_memory)
+
+
+def finish_from_args(args):
+    if args.metrics:
+        write_report(args.metrics)
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import sys
+import pickle
+from typing import List
+
+# Object model of the parsed MAG data (the data dict of data.pkl). Kept free of any
+# third-party imports so that unpickling data.pkl doesn't pull in the parsing or
+# analysis dependencies.
+#
+# The records are __slots__ classes with integer IDs, numeric fields parsed to int or
+# float and interned categorical strings. data.pkl files of the earlier dict based
+# classes (every field a str) still load, their fields are converted on unpickling.
+
+field_mapping = {
+    "0": "arxiv cs na",
+    "1": "arxiv cs mm",
+    "2": "arxiv cs lo",
+    "3": "arxiv cs cy",
+    "4": "arxiv cs cr",
+    "5": "arxiv cs dc",
+    "6": "arxiv cs hc",
+    "7": "arxiv cs ce",
+    "8": "arxiv cs ni",
+    "9": "arxiv cs cc",
+    "10": "arxiv cs ai",
+    "11": "arxiv cs ma",
+    "12": "arxiv cs gl",
+    "13": "arxiv cs ne",
+    "14": "arxiv cs sc",
+    "15": "arxiv cs ar",
+    "16": "arxiv cs cv",
+    "17": "arxiv cs gr",
+    "18": "arxiv cs et",
+    "19": "arxiv cs sy",
+    "20": "arxiv cs cg",
+    "21": "arxiv cs oh",
+    "22": "arxiv cs pl",
+    "23": "arxiv cs se",
+    "24": "arxiv cs lg",
+    "25": "arxiv cs sd",
+    "26": "arxiv cs si",
+    "27": "arxiv cs ro",
+    "28": "arxiv cs it",
+    "29": "arxiv cs pf",
+    "30": "arxiv cs cl",
+    "31": "arxiv cs ir",
+    "32": "arxiv cs ms",
+    "33": "arxiv cs fl",
+    "34": "arxiv cs ds",
+    "35": "arxiv cs os",
+    "36": "arxiv cs gt",
+    "37": "arxiv cs db",
+    "38": "arxiv cs dl",
+    "39": "arxiv cs dm",
+}
+
+
+MISSING_INT = -1
+
+
+def _int(value):
+    if value is None or value == "":
+        return MISSING_INT
+    return int(value)
+
+
+def _float(value):
+    if value is None or value == "":
+        return float("nan")
+    return float(value)
+
+
+# categorical strings (document types, country codes, dates, fields) repeat millions
+# of times, interning keeps one copy of each
+def _category(value):
+    return sys.intern(value)
+
+
+def _str(value):
+    return value
+
+
+# Records keep their fields in __slots__ and pickle them as a tuple in slot order.
+# Numeric fields are parsed once (MISSING_INT / nan when empty), _types maps the
+# converted fields to their parser; other fields (links to records) are kept as is.
+class Record:
+    __slots__ = ()
+    _types = {}
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # attribute dict, e.g. from a data.pkl written before the slots classes,
+            # which stored every field as the raw string
+            for name in self.__slots__:
+                value = state.get(name)
+                convert = self._types.get(name)
+                setattr(self, name, convert(value) if convert is not None else value)
+        else:
+            for name, value in zip(self.__slots__, state):
+                setattr(self, name, value)
+
+    @classmethod
+    def from_attributes(cls, **attributes):
+        obj = cls.__new__(cls)
+        obj.__setstate__(attributes)
+        return obj
+
+
+# https://learn.microsoft.com/en-us/academic-services/graph/reference-data-schema#affiliations
+class Affiliation(Record):
+    __slots__ = ("id", "rank", "normalized_name", "name", "official_page", "paper_count", "paper_family_count",
+                 "citation_count", "country_code", "latitude", "longitude")
+    _types = {"id": _int, "rank": _int, "normalized_name": _str, "name": _str, "official_page": _str,
+              "paper_count": _int, "paper_family_count": _int, "citation_count": _int, "country_code": _category,
+              "latitude": _float, "longitude": _float}
+
+    def __init__(self, data: List[str]):
+        assert len(data) == 14
+        self.id = int(data[0])
+        self.rank = _int(data[1])
+        self.normalized_name = data[2]
+        self.name = data[3]
+        self.official_page = data[5]
+        self.paper_count = _int(data[7])
+        self.paper_family_count = _int(data[8])
+        self.citation_count = _int(data[9])
+        self.country_code = sys.intern(data[10])
+        self.latitude = _float(data[11])
+        self.longitude = _float(data[12])
+
+    def __str__(self):
+        return f"Affiliation(ID: {self.id}, Name: {self.name}, Papers: {self.paper_count}, Citations: {self.citation_count}, Country: {self.country_code})"
+
+
+# https://learn.microsoft.com/en-us/academic-services/graph/reference-data-schema#paper-author-affiliations
+class PaperAuthor(Record):
+    __slots__ = ("paper_id", "author_id", "affiliation_id", "author_sequence_number", "original_author", "affiliation")
+    _types = {"paper_id": _int, "author_id": _int, "affiliation_id": _int, "author_sequence_number": _int,
+              "original_author": _str}
+
+    def __init__(self, data: List[str]):
+        assert len(data) == 6
+        self.paper_id = int(data[0])
+        self.author_id = _int(data[1])
+        # MISSING_INT for authors without affiliation
+        self.affiliation_id = _int(data[2])
+        self.author_sequence_number = _int(data[3])
+        self.original_author = data[4]
+        self.affiliation = None
+
+    def __str__(self):
+        return f"PaperAuthor(Paper: {self.paper_id}, Author: {self.author_id}:{self.original_author}, Affiliation: {self.affiliation_id}:{self.affiliation}, Author #: {self.author_sequence_number})"
+
+    def add_affiliation(self, affiliation: Affiliation):
+        self.affiliation = affiliation
+
+
+# https://learn.microsoft.com/en-us/academic-services/graph/reference-data-schema#papers
+class Paper(Record):
+    __slots__ = ("id", "rank", "doc_type", "title", "original_title", "year", "date", "references", "citations",
+                 "estimated_citations", "field", "authors", "referred_papers")
+    _types = {"id": _int, "rank": _int, "doc_type": _category, "title": _str, "original_title": _str, "year": _int,
+              "date": _category, "references": _int, "citations": _int, "estimated_citations": _int,
+              "field": _category}
+
+    def __init__(self, data: List[str], field: str):
+        assert len(data) == 26
+        self.id = int(data[0])
+        self.rank = _int(data[1])
+        self.doc_type = sys.intern(data[3])
+        self.title = data[4]
+        self.original_title = data[5]
+        self.year = _int(data[7])
+        self.date = sys.intern(data[8])
+        self.references = _int(data[18])
+        self.citations = _int(data[19])
+        self.estimated_citations = _int(data[20])
+        self.field = sys.intern(field)
+        self.authors : List[PaperAuthor] = []
+        self.referred_papers: List[Paper] = []
+
+    def __str__(self):
+        return f"Paper(ID: {self.id}, Type: {self.doc_type}, Field: {self.field}, Title: {self.title}, Date: {self.date}, Authors: {len(self.authors)}, Citations: {self.citations}, References: {self.references})"
+
+    def add_author(self, author: PaperAuthor):
+        self.authors.append(author)
+
+    def add_reference(self, paper: Paper):
+        self.referred_papers.append(paper)
+
+
+# data.pkl files were written with the classes living in parse_mag, or in __main__ when
+# parse_mag.py was run as a script; both resolve to the classes here
+class ModelUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if module in ("parse_mag", "__main__") and name in ("Paper", "PaperAuthor", "Affiliation"):
+            return globals()[name]
+        return super().find_class(module, name)
+
+
+# the data dict of a data.pkl; old files key papers and affiliations by the string ID, re-keyed
+# by the int ID of the records as in the files written now
+def load(fh):
+    data = ModelUnpickler(fh).load()
+    for name in ("papers", "affiliations"):
+        data[name] = {record.id: record for record in data[name].values()}
+    return data
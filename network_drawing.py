@@ -0,0 +1,132 @@
+import hashlib
+
+import numpy as np
+import networkx as nx
+from matplotlib.figure import Figure
+from matplotlib.path import Path
+from matplotlib.collections import PathCollection, PolyCollection
+
+import cache
+
+# Drawing helpers for the network visualizations.
+#
+# Figures are plain matplotlib Figures rendered by Agg (no pyplot state, no GUI
+# backend). Edges are drawn as one collection of curved paths plus one collection
+# of arrowheads instead of one FancyArrowPatch per edge, and node positions are
+# cached per graph so repeated plots of the same institutions keep their layout.
+
+_layouts = {}
+
+
+def new_figure(figsize=8):
+    fig = Figure(figsize=(figsize, figsize))
+    return fig, fig.subplots(1, 1)
+
+
+# digest of the edges of G and their weights, by node key, which the spring layout also depends on
+def _edge_digest(G, node_keys, weight="weight"):
+    key = dict(zip(G.nodes, node_keys))
+    edges = sorted((key[u], key[v], float(1.0 if w is None else w)) for u, v, w in G.edges(data=weight))
+    return hashlib.sha1(repr(edges).encode("utf-8")).hexdigest()
+
+
+# spring layout of G, cached by the node keys (one per node of G, in G's node order), the
+# edges and the layout parameters, in memory and in the result cache when it is enabled
+def cached_layout(G, node_keys, **kwargs):
+    nodes = list(G.nodes)
+    order = sorted(range(len(nodes)), key=lambda i: node_keys[i])
+    parts = [[node_keys[i] for i in order], _edge_digest(G, node_keys, kwargs.get("weight", "weight")),
+             sorted(kwargs.items())]
+    memo_key = repr(parts)
+    if memo_key not in _layouts:
+        def layout():
+            pos = nx.spring_layout(G, **kwargs)
+            return np.array([pos[nodes[i]] for i in order], dtype=np.float64)
+        _layouts[memo_key] = cache.memoize("spring_layout", parts, layout)
+    positions = _layouts[memo_key]
+    return {nodes[i]: positions[k] for k, i in enumerate(order)}
+
+
+# display coordinates (pixels) of the node positions, with the view limits fixed to the nodes
+def _display_positions(ax, pos, nodes):
+    xy = np.array([pos[n] for n in nodes], dtype=np.float64).reshape(-1, 2)
+    # same padding as draw_networkx_edges
+    pad = 0.05 * (xy.max(axis=0) - xy.min(axis=0))
+    ax.update_datalim([xy.min(axis=0) - pad, xy.max(axis=0) + pad])
+    ax.autoscale_view()
+    return xy, ax.transData.transform(xy)
+
+
+# draw the directed edges (u, v) as arcs bent by rad (like connectionstyle 'arc3, rad=...'),
+# self loops as loops above their node; widths and colors are per edge, node_size is
+# per node (in points^2, as for draw_networkx_nodes) and keeps the arrows off the nodes
+def draw_edges(ax, pos, edges, widths, colors, node_size=300, arrowsize=10, rad=0.1, alpha=1.0):
+    nodes = list(pos)
+    index = {n: i for i, n in enumerate(nodes)}
+    if len(edges) == 0:
+        return None, None
+    source = np.array([index[u] for u, _ in edges])
+    target = np.array([index[v] for _, v in edges])
+    widths = np.broadcast_to(np.asarray(widths, dtype=np.float64), (len(edges),))
+    _, display = _display_positions(ax, pos, nodes)
+    points_to_pixels = ax.figure.dpi / 72.0
+    radius = np.broadcast_to(np.sqrt(np.asarray(node_size, dtype=np.float64)) / 2, (len(nodes),)) * points_to_pixels
+
+    start, end = display[source], display[target]
+    loop = source == target
+    # control point of the quadratic bezier, same construction as matplotlib's arc3
+    ctrl = 0.5 * (start + end) + rad * np.stack([end[:, 1] - start[:, 1], start[:, 0] - end[:, 0]], axis=1)
+
+    def towards(a, b, distance):
+        d = b - a
+        length = np.maximum(np.hypot(d[:, 0], d[:, 1]), 1e-9)[:, None]
+        return a + d * np.minimum(distance[:, None] / length, 0.5)
+
+    arc_start = towards(start, ctrl, radius[source])
+    arc_end = towards(end, ctrl, radius[target] + 0.4 * arrowsize * points_to_pixels)
+    tip = towards(end, ctrl, radius[target])
+
+    # self loops, as drawn by networkx: a loop of a tenth of the axes height
+    v_shift = 0.1 * ax.get_window_extent().height
+    h_shift = 0.5 * v_shift
+
+    inverse = ax.transData.inverted()
+    paths = []
+    for e in range(len(edges)):
+        if loop[e]:
+            p = start[e]
+            vertices = p + np.array([[0, v_shift], [h_shift, v_shift], [h_shift, 0], [0, 0],
+                                     [-h_shift, 0], [-h_shift, v_shift], [0, v_shift]])
+            codes = [Path.MOVETO] + [Path.CURVE4] * 6
+        else:
+            vertices = np.stack([arc_start[e], ctrl[e], arc_end[e]])
+            codes = [Path.MOVETO, Path.CURVE3, Path.CURVE3]
+        paths.append((vertices, codes))
+
+    # one inverse transform for every vertex of every edge
+    vertices = inverse.transform(np.concatenate([v for v, _ in paths]))
+    offsets = np.cumsum([0] + [len(v) for v, _ in paths])
+    arcs = PathCollection(
+        [Path(vertices[offsets[e]:offsets[e + 1]], codes) for e, (_, codes) in enumerate(paths)],
+        facecolors="none",
+        edgecolors=colors,
+        linewidths=widths,
+        alpha=alpha,
+        zorder=1,
+    )
+    ax.add_collection(arcs, autolim=False)
+
+    # arrowheads ('-|>' style) pointing along the last segment of each path
+    head_end = np.where(loop[:, None], start + np.array([0, v_shift]), tip)
+    head_from = np.where(loop[:, None], start + np.array([-h_shift, v_shift]), ctrl)
+    direction = head_end - head_from
+    direction /= np.maximum(np.hypot(direction[:, 0], direction[:, 1]), 1e-9)[:, None]
+    normal = np.stack([-direction[:, 1], direction[:, 0]], axis=1)
+    length = (0.4 * arrowsize + widths) * points_to_pixels
+    half_width = (0.2 * arrowsize + widths) * points_to_pixels
+    base = head_end - direction * length[:, None]
+    triangles = np.stack([head_end, base + normal * half_width[:, None], base - normal * half_width[:, None]], axis=1)
+    triangles = inverse.transform(triangles.reshape(-1, 2)).reshape(-1, 3, 2)
+    heads = PolyCollection(triangles, facecolors=colors, edgecolors=colors, linewidths=0, alpha=alpha, zorder=1)
+    ax.add_collection(heads, autolim=False)
+    return arcs, heads
@@ -0,0 +1,81 @@
+import os
+import gzip
+
+import numpy as np
+
+# ogbn-arxiv node labels and MAG paper IDs as numpy arrays, read straight from the
+# dataset's csv files (plain or gzipped) and cached next to them as .npy.
+#
+# The files are looked up in <data_dir>/arxiv (the extracted arxiv.zip) and in the
+# directory NodePropPredDataset downloads to (dataset/ogbn_arxiv). Only if neither has
+# the labels, ogb is imported to download the dataset.
+
+OGB_ROOT = "dataset"
+
+
+def _candidates(data_dir, name):
+    for root in [f"{data_dir}/arxiv", f"{OGB_ROOT}/ogbn_arxiv"]:
+        for path in [f"{root}/{name}", f"{root}/{name}.gz"]:
+            yield path
+
+
+def _find(data_dir, name):
+    for path in _candidates(data_dir, name):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _read_text(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as fh:
+        return fh.read()
+
+
+# integers of a csv file, skip_header drops its first line
+def _read_ints(path, columns, skip_header=False):
+    text = _read_text(path)
+    if skip_header:
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+    values = np.array(text.replace(",", " ").split(), dtype=np.int64)
+    return values.reshape(-1, columns) if columns > 1 else values
+
+
+# the array cached in path.npy, rebuilt with read() when it is missing or older than path
+def _cached(path, read):
+    cache_path = path[:-3] if path.endswith(".gz") else path
+    cache_path = os.path.splitext(cache_path)[0] + ".npy"
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+        return np.load(cache_path)
+    values = read()
+    try:
+        np.save(cache_path, values)
+    except OSError:
+        # read-only dataset directory
+        pass
+    return values
+
+
+# field label of every node
+def load_labels(data_dir):
+    path = _find(data_dir, "raw/node-label.csv")
+    if path is None:
+        # ogb is only needed to download the dataset
+        from ogb.nodeproppred import NodePropPredDataset
+        NodePropPredDataset(name="ogbn-arxiv", root=OGB_ROOT)
+        path = _find(data_dir, "raw/node-label.csv")
+    return _cached(path, lambda: _read_ints(path, 1))
+
+
+# MAG paper ID of every node
+def load_paper_ids(data_dir):
+    path = _find(data_dir, "mapping/nodeidx2paperid.csv")
+    if path is None:
+        raise FileNotFoundError(f"nodeidx2paperid.csv not found in {data_dir}/arxiv/mapping or {OGB_ROOT}/ogbn_arxiv/mapping")
+
+    def read():
+        rows = _read_ints(path, 2, skip_header=True)
+        paper_ids = np.zeros(len(rows), dtype=np.int64)
+        paper_ids[rows[:, 0]] = rows[:, 1]
+        return paper_ids
+    return _cached(path, read)
@@ -1,211 +1,429 @@
 from __future__ import annotations
 
+import io
+import os
 import sys
 import argparse
+import collections
+import multiprocessing
 from typing import List, Dict
-import codecs
-import csv
-from ogb.nodeproppred import NodePropPredDataset
 import pickle
 
-field_mapping = {
-    "0": "arxiv cs na",
-    "1": "arxiv cs mm",
-    "2": "arxiv cs lo",
-    "3": "arxiv cs cy",
-    "4": "arxiv cs cr",
-    "5": "arxiv cs dc",
-    "6": "arxiv cs hc",
-    "7": "arxiv cs ce",
-    "8": "arxiv cs ni",
-    "9": "arxiv cs cc",
-    "10": "arxiv cs ai",
-    "11": "arxiv cs ma",
-    "12": "arxiv cs gl",
-    "13": "arxiv cs ne",
-    "14": "arxiv cs sc",
-    "15": "arxiv cs ar",
-    "16": "arxiv cs cv",
-    "17": "arxiv cs gr",
-    "18": "arxiv cs et",
-    "19": "arxiv cs sy",
-    "20": "arxiv cs cg",
-    "21": "arxiv cs oh",
-    "22": "arxiv cs pl",
-    "23": "arxiv cs se",
-    "24": "arxiv cs lg",
-    "25": "arxiv cs sd",
-    "26": "arxiv cs si",
-    "27": "arxiv cs ro",
-    "28": "arxiv cs it",
-    "29": "arxiv cs pf",
-    "30": "arxiv cs cl",
-    "31": "arxiv cs ir",
-    "32": "arxiv cs ms",
-    "33": "arxiv cs fl",
-    "34": "arxiv cs ds",
-    "35": "arxiv cs os",
-    "36": "arxiv cs gt",
-    "37": "arxiv cs db",
-    "38": "arxiv cs dl",
-    "39": "arxiv cs dm",
-}
-
-class Affiliation:
-    def __init__(self, data: List[str]):
-        assert len(data) == 14
-        self.id = data[0]
-        self.rank = data[1]
-        self.normalized_name = data[2]
-        self.name = data[3]
-        self.official_page = data[5]
-        self.paper_count = data[7]
-        self.paper_family_count = data[8]
-        self.citation_count = data[9]
-        self.country_code = data[10]
-        self.latitude = data[11]
-        self.longitude = data[12]
-
-    def __str__(self):
-        return f"Affiliation(ID: {self.id}, Name: {self.name}, Papers: {self.paper_count}, Citations: {self.citation_count}, Country: {self.country_code})"
-
-
-# https://learn.microsoft.com/en-us/academic-services/graph/reference-data-schema#paper-author-affiliations
-class PaperAuthor:
-    def __init__(self, data: List[str]):
-        assert len(data) == 6
-        self.paper_id = data[0]
-        self.author_id = data[1]
-        self.affiliation_id = data[2]
-        self.author_sequence_number = data[3]
-        self.original_author = data[4]
-        self.affiliation = None
-
-    def __str__(self):
-        return f"PaperAuthor(Paper: {self.paper_id}, Author: {self.author_id}:{self.original_author}, Affiliation: {self.affiliation_id}:{self.affiliation}, Author #: {self.author_sequence_number})"
-
-    def add_affiliation(self, affiliation: Affiliation):
-        self.affiliation = affiliation
-
-
-# https://learn.microsoft.com/en-us/academic-services/graph/reference-data-schema#papers
-class Paper:
-    def __init__(self, data: List[str], field: str):
-        assert len(data) == 26
-        self.id = data[0]
-        self.rank = data[1]
-        self.doc_type = data[3]
-        self.title = data[4]
-        self.original_title = data[5]
-        self.year = data[7]
-        self.date = data[8]
-        self.references = data[18]
-        self.citations = data[19]
-        self.estimated_citations = data[20]
-        self.field = field
-        self.authors : List[PaperAuthor] = []
-        self.referred_papers: List[Paper] = []
-
-    def __str__(self):
-        return f"Paper(ID: {self.id}, Type: {self.doc_type}, Field: {self.field}, Title: {self.title}, Date: {self.date}, Authors: {len(self.authors)}, Citations: {self.citations}, References: {self.references})"
-
-    def add_author(self, author: PaperAuthor):
-        self.authors.append(author)
-
-    def add_reference(self, paper: Paper):
-        self.referred_papers.append(paper)
-
-
-mag_to_node_idx = {}
-mag_to_field = {}
-paper_info: Dict[str, Paper] = {}
-papers: List[Paper] = []
-affiliations: Dict[str, Affiliation] = {}
-
-
-def parse_data(data_dir):
-    sys.setrecursionlimit(50000)
-    dataset = NodePropPredDataset(name = "ogbn-arxiv")
-    graph, label = dataset[0]
-
-    with open(f"{data_dir}/arxiv/mapping/nodeidx2paperid.csv", 'r') as fd:
-        for idx, row in enumerate(fd):
-            if idx == 0:
-                # skip header
-                continue
-            node_idx, mag = row.rstrip("\n").split(",")
-            #print(row)
-            mag_to_node_idx[mag] = node_idx
-            field_idx = str(label[int(node_idx)].item())
-            field = field_mapping[field_idx]
-            mag_to_field[mag] = field
-    print(len(mag_to_node_idx))
+import numpy as np
+
+import instrumentation
+from mag_model import field_mapping, Affiliation, PaperAuthor, Paper, MISSING_INT
+from ogbn_arxiv import load_labels, load_paper_ids
+
+
+BLOCK_SIZE = 16 * 1024 * 1024
+# lines read by the serial path between updates of the stage counts
+UPDATE_LINES = 100000
+
+
+# rows of a MAG dump are kept when their paper ID is among the wanted papers
+def keep_row(line, wanted):
+    # papers not part of ogbn-arxiv are dropped
+    return line[0] in wanted
+
+
+# MAG dumps are read straight from their .zst archive when present, the plain text file is the fallback
+def resolve_input(data_dir, name):
+    compressed = f"{data_dir}/{name}.zst"
+    if os.path.exists(compressed):
+        return compressed
+    return f"{data_dir}/{name}"
+
+
+def open_text(path):
+    if path.endswith(".zst"):
+        import zstandard
+        # stream the decompressed text, nothing is materialized on disk
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+        return io.TextIOWrapper(reader, encoding="utf-8")
+    return open(path, "r")
+
+
+# split a file into num_ranges byte ranges whose boundaries fall on line starts
+def byte_ranges(path, num_ranges):
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as fh:
+        for i in range(1, num_ranges):
+            offset = max(size * i // num_ranges, bounds[-1])
+            if offset >= size:
+                break
+            fh.seek(offset)
+            # the line straddling offset belongs to the previous range
+            fh.readline()
+            bounds.append(fh.tell())
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+_worker_wanted = None
+
+
+def _init_worker(wanted):
+    global _worker_wanted
+    _worker_wanted = wanted
+
+
+# parse the lines starting in [start, end) and return the ones that are kept,
+# the number of lines read and their size in bytes
+def _scan_range(task):
+    path, start, end = task
+    rows = []
+    num_lines = 0
+    with open(path, "rb") as fh:
+        fh.seek(start)
+        position = start
+        while position < end:
+            raw = fh.readline()
+            if not raw:
+                break
+            position += len(raw)
+            num_lines += 1
+            line = raw.decode("utf-8").rstrip("\n").split("\t")
+            if keep_row(line, _worker_wanted):
+                rows.append(line)
+    return rows, num_lines, position - start
+
+
+# parse a batch of lines read from a compressed stream, same results as _scan_range
+def _scan_lines(task):
+    lines = task
+    rows = []
+    num_bytes = 0
+    for line in lines:
+        num_bytes += len(line)
+        line = line.rstrip("\n").split("\t")
+        if keep_row(line, _worker_wanted):
+            rows.append(line)
+    return rows, len(lines), num_bytes
+
+
+def _line_batches(path, batch_size=100000):
+    with open_text(path) as fh:
+        batch = []
+        for line in fh:
+            batch.append(line)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+# iterate over the kept rows of a MAG dump in file order, using a process pool when workers > 1;
+# rows read and kept and bytes read (characters for .zst input) are counted on stage
+def iter_rows(path, wanted, workers=1, stage=None):
+    if workers <= 1:
+        # counted per batch of lines like the worker results, not per line
+        num_lines = num_kept = num_bytes = 0
+        try:
+            with open_text(path) as fh:
+                for line in fh:
+                    row = line.rstrip("\n").split("\t")
+                    num_lines += 1
+                    num_bytes += len(line)
+                    if keep_row(row, wanted):
+                        num_kept += 1
+                        yield row
+                    if num_lines == UPDATE_LINES and stage is not None:
+                        stage.update(read=num_lines, kept=num_kept, nbytes=num_bytes)
+                        num_lines = num_kept = num_bytes = 0
+        finally:
+            if stage is not None:
+                stage.update(read=num_lines, kept=num_kept, nbytes=num_bytes)
+        return
+
+    def counted(result):
+        rows, num_lines, num_bytes = result
+        if stage is not None:
+            stage.update(read=num_lines, kept=len(rows), nbytes=num_bytes)
+        return rows
+
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(set(wanted),)) as pool:
+        if not path.endswith(".zst"):
+            # a few ranges per worker to even out the load, results are merged in range order
+            tasks = [(path, start, end) for start, end in byte_ranges(path, 4 * workers)]
+            for result in pool.imap(_scan_range, tasks):
+                yield from counted(result)
+            return
+
+        # a compressed stream can't be split, so decompress here and hand line batches
+        # to the workers, keeping only a bounded number of batches in flight
+        pending = collections.deque()
+        for task in _line_batches(path):
+            pending.append(pool.apply_async(_scan_lines, (task,)))
+            if len(pending) >= 2 * workers:
+                yield from counted(pending.popleft().get())
+        while pending:
+            yield from counted(pending.popleft().get())
+
+
+# whole lines of path from byte offset start to end, in blocks of about block_size bytes
+def iter_blocks(path, start=0, end=None, block_size=BLOCK_SIZE):
+    if path.endswith(".zst"):
+        import zstandard
+        fh = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+    else:
+        fh = open(path, "rb")
+        fh.seek(start)
+    remaining = None if end is None else end - start
+    rest = b""
+    with fh:
+        while True:
+            size = block_size if remaining is None else min(block_size, remaining)
+            data = fh.read(size) if size > 0 else b""
+            if not data:
+                if rest:
+                    # last line without a newline
+                    yield rest + b"\n"
+                return
+            if remaining is not None:
+                remaining -= len(data)
+            data = rest + data
+            cut = data.rfind(b"\n") + 1
+            rest = data[cut:]
+            if cut > 0:
+                yield data[:cut]
+
+
+# line and column boundaries of a block of tab separated lines, so that ID columns are
+# parsed with numpy and only the rows that are kept are decoded
+class LineBlock:
+    def __init__(self, data):
+        self.data = data
+        self.buffer = np.frombuffer(data, dtype=np.uint8)
+        self.ends = np.flatnonzero(self.buffer == ord("\n"))
+        self.starts = np.concatenate([[0], self.ends[:-1] + 1])
+        # with a sentinel past the end of the block
+        self.tabs = np.append(np.flatnonzero(self.buffer == ord("\t")), len(data))
+        self.first_tab = np.searchsorted(self.tabs, self.starts)
+
+    def __len__(self):
+        return len(self.starts)
+
+    # k-th tab of the lines, the line end for lines with fewer tabs
+    def _tab(self, k, lines):
+        return np.minimum(self.tabs[np.minimum(self.first_tab[lines] + k, len(self.tabs) - 1)], self.ends[lines])
+
+    # byte offsets of column in the lines (all by default), empty at the line end when a line has fewer columns
+    def column_bounds(self, column, lines=slice(None)):
+        start = self.starts[lines] if column == 0 else np.minimum(self._tab(column - 1, lines) + 1, self.ends[lines])
+        return start, self._tab(column, lines)
+
+    # integer column of the lines, MISSING_INT where it is empty
+    def ints(self, column, lines=slice(None)):
+        start, end = self.column_bounds(column, lines)
+        length = end - start
+        values = np.zeros(len(start), dtype=np.int64)
+        for k in range(int(length.max(initial=0))):
+            has_digit = length > k
+            digit = self.buffer[np.where(has_digit, start + k, 0)].astype(np.int64) - ord("0")
+            if ((digit < 0) | (digit > 9))[has_digit].any():
+                raise ValueError(f"Non-integer value in column {column}")
+            values = np.where(has_digit, values * 10 + digit, values)
+        values[length == 0] = MISSING_INT
+        return values
+
+    def rows(self, lines):
+        data = self.data
+        return [data[s:e].decode("utf-8").split("\t") for s, e in zip(self.starts[lines].tolist(), self.ends[lines].tolist())]
+
+
+# sorted paper IDs and their positions, what IDs are joined against
+def id_index(paper_ids):
+    paper_ids = np.asarray(paper_ids, dtype=np.int64)
+    order = np.argsort(paper_ids, kind="stable")
+    return paper_ids[order], order
+
+
+# position of every value in the indexed paper IDs, MISSING_INT if it isn't one of them
+def lookup(index, values):
+    sorted_ids, order = index
+    positions = np.full(len(values), MISSING_INT, dtype=np.int64)
+    if len(sorted_ids) == 0:
+        return positions
+    # searchsorted is several times faster on sorted queries
+    value_order = np.argsort(values)
+    values = values[value_order]
+    pos = np.minimum(np.searchsorted(sorted_ids, values), len(sorted_ids) - 1)
+    positions[value_order] = np.where(sorted_ids[pos] == values, order[pos], MISSING_INT)
+    return positions
+
+
+# join one block of paperReferences (both papers wanted) or paperAuthorAffilliations
+# (paper wanted) against the indexed paper IDs
+def join_block(kind, data, index):
+    block = LineBlock(data)
+    paper = lookup(index, block.ints(0))
+    keep = np.flatnonzero(paper != MISSING_INT)
+    if kind == "references":
+        # the cited paper is only parsed for the rows whose citing paper is wanted
+        reference = lookup(index, block.ints(1, keep))
+        cited = reference != MISSING_INT
+        result = (paper[keep[cited]], reference[cited])
+    else:
+        result = (paper[keep], block.rows(keep))
+    return result, len(block), len(data)
+
+
+def _join_range(task):
+    path, kind, start, end = task
+    results, num_lines, num_bytes = [], 0, 0
+    for data in iter_blocks(path, start, end):
+        result, lines, size = join_block(kind, data, _worker_wanted)
+        results.append(result)
+        num_lines += lines
+        num_bytes += size
+    return _concat_results(kind, results), num_lines, num_bytes
+
+
+def _join_data(task):
+    kind, data = task
+    return join_block(kind, data, _worker_wanted)
+
+
+def _concat_results(kind, results):
+    if kind == "references":
+        return tuple(np.concatenate([r[i] for r in results] or [np.zeros(0, dtype=np.int64)]) for i in range(2))
+    return np.concatenate([r[0] for r in results] or [np.zeros(0, dtype=np.int64)]), [row for r in results for row in r[1]]
+
+
+# join a MAG dump against paper_ids block by block in file order, using a process pool when
+# workers > 1: (source, target) paper positions of the references with both papers among
+# paper_ids, or (paper positions, rows) of the authors of those papers
+def join_ids(path, kind, paper_ids, workers=1, stage=None):
+    index = id_index(paper_ids)
+    results = []
+
+    def counted(output):
+        result, num_lines, num_bytes = output
+        if stage is not None:
+            stage.update(read=num_lines, kept=len(result[0]), nbytes=num_bytes)
+        results.append(result)
+
+    if workers <= 1:
+        for data in iter_blocks(path):
+            counted(join_block(kind, data, index))
+        return _concat_results(kind, results)
+
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(index,)) as pool:
+        if not path.endswith(".zst"):
+            tasks = [(path, kind, start, end) for start, end in byte_ranges(path, 4 * workers)]
+            for output in pool.imap(_join_range, tasks):
+                counted(output)
+        else:
+            # decompressed here, with a bounded number of blocks in flight
+            pending = collections.deque()
+            for data in iter_blocks(path):
+                pending.append(pool.apply_async(_join_data, ((kind, data),)))
+                if len(pending) >= 2 * workers:
+                    counted(pending.popleft().get())
+            while pending:
+                counted(pending.popleft().get())
+    return _concat_results(kind, results)
+
+
+# parse the MAG dumps in data_dir into the data dict of Paper/PaperAuthor/Affiliation objects,
+# labels are the field labels of the ogbn-arxiv nodes (read from the ogbn-arxiv label file if not given)
+def build_data(data_dir, workers=1, labels=None):
+    mag_to_field = {}
+    papers: List[Paper] = []
+    affiliations: Dict[int, Affiliation] = {}
+
+    with instrumentation.stage("labels") as stage:
+        paper_ids = load_paper_ids(data_dir)
+        label = load_labels(data_dir) if labels is None else np.asarray(labels)
+        field_names = np.array([field_mapping[str(i)] for i in range(len(field_mapping))], dtype=object)
+        mag_ids = paper_ids.astype(str).tolist()
+        mag_to_field = dict(zip(mag_ids, field_names[label.reshape(-1)[:len(mag_ids)]].tolist()))
+        stage.update(read=len(mag_ids), kept=len(mag_ids))
+    print(len(paper_ids))
 
 
     # process affiliations
-    with open(f"{data_dir}/affiliations.txt", 'r') as a_file:
-        for idx, line in enumerate(a_file):
-            line = line.rstrip("\n").split("\t")
-            affiliation = Affiliation(line)
-            affiliations[affiliation.id] = affiliation
-            #print(affiliation)
+    with instrumentation.stage("affiliations") as stage:
+        with open_text(resolve_input(data_dir, "affiliations.txt")) as a_file:
+            for idx, line in enumerate(a_file):
+                stage.update(read=1, kept=1, nbytes=len(line))
+                line = line.rstrip("\n").split("\t")
+                affiliation = Affiliation(line)
+                affiliations[affiliation.id] = affiliation
+                #print(affiliation)
     print("Processed affiliations")
 
 
     # process papers
-    with open(f"{data_dir}/papers.txt", 'r') as paper_file:
-        for idx, line in enumerate(paper_file):
-            line = line.rstrip("\n").split("\t")
-            paper_id = line[0]
-            if paper_id not in mag_to_field:
-                # not part of ogbn-arxiv
-                continue
-            #print(line)
-            field = mag_to_field[paper_id]
-            paper = Paper(line, field)
-            paper_info[paper.id] = paper
-            papers.append(paper)
-            if len(papers) % 500 == 0:
-                print(f"Parsed {len(papers)} papers", flush=True)
-                #break
-            #print(paper)
-            #print(graph['node_year'][int(magToNodeIdx[paperId])].item())
-
-
-    # process paper authors
-    with open(f"{data_dir}/paperAuthorAffilliations.txt", 'r') as a_file:
-        for idx, line in enumerate(a_file):
-            line = line.rstrip("\n").split("\t")
+    with instrumentation.stage("papers") as stage:
+        for line in iter_rows(resolve_input(data_dir, "papers.txt"), mag_to_field, workers, stage):
+            field = mag_to_field[line[0]]
+            papers.append(Paper(line, field))
+    paper_ids = np.array([p.id for p in papers], dtype=np.int64)
+
+    # process paper authors, only the rows of wanted papers become PaperAuthor objects
+    with instrumentation.stage("authors") as stage:
+        paper_idx, rows = join_ids(resolve_input(data_dir, "paperAuthorAffilliations.txt"), "authors", paper_ids, workers, stage)
+        for idx, line in zip(paper_idx.tolist(), rows):
             author = PaperAuthor(line)
-            if author.paper_id not in paper_info:
-                continue
-            if len(author.affiliation_id) > 0:
+            if author.affiliation_id != MISSING_INT:
                 affiliation = affiliations[author.affiliation_id]
                 author.add_affiliation(affiliation)
-            if idx % 5000 == 0:
-                print(f"Parsed {idx} authors")
-            #print(author)
-            paper_info[author.paper_id].add_author(author)
-
-    # process paper references
-    with open(f"{data_dir}/paperReferences.txt", 'r') as a_file:
-        for idx, line in enumerate(a_file):
-            line = line.rstrip("\n").split("\t")
-            paper_id, paper_reference_id = line
-            # only keep track of references of papers within obgn-arxiv
-            if paper_id not in paper_info or paper_reference_id not in paper_info:
-                continue
-            paper_info[paper_id].add_reference(paper_info[paper_reference_id])
+            papers[idx].add_author(author)
+
+    # process paper references, only keep track of references within ogbn-arxiv
+    with instrumentation.stage("references") as stage:
+        source, target = join_ids(resolve_input(data_dir, "paperReferences.txt"), "references", paper_ids, workers, stage)
+        for s, t in zip(source.tolist(), target.tolist()):
+            papers[s].add_reference(papers[t])
 
     print(f"Papers: {len(papers)}")
-    data = {"papers": paper_info, "affiliations": affiliations, "fields": field_mapping}
-    with open(f"data/data.pkl", "wb") as handle:
-        pickle.dump(data, handle)
+    return {"papers": {p.id: p for p in papers}, "affiliations": affiliations, "fields": field_mapping}
+
+
+def parse_data(data_dir, output_format="both", workers=1, output_dir="data", labels=None):
+    sys.setrecursionlimit(50000)
+    data = build_data(data_dir, workers, labels)
+    if output_format in ("pickle", "both"):
+        with instrumentation.stage("write pickle"):
+            with open(f"{output_dir}/data.pkl", "wb") as handle:
+                pickle.dump(data, handle)
+    if output_format in ("columnar", "both"):
+        from corpus_store import CorpusStore, store_path
+        with instrumentation.stage("write corpus store"):
+            CorpusStore.from_data(data).save(store_path(output_dir))
+    if output_format == "shards":
+        from corpus_store import CorpusStore, shard_path
+        with instrumentation.stage("write shards"):
+            CorpusStore.from_data(data).save_shards(shard_path(output_dir))
     print("Done")
 
 
-if __name__ == "__main__":
+def main(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument("-d", "--data_dir")
-    args = parser.parse_args()
-    parse_data(args.data_dir)
+    parser.add_argument(
+        "--format",
+        choices=["pickle", "columnar", "both", "shards"],
+        default="both",
+        help="Write data/data.pkl, the memory-mappable data/corpus store, both, or one data/shards shard per field",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes parsing byte ranges of the MAG dumps in parallel",
+    )
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args(argv)
+    instrumentation.configure_from_args(args)
+    parse_data(args.data_dir, output_format=args.format, workers=args.workers)
+    instrumentation.finish_from_args(args)
+
+
+if __name__ == "__main__":
+    main()
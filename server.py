@@ -0,0 +1,192 @@
+import json
+import argparse
+import urllib.parse
+import urllib.request
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import cache
+from corpus_store import load_store
+
+# Resident query server: loads the corpus, its indexes and the citation matrices
+# once and answers read-only queries over localhost HTTP from a thread pool.
+#
+#   python3 server.py -d data --port 8765    (or python3 cli.py serve -d data --port 8765)
+#   python3 analysis.py --server http://localhost:8765
+#
+# Queries are GET requests, repeated parameters make lists:
+#   /top_institutions?top=100&fields=Machine+Learning&fields=Robotics&rank_by=pagerank
+#   /field_citations?top=100&from_year=2010&to_year=2015
+#   /group_citations?fields=...&all_groups=1
+#   /top_institution_subgraph?fields=...
+
+
+class Corpus:
+    def __init__(self, data_dir):
+        from analysis import (
+            citation_matrix_institutions,
+            citation_matrix_fields,
+            field_citation_tensor,
+        )
+        from group_affiliations import get_affiliation_groups
+
+        self.data = load_store(data_dir)
+        self.affiliation_idx, self.affiliations, self.affiliation_group = get_affiliation_groups(data_dir, self.data)
+        # warm up the matrices most queries are derived from, so request threads only read them;
+        # the per-year tables are built on the first year range query instead
+        citation_matrix_institutions(self.data)
+        citation_matrix_fields(self.data)
+        field_citation_tensor(self.data)
+
+    def top_institutions(self, top=100, fields=[], from_year=None, to_year=None, rank_by="citations"):
+        from analysis import top_institutions
+        return top_institutions(self.data, top, fields, from_year, to_year, rank_by)
+
+    def field_citations(self, top=100, from_year=None, to_year=None):
+        from analysis import top_field_citations
+        return top_field_citations(self.data, top, from_year, to_year)
+
+    def group_citations(self, fields=[], all_groups=0, from_year=None, to_year=None):
+        from affilation_interactions import group_citation_counts, ACADEMIA_INDUSTRY
+        author_groups, citations, author_group_count = group_citation_counts(
+            self.data, self.affiliation_idx, self.affiliation_group, fields, {} if all_groups else ACADEMIA_INDUSTRY,
+            from_year, to_year,
+        )
+        return {"author_groups": author_groups, "citations": citations, "author_group_count": author_group_count}
+
+    def top_institution_subgraph(self, fields=[], rank_by="citations"):
+        from top_institution_visualization import top_institution_subgraph
+        top_k_idx, citations, cited = top_institution_subgraph(
+            self.data, self.affiliation_idx, self.affiliation_group, fields, rank_by=rank_by
+        )
+        return {
+            "affiliations": self.affiliations,
+            "affiliation_group": self.affiliation_group,
+            "top_k_idx": top_k_idx,
+            "citations": citations,
+            "cited": cited,
+        }
+
+
+OPERATIONS = {
+    "top_institutions": {"top": int, "fields": list, "from_year": int, "to_year": int, "rank_by": str},
+    "field_citations": {"top": int, "from_year": int, "to_year": int},
+    "group_citations": {"fields": list, "all_groups": int, "from_year": int, "to_year": int},
+    "top_institution_subgraph": {"fields": list, "rank_by": str},
+}
+
+
+def to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {k: to_json(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(v) for v in value]
+    return value
+
+
+def parse_query(operation, query):
+    params = urllib.parse.parse_qs(query)
+    arguments = {}
+    for name, kind in OPERATIONS[operation].items():
+        if name not in params:
+            continue
+        arguments[name] = params[name] if kind is list else kind(params[name][-1])
+    return arguments
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    corpus = None
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        operation = url.path.strip("/")
+        if operation == "health":
+            return self.reply(200, {"status": "ok"})
+        if operation not in OPERATIONS:
+            return self.reply(404, {"error": f"Unknown operation {operation}"})
+        try:
+            arguments = parse_query(operation, url.query)
+            result = getattr(self.corpus, operation)(**arguments)
+        except (ValueError, KeyError) as e:
+            return self.reply(400, {"error": str(e)})
+        self.reply(200, to_json(result))
+
+    def reply(self, status, body):
+        body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# HTTP server handing each connection to a fixed-size thread pool
+class PooledHTTPServer(HTTPServer):
+    def __init__(self, address, handler, workers):
+        super().__init__(address, handler)
+        self.pool = ThreadPoolExecutor(workers)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+def serve(data_dir, host="localhost", port=8765, workers=8, ready=None):
+    QueryHandler.corpus = Corpus(data_dir)
+    server = PooledHTTPServer((host, port), QueryHandler, workers)
+    print(f"Serving {data_dir} on http://{host}:{server.server_port}", flush=True)
+    if ready is not None:
+        ready(server)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+# client side, used by the --server flag of the CLIs
+def query(server, operation, **params):
+    query_string = urllib.parse.urlencode(params, doseq=True)
+    with urllib.request.urlopen(f"{server.rstrip('/')}/{operation}?{query_string}") as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+def main(argv=None):
+    from analysis import add_process_arguments, configure_processes
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-d",
+        "--data_dir",
+        default="data",
+        help="Directory where the corpus store (or data.pkl) and affiliation_type_raw.pkl reside",
+    )
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("-p", "--port", type=int, default=8765)
+    parser.add_argument("-w", "--workers", type=int, default=8, help="Number of request threads")
+    add_process_arguments(parser)
+    cache.add_arguments(parser)
+    args = parser.parse_args(argv)
+    cache.configure_from_args(args)
+    configure_processes(args.processes)
+    serve(args.data_dir, args.host, args.port, args.workers)
+
+
+if __name__ == "__main__":
+    main()
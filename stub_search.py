@@ -0,0 +1,104 @@
+import json
+import argparse
+import threading
+import urllib.parse
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Local stand-in for the search endpoint fetch_affiliation_group.py scrapes, serving
+# canned result pages so fetching, retries and resuming can be tried offline:
+#
+#   python3 stub_search.py --port 8766 --descriptions descriptions.json
+#   python3 fetch_affiliation_group.py --base_url http://localhost:8766/search
+#
+# descriptions maps a query (the affiliation name) to the type description on its
+# result page, queries without one get DEFAULT_DESCRIPTION. failures maps a query to
+# the HTTP statuses of its first requests (e.g. [503, 429]), before the page is served;
+# the last status is repeated forever if it is followed by "*" (e.g. [404, "*"]).
+
+DEFAULT_DESCRIPTION = "Organization"
+
+# the element parse_affiliation_type reads the description from
+RESULT_PAGE = """<html><body>
+<div class="BNeawe tAd8D AP7Wnd">{}</div>
+</body></html>"""
+
+
+class StubSearchHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query).get("q", [""])[0]
+        stub = self.server
+        with stub.lock:
+            attempt = stub.requests[query]
+            stub.requests[query] += 1
+        statuses = stub.failures.get(query, [])
+        if len(statuses) > 1 and statuses[-1] == "*":
+            status = statuses[min(attempt, len(statuses) - 2)]
+        else:
+            status = statuses[attempt] if attempt < len(statuses) else 200
+
+        if status == 200:
+            body = RESULT_PAGE.format(stub.descriptions.get(query, DEFAULT_DESCRIPTION)).encode("utf-8")
+        else:
+            body = f"HTTP {status}".encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# stub server with the number of requests per query in requests; port 0 picks a free port
+class StubSearchServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="localhost", port=0, descriptions={}, failures={}):
+        super().__init__((host, port), StubSearchHandler)
+        self.descriptions = dict(descriptions)
+        self.failures = dict(failures)
+        self.requests = Counter()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_port}/search"
+
+    # serve from a background thread, for tests
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("-p", "--port", type=int, default=8766)
+    parser.add_argument("--descriptions", default=None, help="JSON file mapping queries to type descriptions")
+    parser.add_argument("--failures", default=None, help="JSON file mapping queries to the statuses of their first requests")
+    args = parser.parse_args(argv)
+
+    descriptions, failures = {}, {}
+    if args.descriptions:
+        with open(args.descriptions, "r") as fh:
+            descriptions = json.load(fh)
+    if args.failures:
+        with open(args.failures, "r") as fh:
+            failures = json.load(fh)
+    server = StubSearchServer(args.host, args.port, descriptions, failures)
+    print(f"Serving canned search results on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
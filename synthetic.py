@@ -0,0 +1,185 @@
+import os
+import pickle
+import argparse
+
+import numpy as np
+
+from mag_model import field_mapping
+
+# Synthetic MAG-like dumps for testing and benchmarking the pipeline without the real
+# MAG dump and the ogbn-arxiv download. Writes, schema-correct:
+#
+#   affiliations.txt                   14 columns
+#   papers.txt                         26 columns
+#   paperAuthorAffilliations.txt       6 columns
+#   paperReferences.txt                PaperId, PaperReferenceId
+#   arxiv/mapping/nodeidx2paperid.csv  node idx, paper id (with header)
+#   arxiv/raw/node-label.csv           field label of every node (no header, as in ogbn-arxiv)
+#   affiliation_type_raw.pkl           affiliation index -> type description, as fetched
+#
+# Papers outside ogbn-arxiv (and their authors and references) are mixed in so the
+# filtering is exercised. Citations are drawn preferentially from a Pareto weight per
+# paper, which gives a power-law in-degree.
+
+AFFILIATION_KINDS = [
+    ("University of {}", "Public university"),
+    ("{} Institute of Technology", "Research institute"),
+    ("{} Research Laboratory", "Government agency"),
+    ("{} Inc.", "Technology company"),
+    ("{} Corporation", "Software company"),
+]
+WORDS = ["North", "South", "East", "West", "Lake", "River", "Mountain", "Valley", "Harbor", "Forest",
+         "Stone", "Bright", "Silver", "Golden", "Cedar", "Maple", "Pine", "Oak", "Red", "Blue"]
+COUNTRIES = ["US", "GB", "DE", "FR", "CN", "JP", "CA", "CH", "IN", "KR", ""]
+CHUNK = 100000
+
+
+def write_rows(path, columns):
+    with open(path, "w", encoding="utf-8") as fh:
+        num_rows = len(columns[0])
+        for start in range(0, num_rows, CHUNK):
+            chunk = [c[start:start + CHUNK] for c in columns]
+            fh.writelines("\t".join(map(str, row)) + "\n" for row in zip(*chunk))
+
+
+def affiliation_names(rng, num_affiliations):
+    kinds = rng.integers(0, len(AFFILIATION_KINDS), num_affiliations)
+    words = rng.integers(0, len(WORDS), (num_affiliations, 2))
+    names = [
+        AFFILIATION_KINDS[k][0].format(f"{WORDS[a]} {WORDS[b]} {i}")
+        for i, (k, (a, b)) in enumerate(zip(kinds, words))
+    ]
+    return names, [AFFILIATION_KINDS[k][1] for k in kinds]
+
+
+def generate(output_dir, num_papers=10000, num_affiliations=1000, authors_per_paper=3.0, references_per_paper=10.0,
+             citation_exponent=2.0, missing_affiliation=0.1, other_papers=0.2, seed=0):
+    rng = np.random.default_rng(seed)
+    os.makedirs(f"{output_dir}/arxiv/mapping", exist_ok=True)
+    os.makedirs(f"{output_dir}/arxiv/raw", exist_ok=True)
+
+    # affiliations
+    names, descriptions = affiliation_names(rng, num_affiliations)
+    affiliation_ids = 10000000 + np.sort(rng.choice(num_affiliations * 50, num_affiliations, replace=False))
+    empty = [""] * num_affiliations
+    write_rows(f"{output_dir}/affiliations.txt", [
+        affiliation_ids,
+        rng.integers(1000, 30000, num_affiliations),
+        [n.lower() for n in names],
+        names,
+        empty,
+        [f"http://www.affiliation{i}.example" for i in range(num_affiliations)],
+        empty,
+        rng.integers(0, 100000, num_affiliations),
+        rng.integers(0, 100000, num_affiliations),
+        rng.integers(0, 1000000, num_affiliations),
+        rng.choice(COUNTRIES, num_affiliations),
+        np.round(rng.uniform(-90, 90, num_affiliations), 4),
+        np.round(rng.uniform(-180, 180, num_affiliations), 4),
+        ["2016-06-24"] * num_affiliations,
+    ])
+    with open(f"{output_dir}/affiliation_type_raw.pkl", "wb") as fh:
+        pickle.dump(dict(enumerate(descriptions)), fh)
+
+    # papers, the first num_papers are the ogbn-arxiv nodes
+    total_papers = num_papers + int(other_papers * num_papers)
+    paper_ids = 1000000000 + rng.choice(total_papers * 20, total_papers, replace=False)
+    # file order doesn't follow the node order, like the real dump
+    order = rng.permutation(total_papers)
+    year = rng.integers(1990, 2021, total_papers)
+    labels = rng.choice(len(field_mapping), num_papers, p=rng.dirichlet(np.ones(len(field_mapping))))
+    with open(f"{output_dir}/arxiv/mapping/nodeidx2paperid.csv", "w") as fh:
+        fh.write("node idx,paper id\n")
+        fh.writelines(f"{i},{pid}\n" for i, pid in enumerate(paper_ids[:num_papers]))
+    with open(f"{output_dir}/arxiv/raw/node-label.csv", "w") as fh:
+        fh.writelines(f"{label}\n" for label in labels)
+
+    # references: citing papers get a Poisson number of references, cited papers are
+    # drawn with a Pareto weight each (power-law in-degree)
+    num_references = rng.poisson(references_per_paper, total_papers)
+    weight = rng.pareto(citation_exponent - 1, total_papers) + 1
+    source = np.repeat(np.arange(total_papers), num_references)
+    target = rng.choice(total_papers, len(source), p=weight / weight.sum())
+    keep = source != target
+    edges = np.unique(np.stack([source[keep], target[keep]], axis=1), axis=0)
+    source, target = edges[:, 0], edges[:, 1]
+    citation_count = np.bincount(target, minlength=total_papers)
+
+    empty = [""] * total_papers
+    p = order
+    write_rows(f"{output_dir}/papers.txt", [
+        paper_ids[p],
+        rng.integers(10000, 30000, total_papers),
+        [f"10.0000/synthetic.{i}" for i in p],
+        rng.choice(["Journal", "Conference", "Repository", ""], total_papers),
+        [f"synthetic paper {i}" for i in p],
+        [f"Synthetic Paper {i}" for i in p],
+        empty,
+        year[p],
+        [f"{y}-01-01" for y in year[p]],
+        empty,
+        empty,
+        empty,
+        empty,
+        empty,
+        empty,
+        empty,
+        empty,
+        empty,
+        num_references[p],
+        citation_count[p],
+        citation_count[p],
+        empty,
+        empty,
+        empty,
+        empty,
+        ["2016-06-24"] * total_papers,
+    ])
+
+    # authors, a Poisson number per paper (at least one) with some missing affiliations
+    num_authors = np.maximum(rng.poisson(authors_per_paper, total_papers), 1)
+    paper = np.repeat(order, num_authors[order])
+    sequence = np.concatenate([np.arange(1, n + 1) for n in num_authors[order]])
+    author_affiliation = affiliation_ids[rng.integers(0, num_affiliations, len(paper))].astype(str)
+    author_affiliation[rng.random(len(paper)) < missing_affiliation] = ""
+    write_rows(f"{output_dir}/paperAuthorAffilliations.txt", [
+        paper_ids[paper],
+        2000000000 + rng.integers(0, 10 * total_papers, len(paper)),
+        author_affiliation,
+        sequence,
+        [f"Author {i}" for i in range(len(paper))],
+        [""] * len(paper),
+    ])
+
+    # references in citing paper file order, only those between two arxiv papers are kept by parse_mag
+    edges = edges[np.argsort(np.argsort(order)[source], kind="stable")]
+    write_rows(f"{output_dir}/paperReferences.txt", [paper_ids[edges[:, 0]], paper_ids[edges[:, 1]]])
+    print(f"Wrote {total_papers} papers ({num_papers} in arxiv), {len(paper)} authors, "
+          f"{len(edges)} references and {num_affiliations} affiliations to {output_dir}", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output_dir", required=True)
+    parser.add_argument("-n", "--num_papers", type=int, default=10000, help="Number of ogbn-arxiv papers")
+    parser.add_argument("-a", "--num_affiliations", type=int, default=1000)
+    parser.add_argument("--authors_per_paper", type=float, default=3.0, help="Mean number of authors per paper")
+    parser.add_argument("--references_per_paper", type=float, default=10.0, help="Mean number of references per paper")
+    parser.add_argument("--citation_exponent", type=float, default=2.0, help="Power-law exponent of the citation degree")
+    parser.add_argument("--other_papers", type=float, default=0.2, help="Papers outside ogbn-arxiv, relative to num_papers")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    generate(
+        args.output_dir,
+        num_papers=args.num_papers,
+        num_affiliations=args.num_affiliations,
+        authors_per_paper=args.authors_per_paper,
+        references_per_paper=args.references_per_paper,
+        citation_exponent=args.citation_exponent,
+        other_papers=args.other_papers,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import itertools
+
+import numpy as np
+import pytest
+
+import cache
+from affilation_interactions import group_citation_counts, plot_group_citations, ACADEMIA_INDUSTRY
+from analysis import full_field_name
+from group_affiliations import get_affiliation_groups
+
+# the bitmask group counts against the loop over the data dict: python3 -m pytest test_affilation_interactions.py
+
+
+def in_fields(paper, fields):
+    return len(fields) == 0 or full_field_name[paper.field] in fields
+
+
+# papers whose authors all have a (merged) group, keyed by paper id, with their set of groups
+def loop_paper_groups(data, affiliation_idx, affiliation_group, fields, merge_groups):
+    idx_of_id = {a: idx for idx, a in enumerate(data["affiliations"])}
+    group_of_idx = {idx: merge_groups.get(g, g) for idx, g in zip(affiliation_idx, affiliation_group)}
+    paper_groups = {}
+    for paper in data["papers"].values():
+        groups = [group_of_idx.get(idx_of_id.get(a.affiliation_id), 0) for a in paper.authors]
+        if len(groups) == 0 or 0 in groups or not in_fields(paper, fields):
+            continue
+        paper_groups[paper.id] = tuple(sorted(set(groups)))
+    return paper_groups
+
+
+def loop_group_citation_counts(data, author_groups, paper_groups, from_year=None, to_year=None):
+    def in_years(paper):
+        return (from_year is None or paper.year >= from_year) and (to_year is None or paper.year <= to_year)
+
+    group_idx = {ag: i for i, ag in enumerate(author_groups)}
+    citations = np.zeros((len(author_groups), len(author_groups)))
+    author_group_count = np.zeros(len(author_groups))
+    for paper in data["papers"].values():
+        if paper.id not in paper_groups or not in_years(paper):
+            continue
+        citing = group_idx[paper_groups[paper.id]]
+        author_group_count[citing] += 1
+        for referred_paper in paper.referred_papers:
+            if referred_paper.id in paper_groups:
+                citations[citing][group_idx[paper_groups[referred_paper.id]]] += 1
+    return citations, author_group_count
+
+
+@pytest.fixture(scope="module")
+def affiliation_groups(synthetic_dir, data):
+    idx, _, affiliation_group = get_affiliation_groups(synthetic_dir, data)
+    # leave some affiliations without grouping information, so their papers are skipped
+    return idx[::3], affiliation_group[::3]
+
+
+@pytest.mark.parametrize("merge_groups", [ACADEMIA_INDUSTRY, {}])
+def test_group_citation_counts(data, affiliation_groups, top_fields, merge_groups):
+    affiliation_idx, affiliation_group = affiliation_groups
+    for fields in [[], top_fields]:
+        paper_groups = loop_paper_groups(data, affiliation_idx, affiliation_group, fields, merge_groups)
+        assert len(paper_groups) > 0
+        author_groups, citations, author_group_count = group_citation_counts(
+            data, affiliation_idx, affiliation_group, fields, merge_groups
+        )
+        expected_citations, expected_count = loop_group_citation_counts(data, author_groups, paper_groups)
+        np.testing.assert_array_equal(citations, expected_citations)
+        np.testing.assert_array_equal(author_group_count, expected_count)
+
+        years = sorted(paper.year for paper in data["papers"].values())
+        from_year, to_year = years[len(years) // 3], years[2 * len(years) // 3]
+        author_groups, citations, author_group_count = group_citation_counts(
+            data, affiliation_idx, affiliation_group, fields, merge_groups, from_year, to_year
+        )
+        expected_citations, expected_count = loop_group_citation_counts(
+            data, author_groups, paper_groups, from_year, to_year
+        )
+        np.testing.assert_array_equal(citations, expected_citations)
+        np.testing.assert_array_equal(author_group_count, expected_count)
+
+
+# a cache hit returns the counts computed on the miss
+def test_group_citation_counts_are_cached(data, affiliation_groups, tmp_path):
+    affiliation_idx, affiliation_group = affiliation_groups
+    cache.configure(str(tmp_path))
+    try:
+        for from_year in [None, 0]:
+            computed = group_citation_counts(data, affiliation_idx, affiliation_group, from_year=from_year)
+            cached = group_citation_counts(data, affiliation_idx, affiliation_group, from_year=from_year)
+            assert cached[0] == computed[0]
+            np.testing.assert_array_equal(cached[1], computed[1])
+            np.testing.assert_array_equal(cached[2], computed[2])
+        assert len(list(tmp_path.iterdir())) == 2
+    finally:
+        cache.configure(None)
+
+
+# four groups have 15 combinations, each with its own colour
+def test_plot_four_groups(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    author_groups = [c for size in range(1, 5) for c in itertools.combinations([1, 2, 3, 4], size)]
+    citations = np.random.default_rng(0).integers(1, 100, (len(author_groups), len(author_groups))).astype(np.float64)
+    plot_group_citations(author_groups, citations, {1: "University", 2: "Institute", 3: "Company", 4: "Government"})
+    assert (tmp_path / "aff_int_vis.png").stat().st_size > 0
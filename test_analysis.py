@@ -0,0 +1,209 @@
+import numpy as np
+import scipy.sparse as sp
+
+import analysis
+from corpus_store import CorpusStore
+from analysis import (
+    citation_matrix_institutions,
+    citation_matrix_fields,
+    top_field_citations,
+    year_prefix_sums,
+    institution_pagerank,
+    paper_pagerank_institutions,
+    sum_over_citing_papers,
+    institution_citations,
+    grouped_citation_tensor,
+    field_pair_keys,
+    citing_year_keys,
+    full_field_name,
+)
+
+# the analyses against loops over the data dict: python3 -m pytest test_analysis.py
+
+
+def in_fields(paper, fields):
+    return len(fields) == 0 or full_field_name[paper.field] in fields
+
+
+# papers with an unknown year are left out of any year range
+def in_years(paper, from_year=None, to_year=None):
+    if from_year is None and to_year is None:
+        return True
+    return paper.year >= 0 and (from_year is None or paper.year >= from_year) and (to_year is None or paper.year <= to_year)
+
+
+# citations[x][y] is the number of times affiliation x cites affiliation y, from_year and to_year
+# restrict the citing paper
+def loop_institution_citations(data, fields=[], from_year=None, to_year=None):
+    affiliation_to_idx = {a: idx for idx, a in enumerate(data["affiliations"])}
+    citations = np.zeros((len(affiliation_to_idx), len(affiliation_to_idx)))
+    for paper in data["papers"].values():
+        if not in_fields(paper, fields) or not in_years(paper, from_year, to_year):
+            continue
+        paper_affiliations = {a.affiliation_id for a in paper.authors if a.affiliation is not None}
+        for referred_paper in paper.referred_papers:
+            if not in_fields(referred_paper, fields):
+                continue
+            for a2 in {a.affiliation_id for a in referred_paper.authors if a.affiliation is not None}:
+                for a1 in paper_affiliations:
+                    citations[affiliation_to_idx[a1]][affiliation_to_idx[a2]] += 1
+    return citations
+
+
+def test_citation_matrix_institutions(data, store, top_fields):
+    expected = loop_institution_citations(data)
+    assert expected.sum() > 0
+    np.testing.assert_array_equal(citation_matrix_institutions(store).toarray(), expected)
+    np.testing.assert_array_equal(
+        citation_matrix_institutions(store, top_fields).toarray(), loop_institution_citations(data, top_fields)
+    )
+
+
+# citations[x][y] is the number of times field x cites field y
+def loop_field_citations(data, from_year=None, to_year=None):
+    field_to_idx = {v: k for k, v in enumerate(data["fields"].values())}
+    citations = np.zeros((len(field_to_idx), len(field_to_idx)))
+    for paper in data["papers"].values():
+        if not in_years(paper, from_year, to_year):
+            continue
+        for referred_paper in paper.referred_papers:
+            citations[field_to_idx[paper.field]][field_to_idx[referred_paper.field]] += 1
+    return citations
+
+
+def test_citation_matrix_fields(data, store):
+    np.testing.assert_array_equal(citation_matrix_fields(store), loop_field_citations(data))
+
+
+# ranges inside, overlapping and outside the years of the corpus
+def test_year_ranges(data, store):
+    years = sorted(paper.year for paper in data["papers"].values() if paper.year >= 0)
+    middle = years[len(years) // 2]
+    for from_year, to_year in [(middle, middle), (None, middle), (middle, None), (years[0] - 5, years[-1] + 5),
+                               (years[-1] + 1, None), (middle, middle - 1)]:
+        np.testing.assert_array_equal(
+            citation_matrix_institutions(store, from_year=from_year, to_year=to_year).toarray(),
+            loop_institution_citations(data, from_year=from_year, to_year=to_year),
+        )
+        np.testing.assert_array_equal(
+            citation_matrix_fields(store, from_year, to_year), loop_field_citations(data, from_year, to_year)
+        )
+
+
+# sparse prefix sums equal the dense cumulative sums, with an entry only where a column was counted
+def test_year_prefix_sums():
+    rng = np.random.default_rng(0)
+    per_year = rng.integers(0, 3, (12, 40)) * (rng.random((12, 40)) < 0.2)
+    per_year[[0, 5, 11]] = 0
+    prefix = year_prefix_sums(per_year)
+    assert prefix.shape == (13, 40)
+    np.testing.assert_array_equal(prefix[0], 0)
+    np.testing.assert_array_equal(prefix[1:], np.cumsum(per_year, axis=0))
+    sparse_prefix = year_prefix_sums(sp.csr_matrix(per_year))
+    np.testing.assert_array_equal(sparse_prefix.toarray(), prefix)
+    assert sparse_prefix.nnz == np.count_nonzero(prefix)
+    assert year_prefix_sums(sp.csr_matrix((3, 40))).shape == (4, 40)
+
+
+def test_top_field_citations(data, store):
+    citations = loop_field_citations(data).astype(int)
+    idx_to_field = dict(enumerate(data["fields"].values()))
+    # sorted by citations, then by citing and cited field index, all descending
+    expected = sorted(
+        [(citations[i][j], i, j) for i in range(len(citations)) for j in range(len(citations)) if i != j], reverse=True
+    )
+    expected = [(int(c), idx_to_field[i], idx_to_field[j]) for c, i, j in expected[:20]]
+    assert top_field_citations(store, 20) == expected
+
+
+# the server answers every unfiltered query from the matrices kept on its store
+def test_unfiltered_matrices_are_kept_on_the_store(store, monkeypatch):
+    institutions = citation_matrix_institutions(store)
+    fields = citation_matrix_fields(store)
+
+    def recomputed(*args, **kwargs):
+        raise AssertionError("recomputed")
+
+    monkeypatch.setattr(analysis, "_citation_matrix_institutions", recomputed)
+    monkeypatch.setattr(analysis, "_citation_matrix_fields", recomputed)
+    assert citation_matrix_institutions(store) is institutions
+    assert citation_matrix_fields(store) is fields
+
+
+# PageRank by power iteration over adjacency lists: out_edges[u] lists (v, weight) of every edge u -> v
+def loop_pagerank(out_edges, n, damping=0.85, tol=1e-10, max_iter=1000):
+    out_weight = [sum(w for _, w in out_edges[u]) for u in range(n)]
+    rank = [1.0 / n] * n
+    for _ in range(max_iter):
+        dangling = sum(rank[u] for u in range(n) if out_weight[u] == 0)
+        new_rank = [(1 - damping) / n + damping * dangling / n] * n
+        for u in range(n):
+            for v, w in out_edges[u]:
+                new_rank[v] += damping * rank[u] * w / out_weight[u]
+        converged = sum(abs(a - b) for a, b in zip(new_rank, rank)) < tol
+        rank = new_rank
+        if converged:
+            break
+    return np.array(rank)
+
+
+def test_institution_pagerank(data, store, top_fields):
+    for fields, from_year in [([], None), (top_fields, None), ([], 2015)]:
+        citations = loop_institution_citations(data, fields, from_year)
+        n = len(citations)
+        out_edges = [[(v, citations[u][v]) for v in range(n) if v != u and citations[u][v] > 0] for u in range(n)]
+        np.testing.assert_allclose(
+            institution_pagerank(store, fields, from_year), loop_pagerank(out_edges, n), rtol=1e-8, atol=1e-12
+        )
+
+
+def test_paper_pagerank_institutions(data, store, top_fields):
+    affiliation_to_idx = {a: idx for idx, a in enumerate(data["affiliations"])}
+    for fields, from_year in [([], None), (top_fields, None), ([], 2015)]:
+        papers = [p for p in data["papers"].values() if in_fields(p, fields)]
+        paper_idx = {p.id: idx for idx, p in enumerate(papers)}
+        out_edges = [[] for _ in papers]
+        for p in papers:
+            if not in_years(p, from_year):
+                continue
+            for r in p.referred_papers:
+                if r.id in paper_idx:
+                    out_edges[paper_idx[p.id]].append((paper_idx[r.id], 1.0))
+        rank = loop_pagerank(out_edges, len(papers))
+
+        expected = np.zeros(len(affiliation_to_idx))
+        for p, paper_rank in zip(papers, rank):
+            affiliations = {a.affiliation_id for a in p.authors if a.affiliation is not None}
+            for a in affiliations:
+                expected[affiliation_to_idx[a]] += paper_rank / len(affiliations)
+        np.testing.assert_allclose(
+            paper_pagerank_institutions(store, fields, from_year), expected, rtol=1e-8, atol=1e-12
+        )
+
+
+# the pool memory-maps a store that is on disk, and first writes the columns it reads otherwise;
+# three processes also leave a partial count out of a round of the pairwise sums
+def test_sum_over_citing_papers(data, store, top_fields, tmp_path):
+    CorpusStore.from_data(data).save(str(tmp_path))
+    on_disk = CorpusStore.load(str(tmp_path))
+    assert store.path is None and on_disk.path is not None
+    serial = [
+        sum_over_citing_papers(store, institution_citations, top_fields, 2000, None),
+        sum_over_citing_papers(store, grouped_citation_tensor, field_pair_keys),
+        sum_over_citing_papers(store, grouped_citation_tensor, citing_year_keys),
+    ]
+    np.testing.assert_array_equal(serial[0].toarray(), loop_institution_citations(data, top_fields, 2000))
+
+    analysis.configure_processes(3)
+    try:
+        for corpus in [store, on_disk]:
+            parallel = [
+                sum_over_citing_papers(corpus, institution_citations, top_fields, 2000, None),
+                sum_over_citing_papers(corpus, grouped_citation_tensor, field_pair_keys),
+                sum_over_citing_papers(corpus, grouped_citation_tensor, citing_year_keys),
+            ]
+            for expected, result in zip(serial, parallel):
+                assert result.shape == expected.shape
+                assert (result != expected).nnz == 0
+    finally:
+        analysis.configure_processes(1)
@@ -0,0 +1,19 @@
+import pytest
+
+import cli
+from benchmark import benchmark, run_stage
+
+# the benchmark stages in their own processes: python3 -m pytest test_benchmark.py
+
+
+def test_benchmark(tmp_path):
+    cli.main(["synthetic", "-o", str(tmp_path / "papers_200"), "-n", "200", "-a", "10"])
+    results = benchmark([200], str(tmp_path), stages=["parse", "load", "institutions", "fields", "groups"])
+    assert [r["stage"] for r in results] == ["parse", "load", "institutions", "fields", "groups"]
+    assert all(r["seconds"] >= 0 and r["peak_rss_mb"] > 0 for r in results)
+
+
+# a stage that fails reports its exit code instead of waiting for a result that never comes
+def test_failed_stage(tmp_path):
+    with pytest.raises(RuntimeError, match="Stage load failed"):
+        run_stage("load", str(tmp_path / "missing"))
@@ -0,0 +1,80 @@
+import os
+import stat
+
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+import cache
+
+# the result cache: python3 -m pytest test_cache.py
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    cache.configure(str(tmp_path))
+    yield str(tmp_path)
+    cache.configure(None)
+
+
+def test_round_trip(cache_dir):
+    cache.put("dense", np.arange(6.0).reshape(2, 3))
+    cache.put("sparse", sp.identity(3, format="csr"))
+    np.testing.assert_array_equal(cache.get("dense"), np.arange(6.0).reshape(2, 3))
+    assert (cache.get("sparse") != sp.identity(3)).nnz == 0
+    cache.put("tuple", (np.zeros(2), np.ones((2, 2))))
+    first, second = cache.get("tuple")
+    np.testing.assert_array_equal(first, np.zeros(2))
+    np.testing.assert_array_equal(second, np.ones((2, 2)))
+    assert cache.get("missing") is None
+
+
+# not mkstemp's 0600, so a shared cache directory is readable by the others
+def test_entries_follow_the_umask(cache_dir):
+    cache.put("entry", np.zeros(1))
+    mode = stat.S_IMODE(os.stat(os.path.join(cache_dir, "entry.npz")).st_mode)
+    assert mode == 0o666 & ~cache._UMASK
+
+
+def test_entry_evicted_while_read_is_a_miss(cache_dir, monkeypatch):
+    cache.put("entry", np.zeros(1))
+    deserialize = cache._deserialize
+
+    # another process evicts the entry right after it was loaded
+    def evicted_after_load(path):
+        value = deserialize(path)
+        os.remove(path)
+        return value
+
+    monkeypatch.setattr(cache, "_deserialize", evicted_after_load)
+    np.testing.assert_array_equal(cache.get("entry"), np.zeros(1))
+
+    # or before it is opened
+    monkeypatch.setattr(cache, "_deserialize", deserialize)
+    assert cache.get("entry") is None
+
+
+def test_corrupt_entry_is_a_miss(cache_dir):
+    with open(os.path.join(cache_dir, "entry.npz"), "wb") as fh:
+        fh.write(b"not an npz")
+    assert cache.get("entry") is None
+    assert not os.path.exists(os.path.join(cache_dir, "entry.npz"))
+
+
+calls = []
+
+
+@cache.cached
+def cached_fields(data, fields=[]):
+    calls.append(list(fields))
+    return np.zeros(len(set(fields)))
+
+
+# the same selection of fields in any order is one entry
+def test_unordered_arguments_share_an_entry(cache_dir, store):
+    calls.clear()
+    cached_fields(store, ["A", "B"])
+    cached_fields(store, ["B", "A"])
+    cached_fields(store, fields=["B", "A", "B"])
+    cached_fields(store, ["A"])
+    assert calls == [["A", "B"], ["A"]]
@@ -0,0 +1,26 @@
+import os
+import subprocess
+import sys
+
+# the single entry point: python3 -m pytest test_cli.py
+
+HEAVY_MODULES = ["numpy", "scipy", "matplotlib", "networkx", "zstandard"]
+
+
+# `cli.py -h` imports none of the subcommand modules, nor what they depend on
+def test_help_loads_no_heavy_modules():
+    code = (
+        "import sys, runpy\n"
+        "sys.argv = ['cli.py', '-h']\n"
+        "try:\n"
+        "    runpy.run_path('cli.py', run_name='__main__')\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        f"print('loaded:', [m for m in {HEAVY_MODULES!r} if m in sys.modules])\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True,
+    )
+    assert "unpack" in result.stdout
+    assert result.stdout.strip().splitlines()[-1] == "loaded: []"
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from analysis import full_field_name
+from affilation_interactions import ACADEMIA_INDUSTRY
+from coauthorship import coauthorship_matrix, top_coauthorships, group_coauthorship
+from group_affiliations import get_affiliation_groups
+
+# co-authorship against loops over the data dict: python3 -m pytest test_coauthorship.py
+
+
+# affiliations of the authors of every paper in fields published between from_year and to_year
+def loop_paper_affiliations(data, fields=[], from_year=None, to_year=None):
+    affiliations = []
+    for paper in data["papers"].values():
+        if len(fields) > 0 and full_field_name[paper.field] not in fields:
+            continue
+        if (from_year is not None or to_year is not None) and not (
+            paper.year >= 0 and (from_year is None or paper.year >= from_year) and (to_year is None or paper.year <= to_year)
+        ):
+            continue
+        affiliations.append({a.affiliation_id for a in paper.authors if a.affiliation is not None})
+    return affiliations
+
+
+def loop_coauthorship(data, fields=[], from_year=None, to_year=None):
+    affiliation_to_idx = {a: idx for idx, a in enumerate(data["affiliations"])}
+    papers = np.zeros((len(affiliation_to_idx), len(affiliation_to_idx)))
+    for affiliations in loop_paper_affiliations(data, fields, from_year, to_year):
+        for a1 in affiliations:
+            for a2 in affiliations:
+                papers[affiliation_to_idx[a1]][affiliation_to_idx[a2]] += 1
+    return papers
+
+
+def test_coauthorship_matrix(data, store, top_fields):
+    for fields, from_year, to_year in [([], None, None), (top_fields, None, None), ([], 2000, 2010)]:
+        expected = loop_coauthorship(data, fields, from_year, to_year)
+        assert np.triu(expected, k=1).sum() > 0
+        np.testing.assert_array_equal(coauthorship_matrix(store, fields, from_year, to_year).toarray(), expected)
+
+
+def test_top_coauthorships(data, store):
+    papers = loop_coauthorship(data).astype(int)
+    names = [a.name for a in data["affiliations"].values()]
+    n = len(papers)
+    # by papers descending, ties in the order of the institutions
+    expected = sorted([(-papers[i][j], i, j) for i in range(n) for j in range(i + 1, n) if papers[i][j] > 0])
+    assert top_coauthorships(store, 10) == [(int(-p), names[i], names[j]) for p, i, j in expected[:10]]
+
+
+@pytest.mark.parametrize("merge_groups", [ACADEMIA_INDUSTRY, {}])
+def test_group_coauthorship(data, store, synthetic_dir, merge_groups):
+    affiliation_idx, _, affiliation_group = get_affiliation_groups(synthetic_dir, data)
+    affiliation_ids = list(data["affiliations"])
+    group_of_id = {affiliation_ids[idx]: merge_groups.get(g, g) for idx, g in zip(affiliation_idx, affiliation_group)}
+
+    groups, papers = group_coauthorship(store, affiliation_idx, affiliation_group, merge_groups=merge_groups)
+    assert groups == sorted(set(group_of_id.values()) - {0})
+    expected = np.zeros((len(groups), len(groups)), dtype=int)
+    for affiliations in loop_paper_affiliations(data):
+        paper_groups = {group_of_id.get(a, 0) for a in affiliations} - {0}
+        for g in paper_groups:
+            for h in paper_groups:
+                expected[groups.index(g)][groups.index(h)] += 1
+    np.testing.assert_array_equal(papers, expected)
@@ -0,0 +1,58 @@
+import pytest
+
+from corpus_store import CorpusStore, load_data, shard_path, store_path
+
+# the store and the field shards against a loop over the data dict: python3 -m pytest test_corpus_store.py
+
+
+# the papers of fields (all if empty) with their year, author affiliations and references among them
+def loop_papers(data, fields=[]):
+    papers = [p for p in data["papers"].values() if len(fields) == 0 or p.field in fields]
+    ids = {p.id for p in papers}
+    return {
+        p.id: (p.field, p.year, [a.affiliation_id for a in p.authors], [r.id for r in p.referred_papers if r.id in ids])
+        for p in papers
+    }
+
+
+def affiliations(data):
+    return {a.id: (a.rank, a.normalized_name, a.name, a.paper_count, a.citation_count) for a in data["affiliations"].values()}
+
+
+def test_save_load(data, tmp_path):
+    CorpusStore.from_data(data).save(store_path(str(tmp_path)))
+    loaded = CorpusStore.load(store_path(str(tmp_path))).to_data()
+    assert loop_papers(loaded) == loop_papers(data)
+    assert affiliations(loaded) == affiliations(data)
+    assert [p.title for p in loaded["papers"].values()] == [p.title for p in data["papers"].values()]
+    assert loop_papers(load_data(str(tmp_path))) == loop_papers(data)
+
+
+# a directory with only the shards is read from them, not from a data.pkl that isn't there
+def test_load_data_from_shards(data, tmp_path):
+    CorpusStore.from_data(data).save_shards(shard_path(str(tmp_path)))
+    assert loop_papers(load_data(str(tmp_path))) == loop_papers(data)
+
+
+@pytest.fixture(scope="module")
+def shard_dir(data, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("shards"))
+    CorpusStore.from_data(data).save_shards(path)
+    return path
+
+
+def test_load_shards(data, shard_dir):
+    counts = {}
+    for paper in data["papers"].values():
+        counts[paper.field] = counts.get(paper.field, 0) + 1
+    # the largest fields, a small one, and all of them
+    by_size = sorted(counts, key=counts.get, reverse=True)
+    for fields in [by_size[:2], by_size[-1:], []]:
+        loaded = CorpusStore.load_shards(shard_dir, fields).to_data()
+        assert loop_papers(loaded) == loop_papers(data, fields)
+    assert len(loop_papers(data, by_size[:2])) > 0
+
+
+def test_load_unknown_shard(shard_dir):
+    with pytest.raises(ValueError):
+        CorpusStore.load_shards(shard_dir, ["no such field"])
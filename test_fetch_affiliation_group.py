@@ -0,0 +1,107 @@
+import asyncio
+import time
+
+import pytest
+
+import fetch_affiliation_group
+from fetch_affiliation_group import fetch_affiliation_types, AffiliationTypeCache, TokenBucket
+from stub_search import StubSearchServer, DEFAULT_DESCRIPTION
+
+# fetch_affiliation_types against stub_search.py: python3 -m pytest test_fetch_affiliation_group.py
+
+AFFILIATIONS = {1: "University of North Lake", 2: "River Corporation", 3: "Stone Research Laboratory"}
+DESCRIPTIONS = {"University of North Lake": "Public university", "River Corporation": "Software company"}
+
+
+@pytest.fixture
+def stub():
+    server = StubSearchServer(descriptions=DESCRIPTIONS).start()
+    yield server
+    server.stop()
+
+
+def fetch(stub, cache_path, retries=3):
+    return asyncio.run(fetch_affiliation_types(
+        AFFILIATIONS, str(cache_path), base_url=stub.url, rate=1000.0, retries=retries, backoff=0.01,
+    ))
+
+
+def test_fetches_descriptions(stub, tmp_path):
+    fetched = fetch(stub, tmp_path / "cache.jsonl")
+    assert fetched == {1: "Public university", 2: "Software company", 3: DEFAULT_DESCRIPTION}
+    assert all(stub.requests[name] == 1 for name in AFFILIATIONS.values())
+
+
+def test_retries_rate_limits_and_server_errors(stub, tmp_path):
+    stub.failures["River Corporation"] = [503, 429, 500]
+    fetched = fetch(stub, tmp_path / "cache.jsonl")
+    assert fetched[2] == "Software company"
+    assert stub.requests["River Corporation"] == 4
+
+
+def test_client_errors_are_not_retried(stub, tmp_path):
+    stub.failures["River Corporation"] = [404, "*"]
+    stub.failures["Stone Research Laboratory"] = [403, "*"]
+    fetched = fetch(stub, tmp_path / "cache.jsonl")
+    assert fetched == {1: "Public university"}
+    assert stub.requests["River Corporation"] == 1
+    assert stub.requests["Stone Research Laboratory"] == 1
+
+
+def test_gives_up_after_retries(stub, tmp_path):
+    stub.failures["River Corporation"] = [503, "*"]
+    fetched = fetch(stub, tmp_path / "cache.jsonl", retries=2)
+    assert 2 not in fetched
+    assert stub.requests["River Corporation"] == 3
+
+
+def test_resumes_from_cache(stub, tmp_path):
+    cache_path = tmp_path / "cache.jsonl"
+    stub.failures["River Corporation"] = [503, "*"]
+    fetch(stub, cache_path, retries=1)
+
+    # the next run only asks for what is still missing
+    stub.failures.clear()
+    stub.requests.clear()
+    fetched = fetch(stub, cache_path)
+    assert fetched == {1: "Public university", 2: "Software company", 3: DEFAULT_DESCRIPTION}
+    assert dict(stub.requests) == {"River Corporation": 1}
+
+
+def test_skips_partially_written_cache_line(stub, tmp_path):
+    cache_path = tmp_path / "cache.jsonl"
+    fetch(stub, cache_path)
+    with open(cache_path, "a") as fh:
+        fh.write('{"id": 4, "name": "Half')
+    stub.requests.clear()
+    assert len(fetch(stub, cache_path)) == 3
+    assert sum(stub.requests.values()) == 0
+
+
+# a record appended after a cut off line starts on a line of its own
+def test_appends_after_partially_written_cache_line(stub, tmp_path):
+    cache_path = tmp_path / "cache.jsonl"
+    with open(cache_path, "w") as fh:
+        fh.write('{"id": 1, "name": "University of North Lake", "description": "Public university"}\n["not a record"]\n')
+        fh.write('{"id": 4, "name": "Half')
+    fetched = fetch(stub, cache_path)
+    assert fetched == {1: "Public university", 2: "Software company", 3: DEFAULT_DESCRIPTION}
+    assert AffiliationTypeCache(str(cache_path)).descriptions == {
+        1: "Public university", 2: "Software company", 3: DEFAULT_DESCRIPTION
+    }
+
+
+# requests are spaced by 1 / rate from the start, however many may be in flight
+def test_rate_without_bursts(stub, tmp_path, monkeypatch):
+    times = []
+
+    class RecordedBucket(TokenBucket):
+        async def acquire(self):
+            await super().acquire()
+            times.append(time.monotonic())
+
+    monkeypatch.setattr(fetch_affiliation_group, "TokenBucket", RecordedBucket)
+    asyncio.run(fetch_affiliation_types(AFFILIATIONS, str(tmp_path / "cache.jsonl"), base_url=stub.url,
+                                        concurrency=8, rate=20.0))
+    assert len(times) == 3
+    assert all(b - a >= 1 / 20 * 0.8 for a, b in zip(times, times[1:]))
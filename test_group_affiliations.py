@@ -0,0 +1,26 @@
+import numpy as np
+
+import synthetic
+from group_affiliations import classify_affiliations, define_type, UNKNOWN_GROUP
+
+# the batch classifier against define_type: python3 -m pytest test_group_affiliations.py
+
+
+def test_classify_affiliations_matches_define_type():
+    names, descriptions = synthetic.affiliation_names(np.random.default_rng(0), 200)
+    # names that only the description classifies, descriptions that are missing or match nothing
+    names += ["Stone Labs", "Cedar Works", "Pine Works", "Bright Foundation"]
+    descriptions += ["Software company", "Research laboratory", "", "Charity"]
+    descriptions[:20] = [""] * 20
+
+    expected = [define_type(n, d) or UNKNOWN_GROUP for n, d in zip(names, descriptions)]
+    np.testing.assert_array_equal(classify_affiliations(names, descriptions), expected)
+    np.testing.assert_array_equal(
+        classify_affiliations(names), [define_type(n) or UNKNOWN_GROUP for n in names]
+    )
+
+
+# e.g. a field shard without affiliations
+def test_classify_no_affiliations():
+    assert len(classify_affiliations([], [])) == 0
+    assert len(classify_affiliations([])) == 0
@@ -0,0 +1,46 @@
+import threading
+
+import numpy as np
+
+import instrumentation
+
+# stage bookkeeping: python3 -m pytest test_instrumentation.py
+
+
+# stages of concurrent threads, e.g. server requests, nest only within their own thread
+def test_stage_depth_is_per_thread():
+    metrics = instrumentation.Metrics()
+    outer_started, inner_done = threading.Event(), threading.Event()
+
+    def request():
+        with metrics.stage("outer"):
+            outer_started.set()
+            inner_done.wait(10)
+
+    thread = threading.Thread(target=request)
+    thread.start()
+    outer_started.wait(10)
+    with metrics.stage("inner") as inner:
+        with metrics.stage("nested") as nested:
+            pass
+    inner_done.set()
+    thread.join()
+
+    assert (inner.depth, nested.depth) == (0, 1)
+    assert [s.to_dict()["depth"] for s in metrics.stages] == [0, 0, 1]
+    assert metrics.running == []
+
+
+# a stage that allocates little reports little, even after one that raised the process peak
+def test_rss_of_a_stage_is_its_own():
+    metrics = instrumentation.Metrics()
+    with metrics.stage("allocate"):
+        kept = np.ones(64 * 1024 * 1024 // 8)
+    with metrics.stage("small"):
+        pass
+    allocate, small = [s.to_dict() for s in metrics.stages]
+    assert allocate["rss_increase_mb"] >= 48
+    assert abs(small["rss_increase_mb"]) < 16
+    assert small["process_peak_rss_mb"] >= allocate["process_peak_rss_mb"]
+    assert "peak_rss_mb" not in small
+    del kept
@@ -0,0 +1,119 @@
+import io
+import math
+import pickle
+import sys
+import types
+
+import pytest
+
+import mag_model
+from mag_model import Affiliation, Paper, PaperAuthor, MISSING_INT
+
+# loading data.pkl files of the dict based classes: python3 -m pytest test_mag_model.py
+
+
+# the classes data.pkl was written with before the slots records, every field the raw string
+class OldAffiliation:
+    def __init__(self, data):
+        self.id = data[0]
+        self.rank = data[1]
+        self.normalized_name = data[2]
+        self.name = data[3]
+        self.official_page = data[5]
+        self.paper_count = data[7]
+        self.paper_family_count = data[8]
+        self.citation_count = data[9]
+        self.country_code = data[10]
+        self.latitude = data[11]
+        self.longitude = data[12]
+
+
+class OldPaperAuthor:
+    def __init__(self, data):
+        self.paper_id = data[0]
+        self.author_id = data[1]
+        self.affiliation_id = data[2]
+        self.author_sequence_number = data[3]
+        self.original_author = data[4]
+        self.affiliation = None
+
+
+class OldPaper:
+    def __init__(self, data, field):
+        self.id = data[0]
+        self.rank = data[1]
+        self.doc_type = data[3]
+        self.title = data[4]
+        self.original_title = data[5]
+        self.year = data[7]
+        self.date = data[8]
+        self.references = data[18]
+        self.citations = data[19]
+        self.estimated_citations = data[20]
+        self.field = field
+        self.authors = []
+        self.referred_papers = []
+
+
+def old_data(classes):
+    OldAffiliation, OldPaperAuthor, OldPaper = classes
+    affiliation = OldAffiliation(["7", "12", "north lake", "North Lake", "", "http://x", "", "30", "31", "400", "US",
+                                  "1.5", "", ""])
+    papers = []
+    for paper_id, year in [("100", "2015"), ("101", "")]:
+        row = [paper_id, "5", "", "Journal", "A title", "A Title", "", year, "2015-01-01"] + [""] * 9 + ["3", "8", "9"]
+        papers.append(OldPaper(row + [""] * 5, "arxiv cs lg"))
+    with_affiliation = OldPaperAuthor(["100", "55", "7", "1", "Ann", ""])
+    with_affiliation.affiliation = affiliation
+    papers[0].authors = [with_affiliation, OldPaperAuthor(["100", "56", "", "2", "Bob", ""])]
+    papers[0].referred_papers = [papers[1]]
+    return {
+        "papers": {p.id: p for p in papers},
+        "affiliations": {affiliation.id: affiliation},
+        "fields": mag_model.field_mapping,
+    }
+
+
+# pickled as parse_mag.py wrote them, imported (parse_mag.Paper) or run as a script (__main__.Paper)
+@pytest.fixture(params=["parse_mag", "__main__"])
+def old_pickle(request, monkeypatch):
+    module = sys.modules["__main__"] if request.param == "__main__" else types.ModuleType("parse_mag")
+    if request.param == "parse_mag":
+        monkeypatch.setitem(sys.modules, "parse_mag", module)
+    classes = []
+    for name, old in [("Affiliation", OldAffiliation), ("PaperAuthor", OldPaperAuthor), ("Paper", OldPaper)]:
+        cls = type(name, (old,), {"__module__": request.param, "__qualname__": name})
+        monkeypatch.setattr(module, name, cls, raising=False)
+        classes.append(cls)
+    return pickle.dumps(old_data(classes))
+
+
+def test_load_old_pickle(old_pickle):
+    data = mag_model.load(io.BytesIO(old_pickle))
+    assert list(data["papers"]) == [100, 101]
+    assert list(data["affiliations"]) == [7]
+
+    affiliation = data["affiliations"][7]
+    assert type(affiliation) is Affiliation and not hasattr(affiliation, "__dict__")
+    assert (affiliation.rank, affiliation.paper_count, affiliation.citation_count) == (12, 30, 400)
+    assert affiliation.latitude == 1.5 and math.isnan(affiliation.longitude)
+
+    paper, unknown_year = data["papers"][100], data["papers"][101]
+    assert type(paper) is Paper and not hasattr(paper, "__dict__")
+    assert (paper.year, unknown_year.year, paper.citations, paper.field) == (2015, MISSING_INT, 8, "arxiv cs lg")
+    assert paper.referred_papers == [unknown_year]
+
+    with_affiliation, without = paper.authors
+    assert type(with_affiliation) is PaperAuthor
+    assert (with_affiliation.paper_id, with_affiliation.author_id, with_affiliation.affiliation_id) == (100, 55, 7)
+    assert with_affiliation.affiliation is affiliation
+    assert (without.affiliation_id, without.affiliation) == (MISSING_INT, None)
+
+
+# and the records written now round-trip as they are
+def test_round_trip(old_pickle):
+    data = mag_model.load(io.BytesIO(old_pickle))
+    again = mag_model.load(io.BytesIO(pickle.dumps(data)))
+    paper = again["papers"][100]
+    assert (paper.id, paper.year, paper.authors[1].affiliation_id) == (100, 2015, MISSING_INT)
+    assert paper.authors[0].affiliation is again["affiliations"][7]
@@ -0,0 +1,72 @@
+import io
+
+import networkx as nx
+import numpy as np
+import pytest
+
+import cache
+import network_drawing
+from network_drawing import cached_layout, draw_edges, new_figure
+
+# the drawing helpers: python3 -m pytest test_network_drawing.py
+
+
+def graph(edges, nodes="abcd"):
+    G = nx.MultiDiGraph()
+    G.add_nodes_from(nodes)
+    for u, v, w in edges:
+        G.add_edge(u, v, weight=w)
+    return G
+
+
+@pytest.fixture
+def layouts(monkeypatch, tmp_path):
+    calls = []
+    spring_layout = nx.spring_layout
+
+    def counted(G, **kwargs):
+        calls.append(G)
+        return spring_layout(G, **kwargs)
+
+    monkeypatch.setattr(network_drawing, "_layouts", {})
+    monkeypatch.setattr(network_drawing.nx, "spring_layout", counted)
+    cache.configure(str(tmp_path))
+    yield calls
+    cache.configure(None)
+
+
+def test_layout_follows_the_edges(layouts):
+    edges = [("a", "b", 1.0), ("b", "c", 2.0), ("c", "a", 1.0), ("d", "a", 0.5)]
+    first = cached_layout(graph(edges), list("abcd"), seed=1)
+    # the same graph built in another order is the same layout
+    again = cached_layout(graph(edges[::-1], "dcba"), list("dcba"), seed=1)
+    assert len(layouts) == 1
+    assert all(np.array_equal(first[n], again[n]) for n in "abcd")
+
+    # same nodes, other citations
+    for changed in [edges[:-1] + [("d", "b", 0.5)], edges[:-1] + [("d", "a", 5.0)]]:
+        cached_layout(graph(changed), list("abcd"), seed=1)
+    assert len(layouts) == 3
+
+    # and from the result cache, once the in-memory layouts are gone
+    network_drawing._layouts.clear()
+    cached_layout(graph(edges), list("abcd"), seed=1)
+    cached_layout(graph(edges[:-1] + [("d", "a", 7.0)]), list("abcd"), seed=1)
+    assert len(layouts) == 4
+
+
+def test_draw_edges():
+    fig, ax = new_figure(4)
+    pos = {"a": np.array([0.0, 0.0]), "b": np.array([1.0, 0.0]), "c": np.array([0.0, 1.0])}
+    edges = [("a", "b"), ("b", "a"), ("c", "c")]
+    arcs, heads = draw_edges(ax, pos, edges, [1.0, 2.0, 3.0], ["red", "blue", "green"], node_size=[300, 100, 50])
+    paths = arcs.get_paths()
+    assert len(paths) == 3 and len(heads.get_paths()) == 3
+    # arcs are quadratic curves, the self loop a closed cubic loop starting and ending on top of its node
+    assert len(paths[0].vertices) == 3 and len(paths[2].vertices) == 7
+    np.testing.assert_allclose(paths[2].vertices[0], paths[2].vertices[-1])
+    np.testing.assert_array_equal(arcs.get_linewidths(), [1.0, 2.0, 3.0])
+    # arcs are shortened to stay off the nodes
+    assert 0 < paths[0].vertices[0][0] < paths[0].vertices[-1][0] < 1
+    assert draw_edges(ax, pos, [], [], []) == (None, None)
+    fig.savefig(io.BytesIO(), format="png")
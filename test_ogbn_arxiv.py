@@ -0,0 +1,66 @@
+import gzip
+import os
+
+import numpy as np
+import pytest
+
+import ogbn_arxiv
+from ogbn_arxiv import load_labels, load_paper_ids
+
+# the ogbn-arxiv csv readers and their .npy cache: python3 -m pytest test_ogbn_arxiv.py
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    # not the dataset directory of the working directory
+    monkeypatch.setattr(ogbn_arxiv, "OGB_ROOT", str(tmp_path / "dataset"))
+    os.makedirs(tmp_path / "arxiv" / "mapping")
+    os.makedirs(tmp_path / "arxiv" / "raw")
+    return tmp_path
+
+
+def write_mapping(data_dir, paper_ids, order):
+    with gzip.open(data_dir / "arxiv" / "mapping" / "nodeidx2paperid.csv.gz", "wt") as fh:
+        fh.write("node idx,paper id\n")
+        fh.writelines(f"{i},{paper_ids[i]}\n" for i in order)
+
+
+def write_labels(data_dir, labels):
+    with open(data_dir / "arxiv" / "raw" / "node-label.csv", "w") as fh:
+        fh.writelines(f"{label}\n" for label in labels)
+
+
+def test_load_from_csv_and_cache(data_dir, monkeypatch):
+    paper_ids = [9001, 42, 777, 12345678901]
+    # rows in any node order
+    write_mapping(data_dir, paper_ids, [2, 0, 3, 1])
+    write_labels(data_dir, [3, 0, 39, 3])
+    np.testing.assert_array_equal(load_paper_ids(str(data_dir)), paper_ids)
+    np.testing.assert_array_equal(load_labels(str(data_dir)), [3, 0, 39, 3])
+    assert os.path.exists(data_dir / "arxiv" / "mapping" / "nodeidx2paperid.npy")
+    assert os.path.exists(data_dir / "arxiv" / "raw" / "node-label.npy")
+
+    # read from the .npy from now on
+    def parse(*args, **kwargs):
+        raise AssertionError("parsed the csv again")
+
+    monkeypatch.setattr(ogbn_arxiv, "_read_ints", parse)
+    np.testing.assert_array_equal(load_paper_ids(str(data_dir)), paper_ids)
+    np.testing.assert_array_equal(load_labels(str(data_dir)), [3, 0, 39, 3])
+
+
+def test_stale_cache_is_rebuilt(data_dir):
+    write_labels(data_dir, [1, 2])
+    np.testing.assert_array_equal(load_labels(str(data_dir)), [1, 2])
+
+    # a newer csv than its .npy
+    write_labels(data_dir, [5, 6, 7])
+    cache_time = os.path.getmtime(data_dir / "arxiv" / "raw" / "node-label.npy")
+    os.utime(data_dir / "arxiv" / "raw" / "node-label.csv", (cache_time + 10, cache_time + 10))
+    np.testing.assert_array_equal(load_labels(str(data_dir)), [5, 6, 7])
+    np.testing.assert_array_equal(np.load(data_dir / "arxiv" / "raw" / "node-label.npy"), [5, 6, 7])
+
+
+def test_missing_mapping(data_dir):
+    with pytest.raises(FileNotFoundError):
+        load_paper_ids(str(data_dir))
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+import instrumentation
+import parse_mag
+from parse_mag import iter_rows, resolve_input, join_ids, join_block, iter_blocks, id_index, _concat_results
+from ogbn_arxiv import load_paper_ids
+
+# the MAG dump readers against plain line loops: python3 -m pytest test_parse_mag.py
+
+
+def read_lines(path):
+    with open(path) as fh:
+        return [line for line in fh]
+
+
+# the serial path counts in batches of UPDATE_LINES, the counts add up to the worker path's
+def test_iter_rows_counts(synthetic_dir, monkeypatch):
+    monkeypatch.setattr(parse_mag, "UPDATE_LINES", 7)
+    path = resolve_input(synthetic_dir, "papers.txt")
+    wanted = set(load_paper_ids(synthetic_dir).astype(str).tolist())
+    lines = read_lines(path)
+    expected = [line.rstrip("\n").split("\t") for line in lines if line.split("\t")[0] in wanted]
+
+    for workers in [1, 2]:
+        stage = instrumentation.Stage("papers")
+        assert list(iter_rows(path, wanted, workers, stage)) == expected
+        assert (stage.rows_read, stage.rows_kept, stage.bytes_read) == (
+            len(lines), len(expected), sum(len(line) for line in lines)
+        )
+
+
+# positions in paper_ids of the papers of every reference with both papers among them, or the
+# position and row of every author line of those papers, in file order
+def loop_join(path, kind, paper_ids):
+    position = {str(paper_id): idx for idx, paper_id in enumerate(paper_ids)}
+    papers, other = [], []
+    for line in read_lines(path):
+        row = line.rstrip("\n").split("\t")
+        if row[0] not in position:
+            continue
+        if kind == "references":
+            if row[1] in position:
+                papers.append(position[row[0]])
+                other.append(position[row[1]])
+        else:
+            papers.append(position[row[0]])
+            other.append(row)
+    return papers, other
+
+
+@pytest.fixture(scope="module")
+def joined_ids(synthetic_dir):
+    # a shuffled subset, so positions differ from file order and some rows are dropped
+    paper_ids = load_paper_ids(synthetic_dir)
+    return np.random.default_rng(0).permutation(paper_ids)[: 2 * len(paper_ids) // 3]
+
+
+@pytest.mark.parametrize("kind,name", [("references", "paperReferences.txt"), ("authors", "paperAuthorAffilliations.txt")])
+def test_join_ids(synthetic_dir, joined_ids, kind, name):
+    path = resolve_input(synthetic_dir, name)
+    papers, other = loop_join(path, kind, joined_ids)
+    assert len(papers) > 0
+
+    def as_lists(result):
+        return result[0].tolist(), result[1].tolist() if kind == "references" else result[1]
+
+    for workers in [1, 2]:
+        assert as_lists(join_ids(path, kind, joined_ids, workers)) == (papers, other)
+    # blocks much smaller than the lines, which then end in the middle of the block
+    index = id_index(joined_ids)
+    results = [join_block(kind, data, index)[0] for data in iter_blocks(path, block_size=50)]
+    assert as_lists(_concat_results(kind, results)) == (papers, other)
+
+
+# the last line may lack its newline
+def test_join_ids_without_final_newline(tmp_path):
+    path = str(tmp_path / "paperReferences.txt")
+    with open(path, "w") as fh:
+        fh.write("1\t2\n3\t1\n2\t5\n3\t2")
+    source, target = join_ids(path, "references", [3, 2, 1])
+    assert (source.tolist(), target.tolist()) == ([2, 0, 0], [1, 2, 1])
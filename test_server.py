@@ -0,0 +1,69 @@
+import os
+import shutil
+import threading
+import time
+import urllib.error
+
+import pytest
+
+import analysis
+import server
+from corpus_store import CorpusStore, store_path
+
+# the query server on the synthetic corpus: python3 -m pytest test_server.py
+
+
+@pytest.fixture(scope="module")
+def url(synthetic_dir, data, tmp_path_factory):
+    data_dir = str(tmp_path_factory.mktemp("served"))
+    CorpusStore.from_data(data).save(store_path(data_dir))
+    shutil.copy(os.path.join(synthetic_dir, "affiliation_type_raw.pkl"), data_dir)
+    started = threading.Event()
+    servers = []
+
+    def ready(http_server):
+        servers.append(http_server)
+        started.set()
+
+    thread = threading.Thread(target=server.serve, args=(data_dir, "localhost", 0, 4, ready), daemon=True)
+    thread.start()
+    assert started.wait(60)
+    yield f"http://localhost:{servers[0].server_port}"
+    servers[0].shutdown()
+    thread.join(10)
+
+
+def status(url, operation, **params):
+    try:
+        server.query(url, operation, **params)
+        return 200
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_bad_queries(url, top_fields):
+    assert status(url, "top_institutions", fields=top_fields, top=5) == 200
+    assert status(url, "top_institutions", fields=["Nope"]) == 400
+    assert status(url, "group_citations", fields=[top_fields[0], "Nope"]) == 400
+    assert status(url, "top_institutions", rank_by="bogus") == 400
+    assert status(url, "top_institutions", top="x") == 400
+
+
+# requests arriving together build a matrix kept on the store once
+def test_concurrent_requests_build_a_matrix_once(store, monkeypatch):
+    calls = []
+
+    def slow_year_citation_tensor(data):
+        calls.append(data)
+        time.sleep(0.2)
+        return "tensor"
+
+    monkeypatch.setattr(analysis, "_year_citation_tensor", slow_year_citation_tensor)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(analysis.year_citation_tensor(store))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["tensor"] * 4
+    assert len(calls) == 1
@@ -0,0 +1,74 @@
+import os
+import struct
+
+import zstandard
+
+import unpack_zst
+from unpack_zst import frame_offsets, SKIPPABLE_MAGIC, ZSTD_MAGIC
+
+# multi-frame decompression against the sequential stream: python3 -m pytest test_unpack_zst.py
+
+
+def lines(start, count):
+    return "".join(f"{i}\t{i * 7}\tpaper {i}\n" for i in range(start, start + count)).encode()
+
+
+# frame of a single RLE block (one byte repeated size < 256 times), zstandard itself doesn't write them
+def rle_frame(byte, size):
+    # single segment frame with a one byte content size, then the last block, of type RLE
+    header = 1 | (1 << 1) | (size << 3)
+    return struct.pack("<I", ZSTD_MAGIC) + bytes([0x20, size]) + header.to_bytes(3, "little") + byte
+
+
+# frames with and without a content size and a checksum, a skippable frame between them and an
+# RLE block frame
+def multi_frame_archive():
+    chunks = [lines(0, 2000), lines(2000, 3000), b"x" * 200, lines(5000, 10)]
+    compressor = zstandard.ZstdCompressor(write_content_size=False).compressobj()
+    frames = [
+        zstandard.ZstdCompressor(write_checksum=True).compress(chunks[0]),
+        compressor.compress(chunks[1]) + compressor.flush(),
+        rle_frame(b"x", 200),
+        zstandard.ZstdCompressor(level=19).compress(chunks[3]),
+    ]
+    assert zstandard.frame_content_size(frames[1]) == -1
+    skippable = struct.pack("<II", SKIPPABLE_MAGIC + 3, 5) + b"12345"
+    return frames, skippable, b"".join(chunks)
+
+
+def test_frame_offsets():
+    frames, skippable, _ = multi_frame_archive()
+    buffer = frames[0] + skippable + b"".join(frames[1:])
+    bounds, position = [], 0
+    for k, frame in enumerate(frames):
+        position += len(skippable) if k == 1 else 0
+        bounds.append((position, position + len(frame)))
+        position += len(frame)
+    assert frame_offsets(buffer) == bounds
+    # not a zstd archive, or cut off within a frame
+    assert frame_offsets(b"not zstd") is None
+    assert frame_offsets(buffer[:-3]) is None
+
+
+def test_threaded_output_matches_sequential(tmp_path, monkeypatch):
+    decompressed_frames = []
+    decompress_frame = unpack_zst._decompress_frame
+
+    def recorded(frame):
+        decompressed_frames.append(frame)
+        return decompress_frame(frame)
+
+    monkeypatch.setattr(unpack_zst, "_decompress_frame", recorded)
+    frames, skippable, text = multi_frame_archive()
+    archive = frames[0] + skippable + b"".join(frames[1:])
+    outputs = []
+    for threads in [1, 4]:
+        path = tmp_path / str(threads) / "papers.txt.zst"
+        os.makedirs(path.parent)
+        path.write_bytes(archive)
+        unpack_zst.main(["-f", str(path), "-t", str(threads)])
+        outputs.append((path.parent / "papers.txt").read_bytes())
+    assert outputs[0] == text
+    assert outputs[1] == outputs[0]
+    # only -t 4 split the archive into its frames
+    assert decompressed_frames == frames
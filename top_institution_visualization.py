@@ -1,14 +1,17 @@
-import matplotlib.pyplot as plt
-import networkx as nx
 import numpy as np
-import pickle
 import argparse
-from networkx import MultiDiGraph
 
-from analysis import citation_matrix_institutions
-from affilation_interactions import my_draw_networkx_edge_labels
-from group_affiliations import Paper, PaperAuthor, Affiliation
-from group_affiliations import hardcoded_entries, define_type, mapping_entities
+from analysis import (
+    citation_matrix_institutions,
+    institution_scores,
+    dense_submatrix,
+    load_corpus,
+    add_rank_arguments,
+    add_process_arguments,
+    configure_processes,
+)
+from group_affiliations import get_affiliation_groups, mapping_entities
+import cache
 
 colors = {"node": dict(zip(range(1, 4), ["blue", "green", "red"])),
          "edge": {
@@ -16,34 +19,12 @@ colors = {"node": dict(zip(range(1, 4), ["blue", "green", "red"])),
              (1,3): "green", (3,1): "green", (2,3): "brown", (3,2): "brown"}
          }
 
-def plot(fields=[]):
-    with open("./data/data.pkl", "rb") as f:
-        data = pickle.load(f)
-
-    with open("./data/affiliation_type_raw.pkl", "rb") as f:
-        file = pickle.load(f)
-        idx = np.array(list(file.keys())).astype(int)
-        descriptions = np.array(list(file.values()))
-
-    affiliation_group = []
-    affiliations = np.array([
-        x.name for i, x in enumerate(data["affiliations"].values()) if i in idx
-    ])
-
-    for i in range(len(idx)):
-        affiliation_group.append(define_type(affiliations[i], descriptions[i]))
-    affiliation_group = np.array(affiliation_group)
-
-    # input entries that have been hardcoded (e.g. Intel --> 3)
-    for k, v in hardcoded_entries.items():
-        affiliation_group[np.where(np.isin(idx, v))[0]] = k
-
-    for k, v in mapping_entities.items():
-        print(f"{v.title()} in the top {len(idx)}: {(affiliation_group == k).sum()}")
-
+# citations among the top_k[group] most cited institutions of each affiliation group, and their
+# scores; rank_by (see analysis.RANK_BY) ranks the institutions by PageRank instead
+def top_institution_subgraph(data, idx, affiliation_group, fields=[], top_k={1: 0, 2: 0, 3: 10}, rank_by="citations"):
     cit_inst = citation_matrix_institutions(data, fields=fields)
-    cit_sum = cit_inst.sum(axis=0)
-    cit_inst = cit_inst[idx][:, idx]
+    cit_sum = institution_scores(data, rank_by, fields)
+    cit_inst = dense_submatrix(cit_inst, idx)
     cit_sum = cit_sum[idx]
 
     top_filt_idx = {}
@@ -52,12 +33,32 @@ def plot(fields=[]):
         f_idx = np.where(affiliation_group == k)[0]
         f_idx = f_idx[(-cit_sum[f_idx]).argsort()]
         top_filt_idx[k] = f_idx
-    total_filt_idx = (-cit_sum).argsort()
 
-    top_k = {1: 0, 2: 0, 3: 10}
-    # top_k = {1: 10, 2: 0, 3: 0}
-    top_k_idx = np.concatenate([v[:top_k[k]] for k, v in top_filt_idx.items()])
-    top_cit_inst = cit_inst[top_k_idx][:, top_k_idx]
+    top_k_idx = np.concatenate([v[:top_k.get(k, 0)] for k, v in top_filt_idx.items()])
+    return top_k_idx, cit_inst[top_k_idx][:, top_k_idx], cit_sum[top_k_idx]
+
+
+def plot(fields=[], data_dir="./data", server=None, rank_by="citations"):
+    import networkx as nx
+    from network_drawing import new_figure, cached_layout, draw_edges
+
+    if server:
+        from server import query
+        result = query(server, "top_institution_subgraph", fields=fields, rank_by=rank_by)
+        affiliations = np.array(result["affiliations"])
+        affiliation_group = np.array(result["affiliation_group"])
+        top_k_idx = np.array(result["top_k_idx"], dtype=int)
+        top_cit_inst = np.array(result["citations"])
+        size = np.array(result["cited"])
+    else:
+        data = load_corpus(data_dir, fields)
+        idx, affiliations, affiliation_group = get_affiliation_groups(data_dir, data)
+        affiliations = np.array(affiliations)
+        top_k_idx, top_cit_inst, size = top_institution_subgraph(data, idx, affiliation_group, fields, rank_by=rank_by)
+
+    for k, v in mapping_entities.items():
+        print(f"{v.title()} in the top {len(affiliation_group)}: {(affiliation_group == k).sum()}")
+
     top_cit_inst_n = 3.0*top_cit_inst/top_cit_inst.max()
     proportion = top_cit_inst / np.sum(top_cit_inst, axis=1).reshape(-1, 1)
     edge_weights = top_cit_inst_n
@@ -68,7 +69,6 @@ def plot(fields=[]):
         print(f"{affiliations[top_k_idx[i]]} Citations: {top_cit_inst[:, i].sum()} ({100 * top_cit_inst[:, i].sum() / top_cit_inst.sum():.2f}%)")
         for j in range(top_cit_inst.shape[0]):
             print(f"{affiliations[top_k_idx[i]]} --> {affiliations[top_k_idx[j]]}: {top_cit_inst[i,j]} ({100*proportion[i][j]}%)")
-    size = cit_sum[top_k_idx]
     size = 350*size/size.max()
     #size = 300*np.log(size+1)/np.log(size+1).max()
     node_labels = ['UC Berkeley','CMU','UoftT','Stanford','Univ. of Oxford','Max Planck Society','CAS','Inria','AI2','CIFAR','Google','Microsoft','Facebook','IBM','Huawei','Alcatel-Lucent','Adobe Systems','AT&T','Baidu','OpenAI',]
@@ -76,7 +76,7 @@ def plot(fields=[]):
     # node_labels = ['UC Berkeley', 'UoftT', 'UofOxford', 'CMU', 'Stanford', 'MIT', 'UofAmsterdam', 'UdeMontreal', 'NYU', 'UT Austin']
     node_labels = np.array(affiliations)[top_k_idx].tolist()
 
-    fig, ax = plt.subplots(1, 1, figsize=(8, 8))
+    fig, ax = new_figure(8)
 
     G = nx.MultiDiGraph()
     for i in range(len(top_k_idx)):
@@ -85,7 +85,7 @@ def plot(fields=[]):
     for i, j in zip(*top_cit_inst.nonzero()):
         G.add_edge(i, j, weight=edge_weights[i, j])
 
-    pos = nx.spring_layout(G, 111)
+    pos = cached_layout(G, node_labels, k=111)
 
     nx.draw_networkx_nodes(G,
                            pos,
@@ -93,11 +93,13 @@ def plot(fields=[]):
                            node_color=[colors["node"][k] for k in affiliation_group[top_k_idx]],
                            node_size=size,
                            alpha=0.4,
+                           ax=ax,
                            )
 
-    for edge in G.edges(data='weight'):
-        edge_color = colors["edge"][tuple(affiliation_group[top_k_idx[list(edge[:2])]])]
-        nx.draw_networkx_edges(G, pos, edgelist=[edge], width=edge[2], alpha=1, arrowsize=8, edge_color=edge_color, connectionstyle='arc3, rad = 0.1')
+    edges = list(G.edges(data='weight'))
+    edge_groups = [tuple(affiliation_group[top_k_idx[list(edge[:2])]]) for edge in edges]
+    draw_edges(ax, pos, [e[:2] for e in edges], [e[2] for e in edges], [colors["edge"][g] for g in edge_groups],
+               node_size=size, arrowsize=8, rad=0.1)
 
     for v, k in mapping_entities.items():
         if v == 2:
@@ -110,13 +112,14 @@ def plot(fields=[]):
 
 
     pos_nodes = nudge(pos, 0, -0.1)  # shift the layout
-    nx.draw_networkx_labels(G, pos=pos_nodes, labels=dict(zip(range(len(node_labels)), node_labels)), font_size=12, font_weight="bold")
+    nx.draw_networkx_labels(G, pos=pos_nodes, labels=dict(zip(range(len(node_labels)), node_labels)), font_size=12, font_weight="bold", ax=ax)
 
-    # plt.legend()
+    # ax.legend()
 
-    plt.savefig("top_inst_vis.png")
+    fig.savefig("top_inst_vis.png")
 
-if __name__ == "__main__":
+
+def main(argv=None):
     parser = argparse.ArgumentParser()
 
     # shared parameters
@@ -127,5 +130,15 @@ if __name__ == "__main__":
         help="Directory where data.pkl and affiliation_type_raw.pkl resides",
     )
     parser.add_argument("-f", "--fields", nargs="+", default=[])
-    args = parser.parse_args()
-    plot(args.fields)
\ No newline at end of file
+    parser.add_argument("-s", "--server", default=None, help="URL of a running server.py to query instead")
+    add_rank_arguments(parser)
+    add_process_arguments(parser)
+    cache.add_arguments(parser)
+    args = parser.parse_args(argv)
+    cache.configure_from_args(args)
+    configure_processes(args.processes)
+    plot(args.fields, args.data_dir, args.server, args.rank_by)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,175 @@
 import zstandard
 import pathlib
 import argparse
+import glob
+import mmap
+import os
+import struct
+import threading
+import time
+import collections
+from concurrent.futures import ThreadPoolExecutor
 
-def decompress_zstandard_to_folder(input_file):
+ZSTD_MAGIC = 0xFD2FB528
+# skippable frames use magics 0x184D2A50 - 0x184D2A5F
+SKIPPABLE_MAGIC = 0x184D2A50
+MB = 1024 * 1024
+
+
+# prints MB/s and ETA of one file, measured on the compressed bytes consumed
+class Progress:
+    def __init__(self, name, total_bytes, interval=5.0):
+        self.name = name
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.start = time.time()
+        self.last_report = self.start
+        self.done_bytes = 0
+        self.lock = threading.Lock()
+
+    def update(self, num_bytes):
+        with self.lock:
+            self.done_bytes += num_bytes
+            now = time.time()
+            if now - self.last_report < self.interval:
+                return
+            self.last_report = now
+        self.report()
+
+    def report(self, final=False):
+        elapsed = max(time.time() - self.start, 1e-9)
+        rate = self.done_bytes / elapsed
+        if final:
+            print(f"{self.name}: done, {self.done_bytes / MB:.1f} MB in {elapsed:.1f}s ({rate / MB:.1f} MB/s)", flush=True)
+            return
+        eta = (self.total_bytes - self.done_bytes) / rate if rate > 0 else float("inf")
+        print(f"{self.name}: {self.done_bytes / MB:.1f}/{self.total_bytes / MB:.1f} MB, "
+              f"{rate / MB:.1f} MB/s, ETA {eta:.0f}s", flush=True)
+
+
+# byte ranges of the zstd frames in buffer, or None if it can't be split into frames
+def frame_offsets(buffer):
+    frames = []
+    position = 0
+    size = len(buffer)
+    try:
+        while position < size:
+            magic, = struct.unpack_from("<I", buffer, position)
+            if magic & 0xFFFFFFF0 == SKIPPABLE_MAGIC:
+                skip_size, = struct.unpack_from("<I", buffer, position + 4)
+                position += 8 + skip_size
+                continue
+            if magic != ZSTD_MAGIC:
+                return None
+
+            start = position
+            descriptor = buffer[position + 4]
+            fcs_flag = descriptor >> 6
+            single_segment = (descriptor >> 5) & 1
+            has_checksum = (descriptor >> 2) & 1
+            dict_id_size = [0, 1, 2, 4][descriptor & 3]
+            fcs_size = [single_segment, 2, 4, 8][fcs_flag]
+            position += 5 + (0 if single_segment else 1) + dict_id_size + fcs_size
+
+            while True:
+                header = buffer[position] | (buffer[position + 1] << 8) | (buffer[position + 2] << 16)
+                last_block = header & 1
+                block_type = (header >> 1) & 3
+                block_size = header >> 3
+                if block_type == 3:
+                    return None
+                # RLE blocks store a single byte
+                position += 3 + (1 if block_type == 1 else block_size)
+                if last_block:
+                    break
+            position += 4 if has_checksum else 0
+            if position > size:
+                return None
+            frames.append((start, position))
+    except (IndexError, struct.error):
+        return None
+    return frames
+
+
+def _decompress_frame(frame):
+    # decompressobj also handles frames without a content size in their header
+    return zstandard.ZstdDecompressor().decompressobj().decompress(frame)
+
+
+def _decompress_frames(buffer, frames, destination, threads, progress):
+    # frames are decompressed concurrently and written in order, with a bounded window in flight
+    with ThreadPoolExecutor(threads) as pool:
+        pending = collections.deque()
+        for start, end in frames:
+            pending.append((pool.submit(_decompress_frame, buffer[start:end]), end - start))
+            if len(pending) >= 2 * threads:
+                future, frame_size = pending.popleft()
+                destination.write(future.result())
+                progress.update(frame_size)
+        while pending:
+            future, frame_size = pending.popleft()
+            destination.write(future.result())
+            progress.update(frame_size)
+
+
+def _decompress_stream(compressed, destination, progress, chunk_size=4 * MB):
+    reader = zstandard.ZstdDecompressor().stream_reader(compressed, read_across_frames=True, closefd=False)
+    consumed = 0
+    while True:
+        chunk = reader.read(chunk_size)
+        if not chunk:
+            break
+        destination.write(chunk)
+        position = compressed.tell()
+        progress.update(position - consumed)
+        consumed = position
+
+
+def decompress_zstandard_to_folder(input_file, threads=1, interval=5.0):
     input_file = pathlib.Path(input_file)
+    progress = Progress(input_file.name, os.path.getsize(input_file), interval)
     with open(input_file, 'rb') as compressed:
-        decomp = zstandard.ZstdDecompressor()
         output_path = pathlib.Path(input_file.parent) / input_file.stem
         with open(output_path, 'wb') as destination:
-            decomp.copy_stream(compressed, destination)
+            frames = None
+            if threads > 1 and progress.total_bytes > 0:
+                with mmap.mmap(compressed.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    frames = frame_offsets(buffer)
+                    if frames is not None and len(frames) > 1:
+                        _decompress_frames(buffer, frames, destination, threads, progress)
+            if frames is None or len(frames) <= 1:
+                # single frame archives can only be decompressed sequentially
+                _decompress_stream(compressed, destination, progress)
+    progress.report(final=True)
+    return output_path
 
-if __name__ == "__main__":
+
+# decompress every .zst file in a directory or matching a glob, jobs files at a time
+def decompress_batch(pattern, jobs=4, threads=1, interval=5.0):
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*.zst")
+    files = sorted(glob.glob(pattern))
+    print(f"Decompressing {len(files)} files", flush=True)
+    start = time.time()
+    with ThreadPoolExecutor(jobs) as pool:
+        outputs = list(pool.map(lambda f: decompress_zstandard_to_folder(f, threads, interval), files))
+    print(f"Decompressed {len(files)} files in {time.time() - start:.1f}s", flush=True)
+    return outputs
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument("-f", "--file")
-    args = parser.parse_args()
-    decompress_zstandard_to_folder(args.file)
+    parser.add_argument("-b", "--batch", help="Directory or glob of .zst files to decompress")
+    parser.add_argument("-j", "--jobs", type=int, default=4, help="Number of files decompressed concurrently")
+    parser.add_argument("-t", "--threads", type=int, default=1, help="Threads per file for multi-frame archives")
+    parser.add_argument("-i", "--interval", type=float, default=5.0, help="Seconds between progress reports")
+    args = parser.parse_args(argv)
+    if args.batch:
+        decompress_batch(args.batch, args.jobs, args.threads, args.interval)
+    else:
+        decompress_zstandard_to_folder(args.file, args.threads, args.interval)
+
+
+if __name__ == "__main__":
+    main()